@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from explanation_cache import LRUCache
+from retrieval import tokenize
+
+# Maximum number of answers kept in memory (0 disables the cache)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+
+# Seconds before a cached answer expires
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+
+# Minimum word overlap (Jaccard similarity) for a differently worded question
+# to reuse a cached answer; 1 or more only reuses identical normalized questions
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.9"))
+
+# Questions remembered per document and question type for near-duplicate matching
+NEAR_DUPLICATE_CANDIDATES = 200
+
+# Fewest distinct words, after stopwords, for a question to be matched as a
+# near duplicate; shorter ones like "What is it?" say too little to compare,
+# so they only reuse answers to identical questions
+NEAR_DUPLICATE_MIN_WORDS = 3
+
+_WORD_PATTERN = re.compile(r"[a-z0-9$%]+(?:[-'.,][a-z0-9]+)*")
+
+def normalize_question(question: str) -> str:
+    """
+    Lowercase a question and reduce it to its words, ignoring punctuation and spacing
+    """
+    return " ".join(_WORD_PATTERN.findall(question.lower()))
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b)
+
+class AnswerCache:
+    """
+    Answers keyed on the document, insurance type, question type, personal
+    context and normalized question, with optional near-duplicate matching
+    """
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.enabled = max_size > 0
+        self.similarity = similarity
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._answers = LRUCache(max(max_size, 1), ttl)
+
+        # Recent questions per (document, insurance type, question type, personal
+        # context), used to find near duplicates; bounded like the answers
+        self._candidates = LRUCache(max(max_size, 1), ttl)
+
+    @staticmethod
+    def _scope(document_fingerprint: str, insurance_type: str, question_type: str,
+               personal_context: Dict[str, Any]) -> str:
+        return json.dumps([document_fingerprint, insurance_type.lower(), question_type, personal_context], sort_keys=True)
+
+    @staticmethod
+    def _key(scope: str, question: str) -> str:
+        return hashlib.sha256(f"{scope}\n{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def get(self, document_fingerprint: str, insurance_type: str, question_type: str,
+            personal_context: Dict[str, Any], question: str) -> Optional[str]:
+        """
+        Cached answer for a question or, failing that, for a near-duplicate one
+        """
+        if not self.enabled:
+            return None
+        scope = self._scope(document_fingerprint, insurance_type, question_type, personal_context)
+        answer = self._answers.get(self._key(scope, question))
+        if answer is not None:
+            self.hits += 1
+            return answer
+
+        answer = self._near_duplicate(scope, question) if self.similarity < 1 else None
+        if answer is not None:
+            self.near_hits += 1
+        else:
+            self.misses += 1
+        return answer
+
+    def _near_duplicate(self, scope: str, question: str) -> Optional[str]:
+        words = frozenset(tokenize(question))
+        if len(words) < NEAR_DUPLICATE_MIN_WORDS:
+            return None
+        candidates: Optional[List[Tuple[FrozenSet[str], str]]] = self._candidates.get(scope)
+        if not candidates:
+            return None
+        best_score, best_key = 0.0, None
+        for candidate_words, key in candidates:
+            score = _jaccard(words, candidate_words)
+            if score > best_score:
+                best_score, best_key = score, key
+        if best_key is None or best_score < self.similarity:
+            return None
+        return self._answers.get(best_key)
+
+    def set(self, document_fingerprint: str, insurance_type: str, question_type: str,
+            personal_context: Dict[str, Any], question: str, answer: str) -> None:
+        if not self.enabled:
+            return
+        scope = self._scope(document_fingerprint, insurance_type, question_type, personal_context)
+        key = self._key(scope, question)
+        self._answers.set(key, answer)
+
+        words = frozenset(tokenize(question))
+        if self.similarity < 1 and len(words) >= NEAR_DUPLICATE_MIN_WORDS:
+            candidates = [entry for entry in (self._candidates.get(scope) or []) if entry[1] != key]
+            candidates.append((words, key))
+            self._candidates.set(scope, candidates[-NEAR_DUPLICATE_CANDIDATES:])
+
+    def clear(self) -> None:
+        self._answers.clear()
+        self._candidates.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        answer_stats = self._answers.stats()
+        return {
+            "enabled": self.enabled,
+            "size": answer_stats["size"],
+            "max_size": answer_stats["max_size"],
+            "hits": self.hits,
+            "near_duplicate_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": answer_stats["evictions"]
+        }
+
+_answer_cache: Optional[AnswerCache] = None
+
+def get_answer_cache() -> AnswerCache:
+    """
+    Get the shared answer cache, creating it on first use
+    """
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
@@ -0,0 +1,187 @@
+"""
+Process many policy documents at once.
+
+Documents are extracted and scanned for terms in the worker pool, a few at a
+time, and share the explanation cache, so terms common to a set of policies
+are explained once. Results are produced as NDJSON, one line per document in
+the order documents finish; a document that fails gets an error line and does
+not stop the rest of the batch.
+
+Usage:
+    python batch.py policies/ --insurance-type health --output results.ndjson
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from explanation_generator import explain_term_store
+from metrics import record_document
+from pipeline import extract_and_identify_pdf, identify_text_file
+from session_store import get_session_store
+from term_store import JSON_FORMATS, TermStore
+from worker_pool import run_cpu_bound_when_free, cpu_pool_enabled, shutdown_executor
+
+# Documents processed at the same time within one batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Maximum number of documents accepted in one batch request
+BATCH_MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", "200"))
+
+# File extensions picked up when a directory is given
+BATCH_EXTENSIONS = (".pdf", ".txt")
+
+class BatchDocument(NamedTuple):
+    name: str
+    path: str
+    is_pdf: bool
+    # Temporary files, such as spooled uploads, are deleted once processed
+    temporary: bool = False
+
+def collect_documents(paths: List[str]) -> List[BatchDocument]:
+    """
+    Documents for a list of files and directories, expanding each directory
+    to the PDF and text files directly inside it
+    """
+    documents = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path) if name.lower().endswith(BATCH_EXTENSIONS))
+            files = [os.path.join(path, name) for name in names]
+        else:
+            files = [path]
+        for file_path in files:
+            documents.append(BatchDocument(file_path, file_path, file_path.lower().endswith(".pdf")))
+    return documents
+
+def _remove(document: BatchDocument) -> None:
+    if document.temporary:
+        try:
+            os.remove(document.path)
+        except OSError:
+            pass
+
+async def process_batch_document(document: BatchDocument, insurance_type: str,
+                                 create_session: bool = True) -> Dict[str, Any]:
+    """
+    Extract, identify and explain one document of a batch
+    """
+    func = extract_and_identify_pdf if document.is_pdf else identify_text_file
+    if cpu_pool_enabled():
+        # Wait for an unreserved worker so a large batch leaves room for interactive requests
+        text, store = await run_cpu_bound_when_free(func, document.path, insurance_type)
+    else:
+        text, store = await asyncio.get_running_loop().run_in_executor(None, func, document.path, insurance_type)
+
+    await explain_term_store(store, insurance_type)
+    record_document("batch", text, len(store))
+
+    result: Dict[str, Any] = {"text": text, "terms": store}
+    if create_session:
+        session = get_session_store().create(text, insurance_type, store)
+        result["document_id"] = session.document_id
+        result["version"] = session.version
+    return result
+
+def format_result_line(index: int, document: BatchDocument, result: Dict[str, Any],
+                       response_format: str, include_text: bool) -> str:
+    """
+    One NDJSON line for a processed document
+    """
+    store: TermStore = result["terms"]
+    fields = {"index": index, "name": document.name, "status": "ok"}
+    if "document_id" in result:
+        fields["document_id"] = result["document_id"]
+        fields["version"] = result["version"]
+    fields["term_count"] = len(store)
+    fields["response_format"] = response_format
+    if include_text:
+        fields["original_text"] = result["text"]
+    # Splice the streamed terms JSON into the line rather than re-encoding it
+    return json.dumps(fields)[:-1] + ', "terms": ' + "".join(store.iter_json(response_format)) + "}\n"
+
+def format_error_line(index: int, document: BatchDocument, error: str) -> str:
+    return json.dumps({"index": index, "name": document.name, "status": "error", "error": error}) + "\n"
+
+async def process_batch(documents: List[BatchDocument], insurance_type: str, response_format: str = "compact",
+                        include_text: bool = False, concurrency: int = BATCH_CONCURRENCY,
+                        create_sessions: bool = True) -> AsyncIterator[Tuple[bool, str]]:
+    """
+    Process documents concurrently, yielding (succeeded, NDJSON line) for each
+    as it finishes. Lines carry the document's index in the batch.
+    """
+    if response_format not in JSON_FORMATS:
+        raise ValueError(f"Unknown response format: {response_format}")
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def run(index: int, document: BatchDocument) -> Tuple[bool, str]:
+        async with semaphore:
+            try:
+                result = await process_batch_document(document, insurance_type, create_sessions)
+                return True, format_result_line(index, document, result, response_format, include_text)
+            except Exception as e:
+                print(f"Batch document {document.name} failed: {e}", file=sys.stderr)
+                return False, format_error_line(index, document, str(e) or type(e).__name__)
+            finally:
+                _remove(document)
+
+    tasks = [asyncio.ensure_future(run(index, document)) for index, document in enumerate(documents)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        # Stop documents still in progress if the consumer stopped early,
+        # e.g. because a client disconnected
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for document in documents:
+            _remove(document)
+
+async def _run_cli(args: argparse.Namespace) -> int:
+    documents = collect_documents(args.paths)
+    if not documents:
+        print("No documents found", file=sys.stderr)
+        return 1
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    failed = 0
+    try:
+        async for succeeded, line in process_batch(documents, args.insurance_type, args.format, args.include_text,
+                                                   args.concurrency, create_sessions=False):
+            output.write(line)
+            output.flush()
+            if not succeeded:
+                failed += 1
+    finally:
+        if args.output:
+            output.close()
+
+    print(f"Processed {len(documents)} documents, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Process a batch of insurance policy documents")
+    parser.add_argument("paths", nargs="+", help="PDF or text files, or directories containing them")
+    parser.add_argument("--insurance-type", required=True, help="Insurance type of the documents, e.g. health")
+    parser.add_argument("--format", choices=JSON_FORMATS, default="compact", help="Terms format (default: compact)")
+    parser.add_argument("--include-text", action="store_true", help="Include each document's extracted text")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY,
+                        help=f"Documents processed at the same time (default: {BATCH_CONCURRENCY})")
+    parser.add_argument("--output", help="Write NDJSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    try:
+        status = asyncio.run(_run_cli(args))
+    finally:
+        shutdown_executor()
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
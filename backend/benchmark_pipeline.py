@@ -0,0 +1,180 @@
+"""
+Benchmark the document pipeline on synthetic policies.
+
+Synthetic policies are built by scaling up sample_health_policy.txt to each
+requested size, with terms specific to each insurance type mixed in. LLM
+explanations use the mock path, so the benchmark runs offline.
+
+Usage:
+    python benchmark_pipeline.py --sizes 1KB,100KB,1MB --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+# Keep LLM calls and the on-disk explanation cache out of the measurements
+os.environ["OPENAI_API_KEY"] = ""
+os.environ["EXPLANATION_CACHE_PATH"] = ""
+
+from benchmark_stats import percentile
+from document_processor import clean_text, split_into_sections
+from glossary import get_glossary
+from term_identifier import identify_terms, identify_terms_compact, identify_complex_terms
+from explanation_generator import generate_explanations
+
+SAMPLE_POLICY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample_health_policy.txt")
+
+DEFAULT_SIZES = "1KB,10KB,100KB,1MB,10MB"
+DEFAULT_TYPES = "health,life,disability"
+
+def parse_size(size: str) -> int:
+    """
+    Parse a size such as 512, 10KB or 1MB into bytes
+    """
+    size = size.strip().upper()
+    for suffix, factor in (("MB", 1024 * 1024), ("KB", 1024), ("B", 1)):
+        if size.endswith(suffix):
+            return int(float(size[:-len(suffix)]) * factor)
+    return int(size)
+
+def format_size(size_bytes: int) -> str:
+    if size_bytes >= 1024 * 1024:
+        return f"{size_bytes / (1024 * 1024):g}MB"
+    if size_bytes >= 1024:
+        return f"{size_bytes / 1024:g}KB"
+    return f"{size_bytes}B"
+
+def generate_policy(insurance_type: str, size_bytes: int, seed: int = 0) -> str:
+    """
+    Build a synthetic policy of about size_bytes by repeating the sample policy
+    with varied amounts and insurance-type specific provisions
+    """
+    rng = random.Random(f"{insurance_type}-{size_bytes}-{seed}")
+    with open(SAMPLE_POLICY_PATH, encoding="utf-8") as policy_file:
+        base = policy_file.read()
+    type_terms = get_glossary().type_terms(insurance_type)
+
+    parts: List[str] = []
+    length = 0
+    schedule = 1
+    while length < size_bytes:
+        provisions = [
+            f"SCHEDULE {schedule}: The {term} provision pays {rng.randint(50, 100)}% of covered amounts "
+            f"up to ${rng.randint(1, 500) * 100:,} after {rng.randint(1, 180)} days, "
+            f"subject to the limitations of this Policy."
+            for term in rng.sample(type_terms, min(3, len(type_terms)))
+        ]
+        block = base + "\n\n" + "\n".join(provisions) + "\n\n"
+        parts.append(block)
+        length += len(block)
+        schedule += 1
+
+    return "".join(parts)[:size_bytes]
+
+def measure(stage: Callable[[], Any], repeat: int, size_bytes: int) -> Dict[str, Any]:
+    """
+    Time a stage over several runs, then measure its peak memory in one more run
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage()
+        timings.append(time.perf_counter() - start)
+
+    # Tracing slows execution down, so memory is measured in a separate run
+    tracemalloc.start()
+    stage()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    median = percentile(timings, 50)
+    return {
+        "runs": repeat,
+        "p50_ms": median * 1000,
+        "p90_ms": percentile(timings, 90) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "min_ms": min(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+        "throughput_mb_s": (size_bytes / (1024 * 1024)) / median if median > 0 else None,
+        "peak_memory_bytes": peak_bytes
+    }
+
+def benchmark_document(insurance_type: str, size_bytes: int, repeat: int) -> Dict[str, Any]:
+    """
+    Benchmark every pipeline stage on one synthetic policy
+    """
+    text = generate_policy(insurance_type, size_bytes)
+    identified_terms = identify_terms(text, insurance_type)
+
+    stages = {
+        "clean_text": lambda: clean_text(text),
+        "split_into_sections": lambda: split_into_sections(text),
+        "identify_terms": lambda: identify_terms(text, insurance_type),
+        "identify_terms_compact": lambda: identify_terms_compact(text, insurance_type),
+        "identify_complex_terms": lambda: identify_complex_terms(text, insurance_type),
+        "generate_explanations": lambda: generate_explanations(identified_terms, insurance_type)
+    }
+
+    return {
+        "insurance_type": insurance_type,
+        "size": format_size(size_bytes),
+        "size_bytes": len(text.encode("utf-8")),
+        "term_count": len(identified_terms),
+        "stages": {name: measure(stage, repeat, size_bytes) for name, stage in stages.items()}
+    }
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    print(f"{'type':<11}{'size':>7}  {'stage':<24}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'MB/s':>9}{'peak MB':>9}",
+          file=sys.stderr)
+    for result in results:
+        for name, stats in result["stages"].items():
+            throughput = stats["throughput_mb_s"]
+            print(
+                f"{result['insurance_type']:<11}{result['size']:>7}  {name:<24}"
+                f"{stats['p50_ms']:>10.2f}{stats['p90_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+                f"{throughput if throughput is not None else float('nan'):>9.2f}"
+                f"{stats['peak_memory_bytes'] / (1024 * 1024):>9.2f}",
+                file=sys.stderr
+            )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the InsurSpeak document pipeline")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated document sizes (default: {DEFAULT_SIZES})")
+    parser.add_argument("--types", default=DEFAULT_TYPES, help=f"Comma-separated insurance types (default: {DEFAULT_TYPES})")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage (default: 5)")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    insurance_types = [insurance_type.strip() for insurance_type in args.types.split(",") if insurance_type.strip()]
+
+    results = []
+    for insurance_type in insurance_types:
+        for size_bytes in sizes:
+            print(f"Benchmarking {insurance_type} policy, {format_size(size_bytes)}...", file=sys.stderr)
+            results.append(benchmark_document(insurance_type, size_bytes, args.repeat))
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results
+    }
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
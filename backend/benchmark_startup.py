@@ -0,0 +1,161 @@
+"""
+Benchmark cold start: import time of the API and latency of the first requests.
+
+Each run starts a fresh interpreter, imports main, runs the startup handlers
+and sends a first text document, question and (optionally) PDF. LLM
+explanations use the mock path and the document and explanation caches are
+disabled, so the benchmark runs offline and measures real work. Heavy
+dependencies that are loaded by the import alone are reported, since they
+should only be loaded on first use.
+
+Usage:
+    python benchmark_startup.py --repeat 5 --pdf policy.pdf --max-import-ms 2000
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmark_stats import percentile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that should not be loaded just by importing the API
+HEAVY_MODULES = ("PyPDF2", "pdfplumber", "pdfminer", "httpx", "aiofiles")
+
+# Runs in a fresh interpreter and prints its measurements as JSON
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+measurements = {"import_ms": (time.perf_counter() - start) * 1000}
+measurements["eager_modules"] = sorted(name for name in HEAVY_MODULES if name in sys.modules)
+
+from fastapi.testclient import TestClient
+client = TestClient(main.app)
+start = time.perf_counter()
+client.__enter__()
+measurements["startup_ms"] = (time.perf_counter() - start) * 1000
+
+def timed_request(name, *args, **kwargs):
+    start = time.perf_counter()
+    response = client.post(*args, **kwargs)
+    response.raise_for_status()
+    measurements[name] = (time.perf_counter() - start) * 1000
+    return response
+
+response = timed_request("first_text_request_ms", "/process-document",
+                         data={"text_content": TEXT, "insurance_type": "health"})
+timed_request("first_question_ms", "/ask-question",
+              data={"question": "Is physical therapy covered?", "document_id": response.json()["document_id"]})
+if PDF_PATH:
+    with open(PDF_PATH, "rb") as pdf_file:
+        timed_request("first_pdf_request_ms", "/process-document",
+                      files={"file": ("policy.pdf", pdf_file, "application/pdf")}, data={"insurance_type": "health"})
+client.__exit__(None, None, None)
+print(json.dumps(measurements))
+"""
+
+def run_probe(text: str, pdf_path: Optional[str], use_artifact: bool) -> Dict[str, Any]:
+    """
+    Measure one cold start in a fresh interpreter
+    """
+    env = dict(os.environ)
+    # Keep LLM calls and caches that persist between runs out of the measurements
+    env.update({
+        "OPENAI_API_KEY": "",
+        "EXPLANATION_CACHE_PATH": "",
+        "DOCUMENT_CACHE_SIZE": "0",
+        "DOCUMENT_CACHE_DIR": "",
+        "SESSION_BACKEND": "memory"
+    })
+    if not use_artifact:
+        env["GLOSSARY_ARTIFACT_PATH"] = ""
+
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\nTEXT = {text!r}\nPDF_PATH = {pdf_path!r}\n{_PROBE}"
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env,
+                               capture_output=True, text=True, check=False)
+    total_ms = (time.perf_counter() - start) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{completed.stderr}")
+
+    measurements = json.loads(completed.stdout.strip().splitlines()[-1])
+    measurements["process_ms"] = total_ms
+    return measurements
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    metrics = [name for name in runs[0] if name.endswith("_ms")]
+    return {
+        name: {
+            "p50_ms": percentile([run[name] for run in runs], 50),
+            "min_ms": min(run[name] for run in runs),
+            "max_ms": max(run[name] for run in runs)
+        }
+        for name in metrics
+    }
+
+def print_table(summary: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'measurement':<24}{'p50 ms':>10}{'min ms':>10}{'max ms':>10}", file=sys.stderr)
+    for name, stats in summary.items():
+        print(f"{name[:-len('_ms')]:<24}{stats['p50_ms']:>10.1f}{stats['min_ms']:>10.1f}{stats['max_ms']:>10.1f}",
+              file=sys.stderr)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark InsurSpeak API cold start")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh processes to measure (default: 5)")
+    parser.add_argument("--pdf", help="Also time a first PDF upload of this file")
+    parser.add_argument("--no-artifact", action="store_true", help="Compile the glossary instead of loading its artifact")
+    parser.add_argument("--max-import-ms", type=float, help="Fail if the median import time exceeds this")
+    parser.add_argument("--max-first-request-ms", type=float, help="Fail if the median first text request exceeds this")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    with open(os.path.join(BACKEND_DIR, "..", "sample_health_policy.txt"), encoding="utf-8") as policy_file:
+        text = policy_file.read()
+    pdf_path = os.path.abspath(args.pdf) if args.pdf else None
+
+    runs = []
+    for run in range(args.repeat):
+        print(f"Cold start {run + 1} of {args.repeat}...", file=sys.stderr)
+        runs.append(run_probe(text, pdf_path, not args.no_artifact))
+    summary = summarize(runs)
+    eager_modules = sorted({name for run in runs for name in run["eager_modules"]})
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "glossary_artifact": not args.no_artifact,
+        "eager_modules": eager_modules,
+        "summary": summary,
+        "runs": runs
+    }
+
+    print_table(summary)
+    if eager_modules:
+        print(f"Loaded at import: {', '.join(eager_modules)}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+    failures = []
+    if args.max_import_ms is not None and summary["import_ms"]["p50_ms"] > args.max_import_ms:
+        failures.append(f"import took {summary['import_ms']['p50_ms']:.0f} ms (limit {args.max_import_ms:g} ms)")
+    if args.max_first_request_ms is not None and summary["first_text_request_ms"]["p50_ms"] > args.max_first_request_ms:
+        failures.append(f"first request took {summary['first_text_request_ms']['p50_ms']:.0f} ms "
+                        f"(limit {args.max_first_request_ms:g} ms)")
+    if failures:
+        print("Regression: " + "; ".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
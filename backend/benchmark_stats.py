@@ -0,0 +1,14 @@
+"""
+Statistics shared by the benchmark scripts. Kept free of imports from the
+application so each benchmark only loads what it measures.
+"""
+import math
+from typing import List
+
+def percentile(samples: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of samples
+    """
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
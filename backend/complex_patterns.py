@@ -0,0 +1,149 @@
+"""
+Registry of the patterns used to find complex terms: percentages, amounts,
+time periods, legal clauses and patterns registered for one insurance type,
+such as benefit percentages and elimination periods for disability policies.
+
+The patterns that apply to an insurance type are compiled once into a single
+alternation with a named group per pattern, so a document is scanned in one
+pass however many patterns there are. Register patterns at import time so
+pool worker processes see them too.
+"""
+import os
+import re
+import threading
+from typing import Dict, Iterator, List, NamedTuple, Optional, Pattern, Set, Tuple
+
+# Maximum length of a legal clause, from its opening words to the period ending it
+COMPLEX_CLAUSE_MAX_CHARS = int(os.getenv("COMPLEX_CLAUSE_MAX_CHARS", "1000"))
+
+class ComplexPattern(NamedTuple):
+    category: str
+    pattern: str
+    # Characters a match can start with, as the inside of a regex character
+    # set; when every pattern gives them the scan skips all other positions
+    first_chars: Optional[str] = None
+    # For clauses: the pattern matches the opening words and the match is
+    # extended through the next occurrence of this character
+    clause_end: Optional[str] = None
+
+class PatternRegistry:
+    """
+    Complex term patterns shared by all insurance types or registered for one,
+    compiled per insurance type on first use
+    """
+
+    def __init__(self, clause_max_chars: int = COMPLEX_CLAUSE_MAX_CHARS):
+        self.clause_max_chars = clause_max_chars
+        self._patterns: Dict[str, List[ComplexPattern]] = {}
+        self._compiled: Dict[str, Tuple[Pattern, List[ComplexPattern]]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, category: str, pattern: str, insurance_type: Optional[str] = None,
+                 first_chars: Optional[str] = None, clause_end: Optional[str] = None) -> None:
+        """
+        Add a pattern, for every insurance type or only for one. Patterns are
+        matched case-insensitively and must not use numbered backreferences.
+        Where several patterns match at the same position the first one wins,
+        and patterns for an insurance type come before the shared ones.
+        """
+        # Fail on the caller's pattern rather than on the combined one
+        re.compile(pattern, re.IGNORECASE)
+        with self._lock:
+            self._patterns.setdefault((insurance_type or "").lower(), []).append(
+                ComplexPattern(category, pattern, first_chars, clause_end)
+            )
+            self._compiled.clear()
+
+    def patterns(self, insurance_type: Optional[str] = None) -> List[ComplexPattern]:
+        """
+        The patterns that apply to an insurance type, in matching order
+        """
+        key = (insurance_type or "").lower()
+        with self._lock:
+            own = self._patterns.get(key, []) if key else []
+            return own + self._patterns.get("", [])
+
+    def value_categories(self) -> Set[str]:
+        """
+        Categories of the patterns that match a value, such as an amount or a
+        period, rather than a clause
+        """
+        with self._lock:
+            return {pattern.category for patterns in self._patterns.values() for pattern in patterns
+                    if not pattern.clause_end}
+
+    def compiled(self, insurance_type: Optional[str] = None) -> Tuple[Pattern, List[ComplexPattern]]:
+        """
+        The combined regex for an insurance type, with the pattern behind
+        each group: group "p3" is patterns[3]
+        """
+        key = (insurance_type or "").lower()
+        # Types without patterns of their own share the combined regex
+        if key not in self._patterns:
+            key = ""
+        entry = self._compiled.get(key)
+        if entry is None:
+            patterns = self.patterns(key)
+            alternation = "|".join(f"(?P<p{index}>{pattern.pattern})" for index, pattern in enumerate(patterns))
+            if patterns and all(pattern.first_chars for pattern in patterns):
+                guard = "".join(pattern.first_chars for pattern in patterns)
+                alternation = f"(?=[{guard}])(?:{alternation})"
+            # Never matches when no patterns apply
+            entry = (re.compile(alternation or "(?!)", re.IGNORECASE), patterns)
+            with self._lock:
+                self._compiled[key] = entry
+        return entry
+
+    def finditer(self, document_text: str, insurance_type: Optional[str] = None) -> Iterator[Tuple[int, int, str]]:
+        """
+        Find (start, end, category) of complex terms and clauses in one pass,
+        in document order. A pattern's matches never overlap each other. Only
+        the opening words of a clause are consumed by the scan, so amounts
+        and periods inside a legal clause are found as well.
+        """
+        combined, patterns = self.compiled(insurance_type)
+        pattern_ends = [0] * len(patterns)
+        for match in combined.finditer(document_text):
+            index = int(match.lastgroup[1:])
+            pattern = patterns[index]
+            start, end = match.span()
+            if start < pattern_ends[index]:
+                continue
+            if pattern.clause_end:
+                stop = document_text.find(pattern.clause_end, end, start + self.clause_max_chars)
+                if stop < 0:
+                    continue
+                end = stop + len(pattern.clause_end)
+            pattern_ends[index] = end
+            yield start, end, pattern.category
+
+registry = PatternRegistry()
+
+# Numbers with percentage
+registry.register("percentage", r"\b\d+(?:\.\d+)?%", first_chars=r"\d")
+
+# Dollar amounts
+registry.register("monetary", r"\$\s*\d+(?:,\d{3})*(?:\.\d{2})?", first_chars=r"\$")
+
+# Time periods
+registry.register("time_period", r"\b\d+\s+(?:day|week|month|year)s?\b", first_chars=r"\d")
+
+# Complex clauses often starting with certain words
+registry.register("legal_clause", r"\b(?:provided that|subject to|notwithstanding|whereas)\b",
+                  first_chars="psnw", clause_end=".")
+
+# Share of earnings paid as a disability benefit, e.g. "60% of your pre-disability earnings"
+registry.register("benefit_percentage",
+                  r"\b\d+(?:\.\d+)?%\s+of\s+(?:your\s+|the\s+insured's\s+)?"
+                  r"(?:(?:pre-disability|basic|monthly|covered|annual)\s+)*(?:earnings|salary|income|pay)\b",
+                  insurance_type="disability", first_chars=r"\d")
+
+# Days before disability benefits begin, e.g. "90-day elimination period" or "elimination period of 90 days"
+registry.register("elimination_period", r"\b\d+[-\s]days?\s+(?:elimination|waiting)\s+period\b",
+                  insurance_type="disability", first_chars=r"\d")
+registry.register("elimination_period", r"\b(?:elimination|waiting)\s+period\s+(?:of\s+)?\d+\s+days\b",
+                  insurance_type="disability", first_chars="ew")
+
+# Share of costs paid by the member, e.g. "20% coinsurance"
+registry.register("coinsurance", r"\b\d+(?:\.\d+)?%\s+(?:coinsurance|co-insurance)\b",
+                  insurance_type="health", first_chars=r"\d")
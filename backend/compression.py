@@ -0,0 +1,89 @@
+import os
+import zlib
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional; without it responses fall back to gzip
+    brotli = None
+
+# Compression level for gzip responses (1-9)
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+
+# Quality for brotli responses (0-11)
+BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick the best content encoding the client accepts: "br", "gzip" or None
+    """
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+def _compressor(encoding: Optional[str], flush_chunks: bool = False) -> Tuple[Callable[[str], bytes], Callable[[], bytes]]:
+    """
+    (compress, finish) functions for a content encoding. With flush_chunks,
+    the output of each chunk can be decoded on its own as soon as it arrives.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        def compress(chunk: str) -> bytes:
+            data = compressor.process(chunk.encode("utf-8"))
+            return data + compressor.flush() if flush_chunks else data
+        return compress, compressor.finish
+    if encoding == "gzip":
+        # wbits of 16 + MAX_WBITS writes a gzip header and trailer
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        def compress(chunk: str) -> bytes:
+            data = compressor.compress(chunk.encode("utf-8"))
+            return data + compressor.flush(zlib.Z_SYNC_FLUSH) if flush_chunks else data
+        return compress, compressor.flush
+    return (lambda chunk: chunk.encode("utf-8")), bytes
+
+def compress_stream(chunks: Iterable[str], encoding: Optional[str]) -> Iterator[bytes]:
+    """
+    Encode and compress a stream of text chunks without buffering the whole body
+    """
+    compress, finish = _compressor(encoding)
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    data = finish()
+    if data:
+        yield data
+
+async def compress_async_stream(chunks: AsyncIterator[str], encoding: Optional[str]) -> AsyncIterator[bytes]:
+    """
+    Like compress_stream, for chunks produced over time, e.g. NDJSON lines.
+    Each chunk is flushed so clients can read it without waiting for the next.
+    """
+    compress, finish = _compressor(encoding, flush_chunks=True)
+    async for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    data = finish()
+    if data:
+        yield data
@@ -0,0 +1,244 @@
+"""
+Content-addressed cache of processed documents.
+
+Finished results, the document text and its explained terms, are stored under
+a hash of the raw upload bytes (or of the normalized text for pasted
+documents), the insurance type and the glossary version. An identical upload
+then skips extraction, term identification and explanation entirely, and
+concurrent requests for the same content share a single computation.
+"""
+import asyncio
+import hashlib
+import os
+import pickle
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from explanation_cache import LRUCache
+from glossary import get_glossary
+from term_store import TermStore
+
+# Maximum number of processed documents kept in memory (0 disables the cache)
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", "100"))
+
+# Directory where processed documents are also kept on disk ("" keeps them in memory only)
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", "document_cache")
+
+# Maximum number of processed documents kept on disk
+DOCUMENT_CACHE_DISK_SIZE = int(os.getenv("DOCUMENT_CACHE_DISK_SIZE", "1000"))
+
+# Seconds before a processed document expires
+DOCUMENT_CACHE_TTL = float(os.getenv("DOCUMENT_CACHE_TTL", "604800"))
+
+# Explanation sources that are placeholders rather than real explanations;
+# results containing them are not cached so a later request can do better
+_PLACEHOLDER_SOURCES = ("mock", "fallback")
+
+ProcessedDocument = Tuple[str, TermStore]
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize pasted text so the same document pasted from different
+    platforms has the same content hash: line endings become "\\n" and
+    trailing whitespace is dropped
+    """
+    return text.replace("\r\n", "\n").replace("\r", "\n").rstrip()
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def is_cacheable(store: TermStore) -> bool:
+    return not any(explanation["source"] in _PLACEHOLDER_SOURCES for explanation in store.explanations)
+
+class DocumentCache:
+    """
+    Processed documents keyed by content, in an in-process LRU in front of an
+    optional directory of pickle files named by key. Each write to the
+    directory sweeps it of expired files and of the oldest ones beyond
+    disk_size.
+    """
+
+    def __init__(self, max_size: int = DOCUMENT_CACHE_SIZE, directory: Optional[str] = DOCUMENT_CACHE_DIR,
+                 ttl: float = DOCUMENT_CACHE_TTL, disk_size: int = DOCUMENT_CACHE_DISK_SIZE):
+        self.enabled = max_size > 0
+        self.ttl = ttl
+        self.directory = directory or None
+        self.disk_size = disk_size
+        self.memory = LRUCache(max(max_size, 1), ttl)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.shared = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        if self.enabled and self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(digest: str, insurance_type: str) -> str:
+        """
+        Cache key for content with the given hash, processed for an insurance
+        type with the current glossary
+        """
+        scope = f"{get_glossary().version}\n{insurance_type.lower()}\n{digest}"
+        return hashlib.sha256(scope.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[ProcessedDocument]:
+        document = self._lookup(key)
+        if document is not None:
+            self.hits += 1
+        elif self.enabled:
+            self.misses += 1
+        return document
+
+    def _lookup(self, key: str) -> Optional[ProcessedDocument]:
+        if not self.enabled:
+            return None
+        document = self.memory.get(key)
+        if document is None and self.directory:
+            document = self._promote(key, self._read(key))
+        return document
+
+    async def _lookup_async(self, key: str) -> Optional[ProcessedDocument]:
+        """
+        Like _lookup, but unpickles from disk in a thread
+        """
+        if not self.enabled:
+            return None
+        document = self.memory.get(key)
+        if document is None and self.directory:
+            loop = asyncio.get_running_loop()
+            document = self._promote(key, await loop.run_in_executor(None, self._read, key))
+        return document
+
+    def _promote(self, key: str, document: Optional[ProcessedDocument]) -> Optional[ProcessedDocument]:
+        if document is not None:
+            self.disk_hits += 1
+            self.memory.set(key, document)
+        return document
+
+    def _read(self, key: str) -> Optional[ProcessedDocument]:
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) < time.time() - self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "rb") as document_file:
+                return pickle.load(document_file)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+
+    def set(self, key: str, document: ProcessedDocument) -> None:
+        if not self.enabled:
+            return
+        self.memory.set(key, document)
+        if self.directory:
+            self._write(key, document)
+
+    def _write(self, key: str, document: ProcessedDocument) -> None:
+        # Write to a temporary file first so readers never see a partial result
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as document_file:
+                pickle.dump(document, document_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error writing document cache entry: {e}")
+        self.sweep()
+
+    def sweep(self) -> None:
+        """
+        Remove expired files from the disk tier, then the oldest ones until
+        at most disk_size are left
+        """
+        cutoff = time.time() - self.ttl
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                modified = os.path.getmtime(path)
+                if modified < cutoff:
+                    os.remove(path)
+                else:
+                    entries.append((modified, path))
+            except OSError:
+                pass
+
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.disk_size)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[ProcessedDocument]]) -> ProcessedDocument:
+        """
+        Get a processed document, or compute and cache it. Concurrent calls
+        for the same key wait for the first one's computation, which carries
+        on even if the request that started it goes away.
+        """
+        document = await self._lookup_async(key)
+        if document is not None:
+            self.hits += 1
+            return document
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            if self.enabled:
+                self.misses += 1
+            task = asyncio.ensure_future(self._compute_and_store(key, compute()))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._computed(key, done))
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(self, key: str, computation: Awaitable[ProcessedDocument]) -> ProcessedDocument:
+        document = await computation
+        if self.enabled and is_cacheable(document[1]):
+            self.memory.set(key, document)
+            if self.directory:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, key, document)
+        return document
+
+    def _computed(self, key: str, task: asyncio.Future) -> None:
+        self._in_flight.pop(key, None)
+        # Mark a failure as seen even if every waiting request went away
+        if not task.cancelled():
+            task.exception()
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith(".pkl"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self) -> Dict[str, Any]:
+        memory_stats = self.memory.stats()
+        return {
+            "enabled": self.enabled,
+            "size": memory_stats["size"],
+            "max_size": memory_stats["max_size"],
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "shared_computations": self.shared,
+            "misses": self.misses,
+            "evictions": memory_stats["evictions"]
+        }
+
+_document_cache: Optional[DocumentCache] = None
+
+def get_document_cache() -> DocumentCache:
+    """
+    Get the shared document cache, creating it on first use
+    """
+    global _document_cache
+    if _document_cache is None:
+        _document_cache = DocumentCache()
+    return _document_cache
@@ -1,36 +1,135 @@
-import PyPDF2
-import pdfplumber
-import io
+import asyncio
+import hashlib
+import mmap
+import os
+import tempfile
 from fastapi import UploadFile
 import re
-from typing import Dict, List, Any
+from typing import AsyncIterator, Dict, Iterator, List, Any, Optional
 
-async def extract_text_from_pdf(file: UploadFile) -> str:
+from section_index import SectionIndex
+from metrics import span, timed
+
+# Size of each chunk read from an upload while spooling it to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+@timed
+async def spool_upload(file: UploadFile, digest: Optional["hashlib._Hash"] = None) -> str:
     """
-    Extract text content from a PDF file
+    Copy an uploaded file to a temporary file chunk by chunk and return its
+    path. If given a hash object, the raw bytes are also fed to it.
     """
-    content = await file.read()
-    
-    # Try with PyPDF2 first
-    pdf_text = ""
+    import aiofiles
+
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
     try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            pdf_text += page.extract_text() + "\n\n"
-    except Exception as e:
-        print(f"PyPDF2 extraction failed: {e}")
-        
-        # Fall back to pdfplumber if PyPDF2 fails
+        async with aiofiles.open(path, "wb") as spool:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if digest is not None:
+                    digest.update(chunk)
+                await spool.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+def iter_pdf_file_pages(path: str) -> Iterator[str]:
+    """
+    Extract text from a PDF on disk one page at a time.
+    
+    The file is memory-mapped rather than read into memory. Pages that PyPDF2
+    cannot extract are retried individually with pdfplumber.
+    """
+    # The PDF libraries are slow to import, so they are only loaded once a
+    # PDF is actually processed
+    import PyPDF2
+    import pdfplumber
+
+    with open(path, "rb") as pdf_file:
         try:
-            with pdfplumber.open(io.BytesIO(content)) as pdf:
-                for page in pdf.pages:
-                    pdf_text += page.extract_text() or "" + "\n\n"
-        except Exception as e2:
-            print(f"pdfplumber extraction failed: {e2}")
+            content = mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
             raise Exception("Failed to extract text from PDF")
-    
-    return pdf_text
+        
+        fallback_pdf = None
+        try:
+            # Try with PyPDF2 first
+            try:
+                pdf_reader = PyPDF2.PdfReader(content)
+                page_count = len(pdf_reader.pages)
+            except Exception as e:
+                print(f"PyPDF2 extraction failed: {e}")
+                pdf_reader = None
+                
+                # Fall back to pdfplumber for the whole file if PyPDF2 cannot open it
+                try:
+                    fallback_pdf = pdfplumber.open(path)
+                    page_count = len(fallback_pdf.pages)
+                except Exception as e2:
+                    print(f"pdfplumber extraction failed: {e2}")
+                    raise Exception("Failed to extract text from PDF")
+            
+            for page_num in range(page_count):
+                page_text = None
+                if pdf_reader is not None:
+                    try:
+                        page_text = pdf_reader.pages[page_num].extract_text()
+                    except Exception as e:
+                        print(f"PyPDF2 extraction failed on page {page_num + 1}: {e}")
+                
+                # Fall back to pdfplumber for this page only
+                if page_text is None:
+                    try:
+                        if fallback_pdf is None:
+                            fallback_pdf = pdfplumber.open(path)
+                        page_text = fallback_pdf.pages[page_num].extract_text() or ""
+                    except Exception as e2:
+                        print(f"pdfplumber extraction failed on page {page_num + 1}: {e2}")
+                        page_text = ""
+                
+                yield page_text + "\n\n"
+        finally:
+            if fallback_pdf is not None:
+                fallback_pdf.close()
+            content.close()
+
+async def iter_pdf_pages(file: UploadFile) -> AsyncIterator[str]:
+    """
+    Extract text from an uploaded PDF, yielding each page's text as soon as it
+    has been parsed. Parsing runs in a worker thread so the event loop stays free.
+    """
+    path = await spool_upload(file)
+    try:
+        async for page_text in aiter_pdf_file_pages(path):
+            yield page_text
+    finally:
+        os.remove(path)
+
+async def aiter_pdf_file_pages(path: str) -> AsyncIterator[str]:
+    """
+    Like iter_pdf_file_pages, parsing each page in a worker thread
+    """
+    loop = asyncio.get_running_loop()
+    pages = iter_pdf_file_pages(path)
+    try:
+        while True:
+            with span("extract_pdf_page"):
+                page_text = await loop.run_in_executor(None, next, pages, None)
+            if page_text is None:
+                break
+            yield page_text
+    finally:
+        pages.close()
+
+async def extract_text_from_pdf(file: UploadFile) -> str:
+    """
+    Extract text content from a PDF file
+    """
+    return "".join([page_text async for page_text in iter_pdf_pages(file)])
 
 def process_document(text: str, insurance_type: str) -> Dict[str, Any]:
     """
@@ -77,36 +176,4 @@ def split_into_sections(text: str) -> List[Dict[str, Any]]:
     """
     # Simple section splitting based on common insurance document patterns
     # In a real implementation, this would be more sophisticated
-    
-    section_headers = [
-        "DEFINITIONS", "COVERAGE", "EXCLUSIONS", "LIMITATIONS", 
-        "BENEFITS", "ELIGIBILITY", "PREMIUMS", "CLAIMS", "GENERAL PROVISIONS"
-    ]
-    
-    # Initialize with the whole document as a single section
-    sections = [{"title": "FULL DOCUMENT", "content": text, "start_index": 0, "end_index": len(text)}]
-    
-    # Find section boundaries
-    for header in section_headers:
-        matches = re.finditer(r'(?i)(?:^|\n)\s*(' + re.escape(header) + r')\s*[:.\n]', text)
-        for match in matches:
-            section_start = match.start()
-            section_title = match.group(1)
-            
-            # Add the section
-            sections.append({
-                "title": section_title,
-                "content": text[section_start:],  # We'll fix the end later
-                "start_index": section_start,
-                "end_index": len(text)  # Temporary
-            })
-    
-    # Sort sections by start position
-    sections.sort(key=lambda x: x["start_index"])
-    
-    # Fix section end positions
-    for i in range(len(sections) - 1):
-        sections[i]["end_index"] = sections[i + 1]["start_index"]
-        sections[i]["content"] = text[sections[i]["start_index"]:sections[i]["end_index"]]
-    
-    return sections
+    return SectionIndex(text).to_dicts()
@@ -0,0 +1,322 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# In-process tier: number of explanations kept in memory
+EXPLANATION_CACHE_SIZE = int(os.getenv("EXPLANATION_CACHE_SIZE", "10000"))
+
+# On-disk tier: SQLite file (empty disables the disk tier) and its size bound
+EXPLANATION_CACHE_PATH = os.getenv("EXPLANATION_CACHE_PATH", "explanation_cache.sqlite3")
+EXPLANATION_CACHE_DISK_SIZE = int(os.getenv("EXPLANATION_CACHE_DISK_SIZE", "200000"))
+
+# Seconds before a cached explanation expires (default 30 days)
+EXPLANATION_CACHE_TTL = float(os.getenv("EXPLANATION_CACHE_TTL", str(30 * 24 * 3600)))
+
+# Disk cache hits buffered before their last-used times are written
+EXPLANATION_CACHE_TOUCH_BATCH = int(os.getenv("EXPLANATION_CACHE_TOUCH_BATCH", "256"))
+
+# Words of context on each side of a term that make its explanation distinct.
+# 0 shares one explanation per term, category and insurance type.
+EXPLANATION_CACHE_CONTEXT_WORDS = int(os.getenv("EXPLANATION_CACHE_CONTEXT_WORDS", "0"))
+
+def normalize_term(term: str) -> str:
+    """
+    Normalize a term for use in a cache key
+    """
+    return " ".join(term.lower().split())
+
+def context_fingerprint(term: str, context: str, words: int = EXPLANATION_CACHE_CONTEXT_WORDS) -> str:
+    """
+    Fingerprint the words surrounding a term in its context
+    """
+    if words <= 0:
+        return ""
+
+    normalized = " ".join(context.lower().split())
+    position = normalized.find(term)
+    if position < 0:
+        window = normalized.split()
+    else:
+        before = normalized[:position].split()[-words:]
+        after = normalized[position + len(term):].split()[:words]
+        window = before + [term] + after
+    return hashlib.sha1(" ".join(window).encode("utf-8")).hexdigest()[:16]
+
+def explanation_cache_key(term_info: Dict[str, Any], insurance_type: str) -> str:
+    """
+    Build the cache key for a term's explanation
+    """
+    term = normalize_term(term_info["term"])
+    fingerprint = context_fingerprint(term, term_info.get("context", ""))
+    return "|".join([term, term_info["category"], insurance_type.lower(), fingerprint])
+
+class LRUCache:
+    """
+    In-memory cache with a size bound, least-recently-used eviction and TTL
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+class SQLiteCache:
+    """
+    On-disk cache backed by SQLite, with TTL and least-recently-used eviction.
+
+    Hits only buffer their last-used time; the buffer is written in one
+    transaction on the next set, or once it holds touch_batch keys, so
+    reads do not commit.
+    """
+
+    def __init__(self, path: str, max_size: int, ttl: float, touch_batch: int = EXPLANATION_CACHE_TOUCH_BATCH):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.touch_batch = touch_batch
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+        self._connection.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._connection.commit()
+                self.misses += 1
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= self.touch_batch:
+                self._flush_touched()
+                self._connection.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def _flush_touched(self) -> None:
+        """
+        Write the buffered last-used times; the caller holds the lock and commits
+        """
+        if self._touched:
+            self._connection.executemany(
+                "UPDATE cache SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        with self._lock:
+            self._flush_touched()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now)
+            )
+
+            # Drop expired entries first, then the least recently used ones
+            self._connection.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            size = self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if size > self.max_size:
+                overflow = size - self.max_size
+                self._connection.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                )
+                self.evictions += overflow
+            self._connection.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._touched.clear()
+            self._connection.execute("DELETE FROM cache")
+            self._connection.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+class ExplanationCache:
+    """
+    Two-tier explanation cache: an in-process LRU in front of an optional SQLite store
+    """
+
+    def __init__(self, memory: LRUCache, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                # Promote to the memory tier
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: Dict[str, str]) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None
+        }
+
+_explanation_cache: Optional[ExplanationCache] = None
+
+def get_explanation_cache() -> ExplanationCache:
+    """
+    Get the shared explanation cache, creating it on first use
+    """
+    global _explanation_cache
+    if _explanation_cache is None:
+        disk = None
+        if EXPLANATION_CACHE_PATH:
+            try:
+                disk = SQLiteCache(EXPLANATION_CACHE_PATH, EXPLANATION_CACHE_DISK_SIZE, EXPLANATION_CACHE_TTL)
+            except sqlite3.Error as e:
+                print(f"Explanation cache disk tier unavailable: {e}")
+        _explanation_cache = ExplanationCache(
+            LRUCache(EXPLANATION_CACHE_SIZE, EXPLANATION_CACHE_TTL),
+            disk
+        )
+    return _explanation_cache
+
+def warm_cache(paths, insurance_types) -> int:
+    """
+    Preload the cache by explaining the terms found in a corpus of past documents
+    """
+    from document_processor import iter_pdf_file_pages
+    from explanation_generator import generate_explanations
+    from term_identifier import identify_terms
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            files.append(path)
+
+    explained = 0
+    for file_path in files:
+        if file_path.lower().endswith(".pdf"):
+            document_text = "".join(iter_pdf_file_pages(file_path))
+        elif file_path.lower().endswith(".txt"):
+            with open(file_path, encoding="utf-8", errors="replace") as text_file:
+                document_text = text_file.read()
+        else:
+            continue
+
+        for insurance_type in insurance_types:
+            identified_terms = identify_terms(document_text, insurance_type)
+            generate_explanations(identified_terms, insurance_type)
+            explained += len(identified_terms)
+        print(f"Warmed cache from {file_path}")
+
+    return explained
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    # Warming calls the LLM API with the server's settings
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Manage the InsurSpeak explanation cache")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    warm_parser = subcommands.add_parser("warm", help="Preload the cache from past documents (.txt or .pdf)")
+    warm_parser.add_argument("paths", nargs="+", help="Documents or directories of documents")
+    warm_parser.add_argument(
+        "--insurance-type",
+        action="append",
+        choices=["health", "life", "disability"],
+        help="Insurance type(s) to explain terms for (default: all)"
+    )
+
+    subcommands.add_parser("stats", help="Show cache statistics")
+    subcommands.add_parser("clear", help="Remove every cached explanation")
+
+    args = parser.parse_args()
+    cache = get_explanation_cache()
+    if args.command == "warm":
+        count = warm_cache(args.paths, args.insurance_type or ["health", "life", "disability"])
+        print(f"Processed {count} term occurrences")
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == "clear":
+        cache.clear()
+        print("Explanation cache cleared")
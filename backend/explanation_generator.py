@@ -1,167 +1,257 @@
 import os
-from typing import List, Dict, Any
-import openai
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import json
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+from glossary import get_glossary
+from explanation_cache import get_explanation_cache, explanation_cache_key
+from http_client import close_client, post_chat_completion
+from term_store import TermStore
+from metrics import timed
+from token_budget import chat_request
 
-# Initialize OpenAI API
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Number of terms explained in a single LLM request
+EXPLANATION_BATCH_SIZE = int(os.getenv("EXPLANATION_BATCH_SIZE", "20"))
 
-# Dictionary of pre-defined explanations for common terms
-# In a production app, this would be stored in a database
-COMMON_EXPLANATIONS = {
-    "premium": "The amount of money you pay to your insurance company for coverage. This can be paid monthly, quarterly, or annually.",
-    
-    "deductible": "The amount you must pay out of pocket for covered services before your insurance starts paying. For example, if your deductible is $1,000, you'll pay the first $1,000 of covered services yourself.",
-    
-    "copay": "A fixed amount you pay each time you receive a covered service. For example, a $30 copay for a doctor visit means you pay $30 regardless of the actual cost of the visit.",
-    
-    "coinsurance": "The percentage of costs you pay for a covered service after you've met your deductible. For example, if you have 20% coinsurance, you pay 20% of the cost and your insurance pays 80%.",
-    
-    "out-of-pocket maximum": "The most you'll have to pay for covered services in a policy period (usually one year). After you reach this amount, your insurance will pay 100% of the costs for covered services.",
-    
-    "beneficiary": "The person(s) or entity you choose to receive the benefits (like a payout) from your insurance policy, often after your death in life insurance policies.",
-    
-    "policyholder": "The person who owns the insurance policy. They are responsible for paying premiums and are typically the one covered by the insurance.",
-    
-    "preexisting condition": "A health condition you had before your insurance coverage started. Some policies limit or exclude coverage for these conditions.",
-    
-    "waiting period": "The time you must wait after purchasing a policy before certain benefits become available or before you can file certain types of claims.",
-    
-    "rider": "An optional addition to your insurance policy that provides additional benefits or coverage for an extra cost."
-}
+# Maximum number of batched LLM requests in flight at once
+EXPLANATION_CONCURRENCY = int(os.getenv("EXPLANATION_CONCURRENCY", "4"))
+
+# Instructions for explaining a batch of terms, sent as the system message
+BATCH_EXPLANATION_INSTRUCTIONS = """You are an expert insurance translator helping people understand complex insurance terms.
+
+Please explain each of the insurance terms you are given in simple language (8th-grade reading level).
+Each term is given as a JSON object on its own line, with an id, its category and the surrounding policy text as context.
+
+For every term provide:
+1. A clear, simple explanation of what this term means
+2. Any practical implications this might have for the policyholder
+
+Format your response as a JSON array with one object per term, using the same id:
+[
+  {"id": 0, "explanation": "your simple explanation here", "implications": "practical implications for the policyholder"}
+]
+"""
 
 def generate_explanations(identified_terms: List[Dict[str, Any]], insurance_type: str) -> List[Dict[str, Any]]:
     """
-    Generate plain language explanations for identified terms
+    Generate plain language explanations for identified terms.
+    
+    Synchronous entry point for scripts; must not be called from a running event loop.
+    """
+    return asyncio.run(_generate_explanations_and_close(identified_terms, insurance_type))
+
+async def _generate_explanations_and_close(identified_terms: List[Dict[str, Any]], insurance_type: str) -> List[Dict[str, Any]]:
+    try:
+        return await generate_explanations_async(identified_terms, insurance_type)
+    finally:
+        # The event loop ends with this call, taking the client's connections with it
+        await close_client()
+
+def explanation_key(term_info: Dict[str, Any], insurance_type: str) -> Tuple[str, str, str]:
+    """
+    Key identifying terms that share the same explanation
+    """
+    return (term_info["term"].lower(), term_info["category"], insurance_type.lower())
+
+def fallback_explanation(term_info: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Generic explanation used when the LLM could not explain a term
+    """
+    return {
+        "explanation": f"This is insurance terminology related to {term_info['category']}.",
+        "implications": "You may want to ask your insurance provider for clarification.",
+        "source": "fallback"
+    }
+
+@timed
+async def explain_unique_terms(identified_terms: List[Dict[str, Any]], insurance_type: str,
+                               on_progress: Optional[Callable[[Dict[Tuple[str, str, str], Dict[str, str]], int], None]] = None
+                               ) -> Dict[Tuple[str, str, str], Dict[str, str]]:
+    """
+    Generate plain language explanations keyed by explanation_key.
+    
+    Each distinct (term, category, insurance type) is explained once, and terms
+    that need the LLM are sent in batches that run concurrently. If given,
+    on_progress is called with the explanations so far and the number of
+    distinct terms, once before the LLM is called and after each batch.
     """
-    terms_with_explanations = []
+    explanations: Dict[Tuple[str, str, str], Dict[str, str]] = {}
+    pending: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    cache = get_explanation_cache()
+    glossary = get_glossary()
     
     for term_info in identified_terms:
-        term = term_info["term"].lower()
+        key = explanation_key(term_info, insurance_type)
+        if key in explanations or key in pending:
+            continue
         
         # Check if we have a pre-defined explanation
-        if term in COMMON_EXPLANATIONS:
-            explanation = COMMON_EXPLANATIONS[term]
-            implications = get_implications(term, insurance_type)
-            
-            terms_with_explanations.append({
-                **term_info,
+        term = key[0]
+        explanation = glossary.explanation(term)
+        if explanation is not None:
+            explanations[key] = {
                 "explanation": explanation,
-                "implications": implications,
+                "implications": glossary.implication(term, insurance_type),
                 "source": "database"
-            })
+            }
+            continue
+        
+        # Check the explanation cache before calling the LLM
+        cached = cache.get(explanation_cache_key(term_info, insurance_type))
+        if cached is not None:
+            explanations[key] = {
+                "explanation": cached["explanation"],
+                "implications": cached["implications"],
+                "source": "cache"
+            }
         else:
-            # Generate explanation using LLM
+            pending[key] = term_info
+    
+    # Fall back to mock explanations if no API key, without caching them
+    if pending and not os.getenv("OPENAI_API_KEY"):
+        for key, term_info in pending.items():
+            explanations[key] = mock_explanation(term_info, insurance_type)
+        pending = {}
+    
+    total = len(explanations) + len(pending)
+    if on_progress:
+        on_progress(explanations, total)
+    
+    # Generate the remaining explanations using the LLM
+    pending_items = list(pending.items())
+    batches = [
+        pending_items[i:i + EXPLANATION_BATCH_SIZE]
+        for i in range(0, len(pending_items), EXPLANATION_BATCH_SIZE)
+    ]
+    semaphore = asyncio.Semaphore(EXPLANATION_CONCURRENCY)
+    
+    async def explain_batch(batch):
+        async with semaphore:
             try:
-                llm_response = generate_llm_explanation(term_info, insurance_type)
-                
-                terms_with_explanations.append({
-                    **term_info,
-                    "explanation": llm_response["explanation"],
-                    "implications": llm_response["implications"],
-                    "source": "llm"
-                })
+                results = await generate_llm_explanations_batch([term_info for _, term_info in batch], insurance_type)
             except Exception as e:
-                print(f"Error generating explanation for {term}: {e}")
-                # Fallback to a generic explanation
-                terms_with_explanations.append({
-                    **term_info,
-                    "explanation": f"This is insurance terminology related to {term_info['category']}.",
-                    "implications": "You may want to ask your insurance provider for clarification.",
-                    "source": "fallback"
-                })
+                print(f"Error generating explanations for batch: {e}")
+                results = [None] * len(batch)
+        
+        for (key, term_info), result in zip(batch, results):
+            if result:
+                cache.set(explanation_cache_key(term_info, insurance_type), result)
+                explanations[key] = {
+                    "explanation": result["explanation"],
+                    "implications": result["implications"],
+                    "source": "llm"
+                }
+            else:
+                explanations[key] = fallback_explanation(term_info)
+        
+        if on_progress:
+            on_progress(explanations, total)
+    
+    await asyncio.gather(*(explain_batch(batch) for batch in batches))
     
-    return terms_with_explanations
+    return explanations
 
-def generate_llm_explanation(term_info: Dict[str, Any], insurance_type: str) -> Dict[str, str]:
+async def generate_explanations_async(identified_terms: List[Dict[str, Any]], insurance_type: str) -> List[Dict[str, Any]]:
     """
-    Generate an explanation for a term using OpenAI's API
+    Generate plain language explanations for identified terms
+    """
+    explanations = await explain_unique_terms(identified_terms, insurance_type)
+    return [
+        {**term_info, **explanations[explanation_key(term_info, insurance_type)]}
+        for term_info in identified_terms
+    ]
+
+async def explain_term_store(store: TermStore, insurance_type: str,
+                             on_progress: Optional[Callable[[int, int], None]] = None) -> TermStore:
     """
-    # Format the prompt with the term and its context
-    prompt = f"""
-    You are an expert insurance translator helping people understand complex insurance terms.
+    Attach explanations to a term store in place. Only the first occurrence of
+    each distinct term is materialized as a dictionary.
     
-    Please explain the following insurance term in simple language (8th-grade reading level):
+    If given, on_progress is called with the number of distinct terms explained
+    so far and in total, after the store has been updated with them.
+    """
+    first_occurrences = store.unique_terms()
+    representatives = [store.record(i) for i in first_occurrences.values()]
+    keys = {pair: explanation_key(term_info, insurance_type) for pair, term_info in zip(first_occurrences, representatives)}
     
-    Term: {term_info['term']}
-    Context: {term_info['context']}
-    Insurance Type: {insurance_type}
-    Category: {term_info['category']}
+    def attach(explanations, total):
+        store.set_explanations({pair: explanations[key] for pair, key in keys.items() if key in explanations})
+        if on_progress:
+            on_progress(len(explanations), total)
     
-    Provide:
-    1. A clear, simple explanation of what this term means
-    2. Any practical implications this might have for the policyholder
+    explanations = await explain_unique_terms(representatives, insurance_type, attach if on_progress else None)
+    if on_progress is None:
+        attach(explanations, len(explanations))
+    return store
+
+def mock_explanation(term_info: Dict[str, Any], insurance_type: str) -> Dict[str, str]:
+    """
+    Generate a mock explanation for testing purposes without using the OpenAI API
+    """
+    category = term_info["category"]
+    if category == "percentage":
+        explanation = f"{term_info['term']} is a share of a cost or benefit set by your policy."
+    elif category == "monetary":
+        explanation = f"{term_info['term']} is a dollar amount that your policy uses for costs, limits or benefits."
+    elif category == "time_period":
+        explanation = f"{term_info['term']} is a length of time that affects when coverage or benefits apply."
+    elif category == "legal_clause":
+        explanation = "This clause adds a condition or exception to the policy terms around it."
+    else:
+        explanation = f"'{term_info['term']}' is {insurance_type} insurance terminology related to {category}."
     
-    Format your response as a JSON object with the following structure:
-    {{
-      "explanation": "your simple explanation here",
-      "implications": "practical implications for the policyholder"
-    }}
+    return {
+        "explanation": explanation,
+        "implications": "Check the surrounding policy text to see how this applies to you.",
+        "source": "mock"
+    }
+
+@timed
+async def generate_llm_explanations_batch(term_infos: List[Dict[str, Any]], insurance_type: str) -> List[Optional[Dict[str, str]]]:
     """
+    Explain several terms with a single OpenAI request.
     
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o",  # Use appropriate model
-            messages=[
-                {"role": "system", "content": "You are an insurance expert that explains complex terms in simple language."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=300
-        )
-        
-        # Parse the response
-        content = response.choices[0].message.content
-        
-        # Extract the JSON part
-        json_start = content.find('{')
-        json_end = content.rfind('}') + 1
-        if json_start >= 0 and json_end > json_start:
-            json_str = content[json_start:json_end]
-            return json.loads(json_str)
-        else:
-            # If JSON parsing fails, create a structured response
-            return {
-                "explanation": content[:150] if len(content) > 150 else content,
-                "implications": "Please consult your insurance provider for specific details about how this affects your policy."
-            }
-            
-    except Exception as e:
-        print(f"Error calling OpenAI API: {e}")
-        return {
-            "explanation": f"This term ({term_info['term']}) is related to {insurance_type} insurance.",
-            "implications": "Please consult your insurance provider for specific details."
+    Returns one result per term, in order, with None for any term the model
+    did not explain.
+    """
+    items = [
+        {
+            "id": i,
+            "term": term_info["term"],
+            "category": term_info["category"],
+            "context": term_info["context"]
         }
+        for i, term_info in enumerate(term_infos)
+    ]
+    
+    # One term per line keeps the list compact
+    terms_text = f"Insurance type: {insurance_type}\nTerms:\n" + "\n".join(json.dumps(item) for item in items)
+    response = await post_chat_completion(
+        chat_request(BATCH_EXPLANATION_INSTRUCTIONS, terms_text, min(4000, 150 * len(items)), 0.3, "explanation_batch"),
+        operation="explanation_batch"
+    )
+    
+    # Extract the JSON array from the response
+    content = response["choices"][0]["message"]["content"]
+    json_start = content.find('[')
+    json_end = content.rfind(']') + 1
+    if json_start < 0 or json_end <= json_start:
+        return [None] * len(items)
+    
+    results: List[Optional[Dict[str, str]]] = [None] * len(items)
+    for entry in json.loads(content[json_start:json_end]):
+        if not isinstance(entry, dict):
+            continue
+        index = entry.get("id")
+        if isinstance(index, int) and 0 <= index < len(items) and entry.get("explanation"):
+            results[index] = {
+                "explanation": entry["explanation"],
+                "implications": entry.get("implications") or "Please consult your insurance provider for specific details."
+            }
+    return results
 
 def get_implications(term: str, insurance_type: str) -> str:
     """
     Get implications for common terms based on insurance type
     """
-    implications_map = {
-        "premium": {
-            "health": "If you miss premium payments, your health coverage could be terminated.",
-            "life": "If you miss premium payments, your life insurance policy could lapse and you might lose coverage.",
-            "disability": "If you miss premium payments, your disability protection could end when you need it most."
-        },
-        "deductible": {
-            "health": "You'll need to budget for this amount before your insurance helps with costs.",
-            "life": "Life insurance typically doesn't have deductibles.",
-            "disability": "This is the amount of time (elimination period) or money you must wait/spend before benefits begin."
-        },
-        "waiting period": {
-            "health": "You won't be covered for certain services during this time, so plan accordingly.",
-            "life": "If death occurs during this period, the full benefit may not be paid.",
-            "disability": "You won't receive benefits during this period, so have emergency savings ready."
-        }
-    }
-    
-    # Get the specific implication for this term and insurance type
-    if term in implications_map and insurance_type.lower() in implications_map[term]:
-        return implications_map[term][insurance_type.lower()]
-    
-    # Default generic implications
-    return "This may affect your coverage or costs. Check your specific policy details."
+    return get_glossary().implication(term, insurance_type)
@@ -0,0 +1,194 @@
+"""
+Index of the numeric facts stated in a document.
+
+Every amount, percentage and period found by the complex term patterns is
+paired with the insurance term it describes, the nearest glossary term in
+the same sentence, preferring payment terms such as deductible or copay.
+Factual questions like "How much is my deductible?" can then be answered
+by quoting the sentences stating the facts, without an LLM call.
+"""
+import os
+import re
+from bisect import bisect_right
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from complex_patterns import registry
+from glossary import get_glossary
+from metrics import timed
+from retrieval import tokenize
+from term_store import TermStore
+
+# Farthest a term can be from a value, in characters, to be paired with it
+FACT_MAX_DISTANCE = int(os.getenv("FACT_MAX_DISTANCE", "200"))
+
+# Most sentences quoted in an answer; questions matching more are left to the LLM
+FACT_ANSWER_MAX_SENTENCES = int(os.getenv("FACT_ANSWER_MAX_SENTENCES", "3"))
+
+# Longest qualifier kept after a value, e.g. "for individual coverage"
+FACT_QUALIFIER_CHARS = 60
+
+# Glossary categories of the terms values most often describe, preferred
+# over nearer terms of other categories
+FACT_TERM_CATEGORIES = ("payment",)
+
+# Questions asking for a number rather than an explanation
+_FACT_QUESTION_PATTERN = re.compile(
+    r"\b(?:how (?:much|many|long|soon)|what(?:'s| is| are) (?:my|the|our)|what percent(?:age)?)\b", re.IGNORECASE
+)
+
+# Question types that need reasoning rather than a quote from the policy
+_REASONING_QUESTION_TYPES = ("recommendation", "comparison")
+
+# Ends of sentences: a line break, or sentence punctuation followed by
+# whitespace so decimals and clause numbers like 2.1 do not split sentences
+_SENTENCE_BREAK = re.compile(r"\n|[.!?;](?=\s)")
+
+# Where a qualifier stops: the next clause or a parenthesis
+_QUALIFIER_STOP = re.compile(r"[,;:()]|\s(?:and|or|but)\s", re.IGNORECASE)
+
+class Fact(NamedTuple):
+    term: str
+    value: str
+    category: str
+    qualifier: str
+    section: Optional[str]
+    start: int
+    end: int
+    sentence_start: int
+    sentence_end: int
+
+class FactIndex:
+    """
+    The facts in one document, grouped by the term they describe
+    """
+
+    def __init__(self, text: str, insurance_type: str, facts: List[Fact]):
+        self.text = text
+        self.insurance_type = insurance_type
+        self.facts = facts
+        self._by_term: Dict[str, List[Fact]] = {}
+        for fact in facts:
+            self._by_term.setdefault(fact.term, []).append(fact)
+
+    def __len__(self) -> int:
+        return len(self.facts)
+
+    def terms(self) -> List[str]:
+        return list(self._by_term)
+
+    def facts_for(self, term: str) -> List[Fact]:
+        return self._by_term.get(term.lower(), [])
+
+    def sentence(self, fact: Fact) -> str:
+        return self.text[fact.sentence_start:fact.sentence_end].strip()
+
+    def to_dicts(self, term: Optional[str] = None) -> List[Dict[str, Any]]:
+        facts = self.facts_for(term) if term else self.facts
+        return [
+            {
+                "term": fact.term,
+                "value": fact.value,
+                "category": fact.category,
+                "qualifier": fact.qualifier,
+                "section": fact.section,
+                "start_index": fact.start,
+                "end_index": fact.end,
+                "sentence": self.sentence(fact)
+            }
+            for fact in facts
+        ]
+
+    def lookup(self, question: str) -> List[Fact]:
+        """
+        Facts about the terms a question mentions, keeping those whose
+        sentence shares the most other words with the question, e.g. the
+        specialist copay for "What is my copay for specialist visits?"
+        """
+        glossary = get_glossary()
+        terms = {glossary.canonical_term(form, self.insurance_type)
+                 for _, _, form in glossary.matcher(self.insurance_type).find(question)}
+        candidates = [fact for term in terms for fact in self._by_term.get(term, [])]
+        if not candidates:
+            return []
+
+        term_words = set(tokenize(" ".join(terms)))
+        question_words = set(tokenize(question)) - term_words
+        scores = [len(question_words.intersection(tokenize(self.sentence(fact)))) for fact in candidates]
+        best = max(scores)
+        return sorted((fact for fact, score in zip(candidates, scores) if score == best), key=lambda fact: fact.start)
+
+    def answer(self, question: str, question_type: str) -> Optional[str]:
+        """
+        Answer a factual question by quoting the sentences stating the facts
+        it asks about, or None if the question needs the LLM
+        """
+        if question_type in _REASONING_QUESTION_TYPES or not _FACT_QUESTION_PATTERN.search(question):
+            return None
+        sentences = list(dict.fromkeys(self.sentence(fact) for fact in self.lookup(question)))
+        if not sentences or len(sentences) > FACT_ANSWER_MAX_SENTENCES:
+            return None
+        return "According to your policy: " + " ".join(
+            sentence if sentence.endswith((".", "!", "?")) else sentence + "." for sentence in sentences
+        )
+
+def _qualifier(text: str, start: int, stop: int) -> str:
+    """
+    The words following a value up to the next clause, e.g. "for individual
+    coverage" after "$1,500"
+    """
+    following = text[start:min(stop, start + FACT_QUALIFIER_CHARS)]
+    match = _QUALIFIER_STOP.search(following)
+    if match:
+        following = following[:match.start()]
+    return following.strip().rstrip(".")
+
+@timed
+def extract_facts(store: TermStore) -> FactIndex:
+    """
+    Pair each value in a term store with the term it describes
+    """
+    text = store.text
+    value_categories = registry.value_categories()
+    glossary = get_glossary()
+    sentence_ends = [match.end() for match in _SENTENCE_BREAK.finditer(text)]
+
+    # Rows of glossary terms rather than pattern matches, in document order
+    term_rows = [i for i in range(len(store)) if store.category(i) not in value_categories
+                 and glossary.category(store.term(i)) == store.category(i)]
+    term_starts = [store.starts[i] for i in term_rows]
+
+    facts = []
+    value_rows = [i for i in range(len(store)) if store.category(i) in value_categories]
+    for position, i in enumerate(value_rows):
+        start, end = store.starts[i], store.ends[i]
+        sentence = bisect_right(sentence_ends, start)
+        sentence_start = sentence_ends[sentence - 1] if sentence else 0
+        sentence_end = sentence_ends[sentence] if sentence < len(sentence_ends) else len(text)
+        low = max(sentence_start, start - FACT_MAX_DISTANCE)
+        high = min(sentence_end, end + FACT_MAX_DISTANCE)
+
+        best = None
+        for j in range(bisect_right(term_starts, low - 1), bisect_right(term_starts, high)):
+            row = term_rows[j]
+            if store.ends[row] > high:
+                continue
+            distance = max(store.starts[row] - end, start - store.ends[row], 0)
+            rank = (store.category(row) not in FACT_TERM_CATEGORIES, distance)
+            if best is None or rank < best[0]:
+                best = (rank, row)
+        if best is None:
+            continue
+
+        next_value = store.starts[value_rows[position + 1]] if position + 1 < len(value_rows) else len(text)
+        facts.append(Fact(
+            term=store.term(best[1]),
+            value=store.original_text(i),
+            category=store.category(i),
+            qualifier=_qualifier(text, end, min(next_value, sentence_end)),
+            section=store.section(i),
+            start=start,
+            end=end,
+            sentence_start=sentence_start,
+            sentence_end=sentence_end
+        ))
+    return FactIndex(text, store.insurance_type, facts)
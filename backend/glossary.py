@@ -0,0 +1,384 @@
+"""
+Insurance glossary: terms, synonyms, categories, explanations and implications.
+
+The glossary is loaded from a JSON file or a SQLite database and compiled into
+term matchers and lookup tables. When the file changes it is reloaded and
+swapped in atomically, so running workers pick up edits without a restart.
+
+Compiling the matchers of a large glossary is slow, so the compiled glossary
+is also saved as an artifact that later processes load instead, as long as
+the glossary has not changed since. Build it ahead of deployment with
+"python glossary.py build".
+
+Usage:
+    python glossary.py stats
+    python glossary.py export glossary.sqlite3
+    python glossary.py build
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from term_matcher import TermMatcher
+
+# Glossary file, either JSON or SQLite (.sqlite3, .sqlite or .db)
+GLOSSARY_PATH = os.getenv("GLOSSARY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "glossary.json"))
+
+# Minimum seconds between checks for a changed glossary file (0 disables reloading)
+GLOSSARY_RELOAD_INTERVAL = float(os.getenv("GLOSSARY_RELOAD_INTERVAL", "5"))
+
+# Compiled glossary artifact ("" always compiles the glossary when it is loaded)
+GLOSSARY_ARTIFACT_PATH = os.getenv("GLOSSARY_ARTIFACT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "glossary.compiled.pkl"))
+
+# Version of the artifact layout; bump it when Glossary or TermMatcher internals change
+ARTIFACT_FORMAT = 1
+
+DEFAULT_CATEGORY = "general"
+
+_SQLITE_SUFFIXES = (".sqlite3", ".sqlite", ".db")
+
+class Glossary:
+    """
+    A compiled glossary. Instances are never modified after construction, so
+    a reference taken once stays consistent while a reload swaps in a new one.
+    """
+
+    def __init__(self, data: Dict[str, Any], source: Optional[str] = None):
+        self.source = source
+        # Changes whenever the glossary content changes, so results derived
+        # from it can be invalidated
+        self.version = glossary_version(data)
+        self.default_implications: str = data.get("default_implications", "")
+        self.categories: Dict[str, str] = {}
+        self.explanations: Dict[str, str] = {}
+        self.implications: Dict[Tuple[str, str], str] = {}
+
+        # Surface forms (terms and synonyms) matched for every insurance type,
+        # and for each specific type, mapped to their canonical term
+        self._common_forms: Dict[str, str] = {}
+        self._type_forms: Dict[str, Dict[str, str]] = {}
+        self._type_terms: Dict[str, List[str]] = {}
+
+        for entry in data.get("terms", []):
+            term = entry["term"].lower()
+            self.categories[term] = entry.get("category") or DEFAULT_CATEGORY
+            if entry.get("explanation"):
+                self.explanations[term] = entry["explanation"]
+            for insurance_type, implications in (entry.get("implications") or {}).items():
+                self.implications[term, insurance_type.lower()] = implications
+
+            insurance_types = [insurance_type.lower() for insurance_type in entry.get("insurance_types") or []]
+            for insurance_type in insurance_types:
+                self._type_terms.setdefault(insurance_type, []).append(term)
+
+            # Synonyms are a list, or a mapping from insurance type to a list
+            # where "*" holds the synonyms used for every type of the term
+            synonyms = entry.get("synonyms") or []
+            if isinstance(synonyms, dict):
+                for insurance_type, type_synonyms in synonyms.items():
+                    if insurance_type == "*":
+                        continue
+                    forms = self._type_forms.setdefault(insurance_type.lower(), {})
+                    for synonym in type_synonyms:
+                        forms.setdefault(synonym.lower(), term)
+                synonyms = synonyms.get("*", [])
+
+            for form in [term] + [synonym.lower() for synonym in synonyms]:
+                if insurance_types:
+                    for insurance_type in insurance_types:
+                        self._type_forms.setdefault(insurance_type, {}).setdefault(form, term)
+                else:
+                    self._common_forms.setdefault(form, term)
+
+        # Compile a matcher for every insurance type the glossary knows about
+        self._forms: Dict[str, Dict[str, str]] = {}
+        self._matchers: Dict[str, TermMatcher] = {}
+        for insurance_type in self.insurance_types():
+            self.matcher(insurance_type)
+
+    def insurance_types(self) -> List[str]:
+        return sorted(set(self._type_forms) | set(self._type_terms))
+
+    def _surface_forms(self, insurance_type: str) -> Dict[str, str]:
+        forms = self._forms.get(insurance_type)
+        if forms is None:
+            forms = dict(self._common_forms)
+            for form, term in self._type_forms.get(insurance_type, {}).items():
+                forms.setdefault(form, term)
+            self._forms[insurance_type] = forms
+        return forms
+
+    def matcher(self, insurance_type: str) -> TermMatcher:
+        """
+        Term matcher for the common terms plus those specific to an insurance type
+        """
+        insurance_type = insurance_type.lower()
+        matcher = self._matchers.get(insurance_type)
+        if matcher is None:
+            matcher = TermMatcher(self._surface_forms(insurance_type))
+            self._matchers[insurance_type] = matcher
+        return matcher
+
+    def canonical_term(self, form: str, insurance_type: str) -> str:
+        """
+        Canonical term for a matched term or synonym
+        """
+        return self._surface_forms(insurance_type.lower()).get(form.lower(), form.lower())
+
+    def category(self, term: str) -> str:
+        return self.categories.get(term.lower(), DEFAULT_CATEGORY)
+
+    def explanation(self, term: str) -> Optional[str]:
+        return self.explanations.get(term.lower())
+
+    def implication(self, term: str, insurance_type: str) -> str:
+        return self.implications.get((term.lower(), insurance_type.lower()), self.default_implications)
+
+    def type_terms(self, insurance_type: str) -> List[str]:
+        """
+        Terms specific to an insurance type
+        """
+        return list(self._type_terms.get(insurance_type.lower(), []))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "version": self.version,
+            "terms": len(self.categories),
+            "explanations": len(self.explanations),
+            "implications": len(self.implications),
+            "insurance_types": {
+                insurance_type: len(self._surface_forms(insurance_type))
+                for insurance_type in self.insurance_types()
+            }
+        }
+
+def glossary_version(data: Dict[str, Any]) -> str:
+    """
+    Short hash of the glossary content
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def load_glossary_artifact(path: str, version: str) -> Optional[Glossary]:
+    """
+    Load a compiled glossary artifact, or None if it is missing, unreadable or
+    was built from a different version of the glossary
+    """
+    try:
+        # Unpickling skips building the term matchers. With the bundled glossary
+        # either takes about a millisecond, but building grows with the number
+        # of terms and synonyms: for 5,000 terms it takes about 0.7s, and
+        # loading the artifact about 0.13s, in every worker process.
+        with open(path, "rb") as artifact_file:
+            artifact = pickle.load(artifact_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error loading glossary artifact {path}: {e}")
+        return None
+    if artifact.get("format") != ARTIFACT_FORMAT or artifact.get("version") != version:
+        return None
+    return artifact["glossary"]
+
+def write_glossary_artifact(path: str, glossary: Glossary) -> None:
+    """
+    Save a compiled glossary for later processes to load
+    """
+    # Write to a temporary file first so readers never see a partial artifact
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as artifact_file:
+        pickle.dump({"format": ARTIFACT_FORMAT, "version": glossary.version, "glossary": glossary},
+                    artifact_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+def compile_glossary(data: Dict[str, Any], source: Optional[str] = None,
+                     artifact_path: Optional[str] = GLOSSARY_ARTIFACT_PATH) -> Glossary:
+    """
+    Compile glossary data, reusing the artifact when it matches and saving a
+    new one when it does not
+    """
+    glossary = load_glossary_artifact(artifact_path, glossary_version(data)) if artifact_path else None
+    if glossary is None:
+        glossary = Glossary(data, source)
+        if artifact_path:
+            try:
+                write_glossary_artifact(artifact_path, glossary)
+            except OSError as e:
+                print(f"Error writing glossary artifact {artifact_path}: {e}")
+    glossary.source = source
+    return glossary
+
+def load_glossary_data(path: str) -> Dict[str, Any]:
+    """
+    Read a glossary file into the JSON glossary structure
+    """
+    if not path.lower().endswith(_SQLITE_SUFFIXES):
+        with open(path, encoding="utf-8") as glossary_file:
+            return json.load(glossary_file)
+
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        entries: Dict[str, Dict[str, Any]] = {}
+        for term, category, explanation, insurance_types in connection.execute(
+            "SELECT term, category, explanation, insurance_types FROM terms ORDER BY rowid"
+        ):
+            entry = {"term": term, "category": category or DEFAULT_CATEGORY}
+            if explanation:
+                entry["explanation"] = explanation
+            if insurance_types:
+                entry["insurance_types"] = [value.strip() for value in insurance_types.split(",") if value.strip()]
+            entries[term] = entry
+
+        for term, synonym, insurance_type in connection.execute(
+            "SELECT term, synonym, insurance_type FROM synonyms ORDER BY rowid"
+        ):
+            if term in entries:
+                entries[term].setdefault("synonyms", {}).setdefault(insurance_type or "*", []).append(synonym)
+
+        for term, insurance_type, implications in connection.execute(
+            "SELECT term, insurance_type, implications FROM implications ORDER BY rowid"
+        ):
+            if term in entries:
+                entries[term].setdefault("implications", {})[insurance_type] = implications
+
+        row = connection.execute("SELECT value FROM settings WHERE key = 'default_implications'").fetchone()
+    finally:
+        connection.close()
+
+    # Use the plain list form when no synonyms are type specific
+    for entry in entries.values():
+        synonyms = entry.get("synonyms")
+        if synonyms and list(synonyms) == ["*"]:
+            entry["synonyms"] = synonyms["*"]
+
+    return {"default_implications": row[0] if row else "", "terms": list(entries.values())}
+
+def write_glossary_data(data: Dict[str, Any], path: str) -> None:
+    """
+    Write the JSON glossary structure to a JSON file or SQLite database
+    """
+    if not path.lower().endswith(_SQLITE_SUFFIXES):
+        with open(path, "w", encoding="utf-8") as glossary_file:
+            json.dump(data, glossary_file, indent=2, ensure_ascii=False)
+            glossary_file.write("\n")
+        return
+
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            connection.executescript("""
+                CREATE TABLE terms (
+                    term TEXT PRIMARY KEY,
+                    category TEXT NOT NULL,
+                    explanation TEXT,
+                    insurance_types TEXT
+                );
+                CREATE TABLE synonyms (term TEXT NOT NULL, synonym TEXT NOT NULL, insurance_type TEXT);
+                CREATE TABLE implications (
+                    term TEXT NOT NULL,
+                    insurance_type TEXT NOT NULL,
+                    implications TEXT NOT NULL,
+                    PRIMARY KEY (term, insurance_type)
+                );
+                CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT);
+            """)
+            for entry in data.get("terms", []):
+                term = entry["term"]
+                connection.execute(
+                    "INSERT INTO terms (term, category, explanation, insurance_types) VALUES (?, ?, ?, ?)",
+                    (term, entry.get("category") or DEFAULT_CATEGORY, entry.get("explanation"),
+                     ",".join(entry.get("insurance_types") or []) or None)
+                )
+                synonyms = entry.get("synonyms") or []
+                if not isinstance(synonyms, dict):
+                    synonyms = {"*": synonyms}
+                connection.executemany(
+                    "INSERT INTO synonyms (term, synonym, insurance_type) VALUES (?, ?, ?)",
+                    [
+                        (term, synonym, None if insurance_type == "*" else insurance_type)
+                        for insurance_type, values in synonyms.items()
+                        for synonym in values
+                    ]
+                )
+                connection.executemany(
+                    "INSERT INTO implications (term, insurance_type, implications) VALUES (?, ?, ?)",
+                    [(term, insurance_type, text) for insurance_type, text in (entry.get("implications") or {}).items()]
+                )
+            connection.execute(
+                "INSERT INTO settings (key, value) VALUES ('default_implications', ?)",
+                (data.get("default_implications", ""),)
+            )
+    finally:
+        connection.close()
+
+_glossary: Optional[Glossary] = None
+_glossary_mtime: Optional[float] = None
+_last_check = 0.0
+_reload_lock = threading.Lock()
+
+def reload_glossary(path: Optional[str] = None) -> Glossary:
+    """
+    Load and compile the glossary, then swap it in for new lookups
+    """
+    global _glossary, _glossary_mtime, _last_check
+    path = path or GLOSSARY_PATH
+    with _reload_lock:
+        mtime = os.path.getmtime(path)
+        glossary = compile_glossary(load_glossary_data(path), path)
+        _glossary, _glossary_mtime, _last_check = glossary, mtime, time.time()
+    return glossary
+
+def get_glossary() -> Glossary:
+    """
+    Get the current glossary, reloading it if the file has changed. A glossary
+    that fails to load is reported and the previous one is kept.
+    """
+    global _last_check
+    if _glossary is None:
+        return reload_glossary()
+
+    now = time.time()
+    if GLOSSARY_RELOAD_INTERVAL > 0 and now - _last_check >= GLOSSARY_RELOAD_INTERVAL:
+        _last_check = now
+        try:
+            if os.path.getmtime(_glossary.source) != _glossary_mtime:
+                return reload_glossary(_glossary.source)
+        except Exception as e:
+            print(f"Error reloading glossary from {_glossary.source}: {e}")
+    return _glossary
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect or convert the InsurSpeak glossary")
+    parser.add_argument("--path", default=GLOSSARY_PATH, help="Glossary file (JSON or SQLite)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("stats", help="Show the size of the compiled glossary")
+
+    export_parser = subparsers.add_parser("export", help="Write the glossary to another JSON or SQLite file")
+    export_parser.add_argument("output", help="Output file; .sqlite3, .sqlite or .db writes SQLite")
+
+    build_parser = subparsers.add_parser("build", help="Compile the glossary into an artifact loaded at startup")
+    build_parser.add_argument("--output", default=GLOSSARY_ARTIFACT_PATH, help=f"Artifact file (default: {GLOSSARY_ARTIFACT_PATH})")
+
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(json.dumps(Glossary(load_glossary_data(args.path), args.path).stats(), indent=2))
+    elif args.command == "export":
+        write_glossary_data(load_glossary_data(args.path), args.output)
+        print(f"Glossary written to {args.output}")
+    elif args.command == "build":
+        glossary = Glossary(load_glossary_data(args.path), args.path)
+        write_glossary_artifact(args.output, glossary)
+        print(f"Compiled glossary version {glossary.version} written to {args.output}")
+
+if __name__ == "__main__":
+    main()
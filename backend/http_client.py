@@ -0,0 +1,295 @@
+import asyncio
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, Optional
+
+from metrics import LLM_REQUESTS, LLM_RETRIES, LLM_SECONDS, record_llm_usage
+
+if TYPE_CHECKING:
+    # httpx is imported on first use, keeping it out of startup for mock and
+    # cached requests that never call the API
+    import httpx
+
+# Base URL of the OpenAI-compatible API (point at a local mock server for testing)
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+
+# Timeouts in seconds
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+
+# Connection pool limits
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+
+# Retries for rate limits, server errors and network failures
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+# Circuit breaker: consecutive failed calls before opening, and seconds before retrying
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+LLM_CIRCUIT_RESET_TIMEOUT = float(os.getenv("LLM_CIRCUIT_RESET_TIMEOUT", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+class LLMRequestError(Exception):
+    """
+    Raised when the LLM API returns an error or cannot be reached
+    """
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class CircuitOpenError(LLMRequestError):
+    """
+    Raised without calling the API while the circuit breaker is open
+    """
+
+class CircuitBreaker:
+    """
+    Stops calling a failing API for a while so requests fail fast instead of
+    piling up behind timeouts. Once the reset timeout has passed a single
+    call is let through to probe the API; the rest keep failing fast until
+    it succeeds or fails, or until it has taken a whole reset timeout.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state != "half-open":
+            return state == "closed"
+        now = time.monotonic()
+        if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+            return False
+        self.probe_started = now
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half-open" or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probe_started = None
+
+circuit_breaker = CircuitBreaker(LLM_CIRCUIT_FAILURE_THRESHOLD, LLM_CIRCUIT_RESET_TIMEOUT)
+
+_client: Optional["httpx.AsyncClient"] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_client() -> "httpx.AsyncClient":
+    """
+    Get the shared HTTP client for the running event loop, creating it on first use
+    """
+    import httpx
+
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is not None and not _client.is_closed and _client_loop is not loop:
+        _discard_client(_client, _client_loop)
+        _client = None
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=OPENAI_API_BASE,
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
+        _client_loop = loop
+    return _client
+
+def _discard_client(client: "httpx.AsyncClient", loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    """
+    Close a client created on another event loop. Its connections belong to
+    that loop, so they are closed there if it is still running; a stopped
+    loop cannot close them, which is why callers of asyncio.run close the
+    client before their loop ends.
+    """
+    if loop is not None and loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+async def close_client() -> None:
+    """
+    Close the shared HTTP client if it belongs to the running event loop,
+    e.g. when the server shuts down or a script's event loop finishes
+    """
+    global _client
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+        _client = None
+
+def retry_delay(attempt: int, response: Optional["httpx.Response"] = None) -> float:
+    """
+    Seconds to wait before the next attempt: the server's Retry-After if it
+    sent one, otherwise exponential backoff with full jitter
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(LLM_BACKOFF_MAX, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                    return min(LLM_BACKOFF_MAX, max(0.0, wait))
+                except (TypeError, ValueError):
+                    pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+def _auth_headers() -> Dict[str, str]:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"
+    }
+
+def _error_message(response: "httpx.Response") -> str:
+    try:
+        error_data = response.json()
+        if "error" in error_data:
+            return f"API error: {error_data['error']['message']}"
+    except Exception:
+        pass
+    return f"HTTP error: {response.status_code} {response.reason_phrase}"
+
+@contextmanager
+def _record_call(operation: str) -> Iterator[None]:
+    """
+    Record the latency and outcome of an LLM API call, including its retries
+    """
+    started = time.perf_counter()
+    outcome = "cancelled"
+    try:
+        yield
+        outcome = "success"
+    except CircuitOpenError:
+        outcome = "circuit_open"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        LLM_SECONDS.observe(time.perf_counter() - started, operation=operation)
+        LLM_REQUESTS.inc(operation=operation, outcome=outcome)
+
+async def post_chat_completion(payload: Dict[str, Any], operation: str = "chat") -> Dict[str, Any]:
+    """
+    Send a chat completion request, retrying transient failures. The operation
+    names the call in metrics.
+    """
+    with _record_call(operation):
+        response_data = await _post_with_retries(payload, operation)
+    record_llm_usage(operation, response_data)
+    return response_data
+
+async def _post_with_retries(payload: Dict[str, Any], operation: str) -> Dict[str, Any]:
+    import httpx
+
+    if not circuit_breaker.allow_request():
+        raise CircuitOpenError("LLM API is unavailable, please try again shortly")
+
+    client = get_client()
+    error: Optional[LLMRequestError] = None
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        response = None
+        try:
+            response = await client.post("/chat/completions", headers=_auth_headers(), json=payload)
+        except httpx.TransportError as e:
+            error = LLMRequestError(f"Connection error: {e}")
+        else:
+            if response.status_code < 400:
+                circuit_breaker.record_success()
+                return response.json()
+            error = LLMRequestError(_error_message(response), response.status_code)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                # The request itself is wrong; retrying won't help and the API is healthy
+                circuit_breaker.record_success()
+                raise error
+
+        if attempt < LLM_MAX_RETRIES:
+            LLM_RETRIES.inc(operation=operation)
+            await asyncio.sleep(retry_delay(attempt, response))
+
+    circuit_breaker.record_failure()
+    raise error
+
+async def stream_chat_completion(payload: Dict[str, Any], operation: str = "chat_stream") -> AsyncIterator[str]:
+    """
+    Send a streaming chat completion request and yield content as it arrives.
+    
+    Failures before the first token are retried like post_chat_completion;
+    once tokens have been sent the stream cannot be restarted.
+    """
+    with _record_call(operation):
+        async for content in _stream_with_retries(payload, operation):
+            yield content
+
+async def _stream_with_retries(payload: Dict[str, Any], operation: str) -> AsyncIterator[str]:
+    import httpx
+
+    if not circuit_breaker.allow_request():
+        raise CircuitOpenError("LLM API is unavailable, please try again shortly")
+
+    client = get_client()
+    payload = {**payload, "stream": True}
+    error: Optional[LLMRequestError] = None
+    started = False
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        response = None
+        try:
+            async with client.stream("POST", "/chat/completions", headers=_auth_headers(), json=payload) as response:
+                if response.status_code < 400:
+                    circuit_breaker.record_success()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            return
+                        choices = json.loads(data).get("choices") or [{}]
+                        content = (choices[0].get("delta") or {}).get("content")
+                        if content:
+                            started = True
+                            yield content
+                    return
+
+                await response.aread()
+                error = LLMRequestError(_error_message(response), response.status_code)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    circuit_breaker.record_success()
+                    raise error
+        except httpx.TransportError as e:
+            error = LLMRequestError(f"Connection error: {e}")
+            if started:
+                circuit_breaker.record_failure()
+                raise error
+
+        if attempt < LLM_MAX_RETRIES:
+            LLM_RETRIES.inc(operation=operation)
+            await asyncio.sleep(retry_delay(attempt, response))
+
+    circuit_breaker.record_failure()
+    raise error
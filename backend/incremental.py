@@ -0,0 +1,145 @@
+from bisect import bisect_left
+from typing import Tuple
+
+import complex_patterns
+from explanation_generator import explanation_key, explain_unique_terms
+from section_index import SectionIndex
+from term_identifier import identify_terms_between
+from term_store import TermStore
+from metrics import timed
+
+def common_prefix_length(a: str, b: str) -> int:
+    """
+    Length of the common prefix of two strings, found by binary search over
+    slice comparisons so long documents are compared at C speed
+    """
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def common_suffix_length(a: str, b: str, limit: int) -> int:
+    """
+    Length of the common suffix of two strings, at most limit characters
+    """
+    low, high = 0, min(len(a), len(b), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:] == b[len(b) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def diff_range(old_text: str, new_text: str) -> Tuple[int, int, str]:
+    """
+    Smallest single edit turning old_text into new_text, as
+    (start, old_end, replacement)
+    """
+    start = common_prefix_length(old_text, new_text)
+    suffix = common_suffix_length(old_text, new_text, min(len(old_text), len(new_text)) - start)
+    return start, len(old_text) - suffix, new_text[start:len(new_text) - suffix]
+
+def _widen(old_store: TermStore, window_start: int, window_end: int, delta: int) -> Tuple[int, int]:
+    """
+    Widen a window of the new text until no unchanged term straddles its edges
+    """
+    # No term is longer than a clause, so only terms starting less than that
+    # before an edge can straddle it
+    reach = complex_patterns.registry.clause_max_chars
+    starts, ends = old_store.starts, old_store.ends
+    widened = True
+    while widened:
+        widened = False
+        for row in range(bisect_left(starts, window_start - reach), bisect_left(starts, window_start)):
+            if ends[row] > window_start:
+                window_start = starts[row]
+                widened = True
+                break
+        old_window_end = window_end - delta
+        rows = range(bisect_left(starts, old_window_end - reach), bisect_left(starts, old_window_end))
+        furthest = max((ends[row] for row in rows), default=old_window_end)
+        if furthest > old_window_end:
+            window_end = furthest + delta
+            widened = True
+    return window_start, window_end
+
+def _affected_window(old_sections: SectionIndex, new_sections: SectionIndex, sections_end: int,
+                     old_store: TermStore, start: int, old_end: int, new_end: int) -> Tuple[int, int]:
+    """
+    Range of the new text that must be re-scanned: every section touched by
+    the edit, including the one before it and the text up to sections_end
+    whose headings were re-scanned, and any clause that may end in it,
+    widened until no unchanged term straddles its edges. Terms outside the
+    window then keep their sections, shifted by the change in headings.
+    """
+    delta = new_end - old_end
+    window_start = min(
+        old_sections.bounds(old_sections.section_at(start - 1))[0],
+        new_sections.bounds(new_sections.section_at(start))[0],
+        max(0, start - complex_patterns.registry.clause_max_chars)
+    )
+    window_end = max(
+        old_sections.bounds(old_sections.section_at(max(start, old_end - 1)))[1] + delta,
+        new_sections.bounds(new_sections.section_at(max(start, new_end - 1)))[1],
+        sections_end
+    )
+    return _widen(old_store, window_start, window_end, delta)
+
+@timed
+async def reprocess_edit(old_text: str, old_store: TermStore, old_sections: SectionIndex,
+                         insurance_type: str, start: int, old_end: int,
+                         replacement: str) -> Tuple[str, SectionIndex, TermStore, Tuple[int, int]]:
+    """
+    Apply an edit to a processed document, re-scanning only the affected sections.
+
+    Terms outside the affected window keep their explanations and have their
+    offsets shifted. Re-scanned terms reuse explanations from the previous
+    version where possible, and only genuinely new terms are explained.
+    Returns the new text, its section index, its terms and the re-scanned window.
+    """
+    new_text = old_text[:start] + replacement + old_text[old_end:]
+    new_end = start + len(replacement)
+    delta = new_end - old_end
+    new_sections, sections_end = old_sections.apply_edit(new_text, start, old_end, new_end)
+
+    window_start, window_end = _affected_window(old_sections, new_sections, sections_end, old_store,
+                                                start, old_end, new_end)
+
+    # Re-scan the affected window. A re-scanned term running past its end may
+    # hide terms after it, so the window grows to cover such terms.
+    while True:
+        window_store = identify_terms_between(new_text, insurance_type, window_start, window_end)
+        furthest = max(window_store.ends, default=window_end)
+        if furthest <= window_end:
+            break
+        window_start, window_end = _widen(old_store, window_start, furthest, delta)
+
+    # Reuse explanations from the previous version, explaining only new terms
+    explanations = {}
+    unexplained = {}
+    for pair, i in window_store.unique_terms().items():
+        previous = old_store.explanation_for(window_store.term(i), window_store.category(i))
+        if previous is not None:
+            explanations[pair] = previous
+        else:
+            unexplained[pair] = window_store.record(i)
+    if unexplained:
+        explained = await explain_unique_terms(list(unexplained.values()), insurance_type)
+        for pair, term_info in unexplained.items():
+            explanations[pair] = explained[explanation_key(term_info, insurance_type)]
+    window_store.set_explanations(explanations)
+
+    # Keep the terms before the window, whose context is sliced from the new
+    # text on demand, and shift those after it
+    first, last = old_store.row_at(window_start), old_store.row_at(window_end - delta)
+    new_store = old_store.splice(first, last, window_store)
+    new_store.text = new_text
+    window_rows = first + len(window_store)
+    new_store.shift(delta, window_rows, len(new_sections) - len(old_sections))
+    new_store.assign_sections(new_sections, first, window_rows)
+    return new_text, new_sections, new_store, (window_start, window_end)
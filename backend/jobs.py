@@ -0,0 +1,330 @@
+import asyncio
+import copy
+import os
+import pickle
+import re
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from document_processor import iter_pdf_file_pages
+from explanation_generator import explain_term_store
+from metrics import record_document
+from pipeline import extract_and_identify_pdf
+from session_store import get_session_store
+from term_identifier import PageTermScanner, identify_terms_compact
+from term_store import TermStore
+from worker_pool import run_cpu_bound_when_free, cpu_pool_enabled
+
+# Where job state is kept: "memory" or "disk"
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")
+
+# Directory used by the disk backend
+JOB_DIR = os.getenv("JOB_DIR", "jobs")
+
+# Jobs processed at the same time by each API worker
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+
+# Jobs that may wait in the queue before new submissions are rejected
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+
+# Seconds a job is kept after its last update
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "3600"))
+
+# Minimum seconds between saves of progress counters (stage changes are always saved)
+JOB_PROGRESS_INTERVAL = 1.0
+
+# Pipeline stages, in order
+JOB_STAGES = ("extract", "identify", "explain")
+
+_JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+class JobQueueFullError(Exception):
+    """
+    Raised when the job queue is full
+    """
+
+class Job:
+    """
+    A document processing job and its progress
+    """
+
+    def __init__(self, job_id: str, insurance_type: str, text: Optional[str] = None, path: Optional[str] = None):
+        self.job_id = job_id
+        self.insurance_type = insurance_type
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.stages: Dict[str, Dict[str, Any]] = {stage: {"status": "pending"} for stage in JOB_STAGES}
+        self.text = text
+        self.path = path
+        self.terms: Optional[TermStore] = None
+        self.document_id: Optional[str] = None
+        self.version: Optional[int] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    def status_fields(self) -> Dict[str, Any]:
+        """
+        Job status as JSON-serializable fields
+        """
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "stages": self.stages,
+            "document_id": self.document_id,
+            "version": self.version,
+            "insurance_type": self.insurance_type,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+    def terms_snapshot(self) -> Optional[TermStore]:
+        """
+        Copy of the identified terms that stays consistent while explanations
+        are still being attached to the original
+        """
+        return copy.copy(self.terms) if self.terms is not None else None
+
+class MemoryJobBackend:
+    """
+    Keeps jobs in process memory
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def put(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.job_id] = job
+
+    def expire(self, cutoff: float) -> None:
+        with self._lock:
+            for job_id in [key for key, job in self._jobs.items() if job.updated_at < cutoff]:
+                del self._jobs[job_id]
+
+class DiskJobBackend:
+    """
+    Keeps jobs as pickle files in a local directory, so any worker on the same
+    machine can report the progress of a job
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.pkl")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        try:
+            with open(self._path(job_id), "rb") as job_file:
+                return pickle.load(job_file)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+
+    def put(self, job: Job) -> None:
+        # Write to a temporary file first so readers never see a partial job
+        path = self._path(job.job_id)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as job_file:
+            pickle.dump(job, job_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    def expire(self, cutoff: float) -> None:
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+class JobManager:
+    """
+    Runs document processing jobs from an in-process queue, a few at a time
+    """
+
+    def __init__(self, backend, concurrency: int = JOB_CONCURRENCY, queue_size: int = JOB_QUEUE_SIZE,
+                 retention: float = JOB_RETENTION):
+        self.backend = backend
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.retention = retention
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_saved: Dict[str, float] = {}
+
+    def _ensure_workers(self) -> asyncio.Queue:
+        # The queue and worker tasks belong to the event loop that submits jobs
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(self.queue_size)
+            self._workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+        return self._queue
+
+    def submit(self, insurance_type: str, text: Optional[str] = None, path: Optional[str] = None) -> Job:
+        """
+        Queue a document for processing, given either its text or the path of a
+        spooled PDF, which the job deletes when it finishes
+        """
+        self.backend.expire(time.time() - self.retention)
+        queue = self._ensure_workers()
+        job = Job(secrets.token_urlsafe(16), insurance_type, text, path)
+        try:
+            queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFullError("Too many documents are waiting to be processed, please retry shortly")
+        self.backend.put(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Look up a job, returning None if it does not exist or has expired
+        """
+        if not _JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        return self.backend.get(job_id)
+
+    def _save(self, job: Job, force: bool = True) -> None:
+        now = time.time()
+        job.updated_at = now
+        if force or now - self._last_saved.get(job.job_id, 0) >= JOB_PROGRESS_INTERVAL:
+            self._last_saved[job.job_id] = now
+            self.backend.put(job)
+
+    def _set_stage(self, job: Job, stage: str, status: str, **progress) -> None:
+        job.stages[stage].update(status=status, **progress)
+        self._save(job)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.status = "running"
+        try:
+            await self._extract_and_identify(job)
+
+            # Explanations are published as each batch completes
+            self._set_stage(job, "explain", "running", explained=0)
+            def report(explained: int, total: int) -> None:
+                job.stages["explain"].update(explained=explained, total=total)
+                self._save(job, force=False)
+            await explain_term_store(job.terms, job.insurance_type, report)
+            self._set_stage(job, "explain", "completed")
+            record_document("job", job.text, len(job.terms))
+
+            # Keep the processed document so follow-up questions can refer to it by ID
+            session = get_session_store().create(job.text, job.insurance_type, job.terms)
+            job.document_id = session.document_id
+            job.version = session.version
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "Server shut down before the job finished"
+            raise
+        except Exception as e:
+            print(f"Job {job.job_id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+            for progress in job.stages.values():
+                if progress["status"] == "running":
+                    progress["status"] = "failed"
+        finally:
+            if job.path:
+                os.remove(job.path)
+                job.path = None
+            self._save(job)
+            self._last_saved.pop(job.job_id, None)
+
+    async def _extract_and_identify(self, job: Job) -> None:
+        if job.path and cpu_pool_enabled():
+            # Parse the PDF and identify terms in a worker process, waiting
+            # for a free slot rather than failing when the pool is busy
+            self._set_stage(job, "extract", "running")
+            self._set_stage(job, "identify", "running")
+            text, store = await run_cpu_bound_when_free(extract_and_identify_pdf, job.path, job.insurance_type)
+            job.text = text
+            self._set_stage(job, "extract", "completed", characters=len(text))
+        elif job.path:
+            # Parse and scan page by page in a worker thread, reporting each page
+            self._set_stage(job, "extract", "running", pages=0)
+            self._set_stage(job, "identify", "running", terms=0)
+            loop = asyncio.get_running_loop()
+            pages = iter_pdf_file_pages(job.path)
+            scanner = PageTermScanner(job.insurance_type)
+            try:
+                while True:
+                    page_text = await loop.run_in_executor(None, next, pages, None)
+                    if page_text is None:
+                        break
+                    await loop.run_in_executor(None, scanner.add_page, page_text)
+                    job.stages["extract"]["pages"] = len(scanner.pages)
+                    job.stages["identify"]["terms"] = len(scanner.store)
+                    self._save(job, force=False)
+            finally:
+                pages.close()
+            store = await loop.run_in_executor(None, scanner.finish)
+            job.text = store.text
+            self._set_stage(job, "extract", "completed", characters=len(job.text))
+        else:
+            self._set_stage(job, "extract", "completed", characters=len(job.text))
+            self._set_stage(job, "identify", "running")
+            if cpu_pool_enabled():
+                store = await run_cpu_bound_when_free(identify_terms_compact, job.text, job.insurance_type)
+            else:
+                store = await asyncio.get_running_loop().run_in_executor(None, identify_terms_compact, job.text, job.insurance_type)
+
+        # Terms are available to pollers from here on, before explanations
+        job.terms = store
+        self._set_stage(job, "identify", "completed", terms=len(store))
+
+    async def shutdown(self) -> None:
+        """
+        Stop the workers, marking jobs that have not finished as failed
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+                job.status = "failed"
+                job.error = "Server shut down before the job started"
+                if job.path:
+                    os.remove(job.path)
+                    job.path = None
+                self._save(job)
+        self._loop = None
+        self._queue = None
+
+_job_manager: Optional[JobManager] = None
+
+def get_job_manager() -> JobManager:
+    """
+    Get the shared job manager, creating it on first use
+    """
+    global _job_manager
+    if _job_manager is None:
+        if JOB_BACKEND == "disk":
+            backend = DiskJobBackend(JOB_DIR)
+        else:
+            backend = MemoryJobBackend()
+        _job_manager = JobManager(backend)
+    return _job_manager
@@ -1,15 +1,36 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import os
 import json
-from typing import Optional, List, Dict, Any
-import uvicorn
+import hashlib
+import time
+from typing import Optional, List, Dict, Any, Tuple
+from dotenv import load_dotenv
 
-from document_processor import process_document, extract_text_from_pdf
-from term_identifier import identify_terms
-from explanation_generator import generate_explanations
-from question_answerer import answer_question, identify_question_type, extract_personal_context
+# Load environment variables before the modules below read their settings
+load_dotenv()
+
+from document_processor import process_document, aiter_pdf_file_pages, spool_upload
+from term_identifier import PageTermScanner, identify_terms_compact
+from term_store import TermStore, JSON_FORMATS
+from pipeline import extract_and_identify_pdf
+from incremental import diff_range, reprocess_edit
+from session_store import get_session_store
+from jobs import get_job_manager, JobQueueFullError
+from batch import BatchDocument, process_batch, BATCH_MAX_DOCUMENTS
+from worker_pool import run_cpu_bound, cpu_pool_enabled, shutdown_executor, pending_jobs, PoolSaturatedError, JobTimeoutError
+from http_client import close_client
+from answer_cache import get_answer_cache
+from explanation_cache import get_explanation_cache
+from document_cache import get_document_cache, normalize_text, text_digest
+from compression import choose_encoding, compress_stream, compress_async_stream, COMPRESSION_MIN_BYTES
+from explanation_generator import explain_term_store
+from question_answerer import answer_question, answer_question_stream
+from question_classifier import classify_question
+from glossary import get_glossary
+from metrics import (registry, record_document, start_profile, finish_profile, server_timing,
+                     REQUEST_SECONDS, REQUESTS, REQUEST_PROFILING, PROFILE_HEADER)
 
 app = FastAPI(
     title="InsurSpeak API",
@@ -26,65 +47,503 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Time each request per route. When profiling is enabled and the client
+    sends the profile header, return a stage-by-stage breakdown in a
+    Server-Timing header.
+    """
+    profile_token = start_profile() if REQUEST_PROFILING and request.headers.get(PROFILE_HEADER) else None
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        profile = finish_profile(profile_token) if profile_token is not None else None
+        
+        # Label by route template so IDs in paths do not create new series
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        REQUEST_SECONDS.observe(elapsed, method=request.method, route=route_path)
+        REQUESTS.inc(method=request.method, route=route_path, status=status)
+    
+    if profile is not None:
+        response.headers["Server-Timing"] = server_timing(profile, elapsed)
+    return response
+
+@app.on_event("startup")
+def preload_glossary():
+    # Load the compiled glossary before the first request rather than during it
+    get_glossary()
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    await get_job_manager().shutdown()
+    shutdown_executor()
+    await close_client()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to InsurSpeak API"}
 
+# Term formats for processed documents (see TermStore.iter_json)
+RESPONSE_FORMATS = JSON_FORMATS
+
+def check_response_format(response_format: str) -> None:
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"response_format must be one of: {', '.join(RESPONSE_FORMATS)}")
+
+def document_response(request: Request, fields: Dict[str, Any], document_text: str, store: TermStore,
+                      response_format: str, include_text: bool) -> StreamingResponse:
+    """
+    Stream a processed document as JSON without building the whole body in
+    memory, compressed with brotli or gzip when the client accepts it
+    """
+    terms_json = store.iter_json(response_format)
+    
+    def body():
+        yield "{" + "".join(f"{json.dumps(key)}: {json.dumps(value)}, " for key, value in fields.items())
+        yield '"response_format": ' + json.dumps(response_format)
+        if include_text:
+            yield ', "original_text": ' + json.dumps(document_text)
+        yield ', "terms": '
+        yield from terms_json
+        yield "}"
+    
+    encoding = None
+    if len(document_text) >= COMPRESSION_MIN_BYTES:
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    
+    return StreamingResponse(compress_stream(body(), encoding), media_type="application/json", headers=headers)
+
+async def process_pdf_document(path: str, insurance_type: str) -> Tuple[str, TermStore]:
+    """
+    Extract, identify and explain the terms of a spooled PDF, deleting it afterwards
+    """
+    try:
+        if cpu_pool_enabled():
+            # Parse the PDF and identify terms in a worker process
+            document_text, term_store = await run_cpu_bound(extract_and_identify_pdf, path, insurance_type)
+        else:
+            # Identify terms page by page as the PDF is parsed
+            scanner = PageTermScanner(insurance_type)
+            async for page_text in aiter_pdf_file_pages(path):
+                scanner.add_page(page_text)
+            term_store = scanner.finish()
+            document_text = term_store.text
+    finally:
+        os.remove(path)
+    
+    # Generate explanations for identified terms
+    await explain_term_store(term_store, insurance_type)
+    record_document("process_document", document_text, len(term_store))
+    return document_text, term_store
+
+async def process_text_document(document_text: str, insurance_type: str) -> Tuple[str, TermStore]:
+    """
+    Identify and explain the terms of a pasted document
+    """
+    if cpu_pool_enabled():
+        term_store = await run_cpu_bound(identify_terms_compact, document_text, insurance_type)
+    else:
+        term_store = identify_terms_compact(document_text, insurance_type)
+    
+    await explain_term_store(term_store, insurance_type)
+    record_document("process_document", document_text, len(term_store))
+    return document_text, term_store
+
 @app.post("/process-document")
 async def process_document_endpoint(
+    request: Request,
     file: Optional[UploadFile] = File(None),
     text_content: Optional[str] = Form(None),
-    insurance_type: str = Form(...)
+    insurance_type: str = Form(...),
+    response_format: str = Form("compact"),
+    include_text: bool = Form(True),
+    bypass_cache: bool = Form(False)
 ):
     """
     Process an insurance document (PDF upload or text input)
-    and identify complex terms with explanations
+    and identify complex terms with explanations.
+    
+    Terms are returned in the compact columnar format unless response_format
+    is "reference" or "full". Set include_text to false to leave out
+    original_text when the client already has it.
+    
+    Results are cached by content, so a document that was processed before
+    is returned without re-processing it. Set bypass_cache to process it again.
     """
     if not file and not text_content:
         raise HTTPException(status_code=400, detail="Either file or text_content must be provided")
+    check_response_format(response_format)
+    cache = get_document_cache()
     
     # Process the document
-    if file:
-        document_text = await extract_text_from_pdf(file)
+    try:
+        if file:
+            # Spool the upload, hashing its raw bytes on the way
+            digest = hashlib.sha256()
+            path = await spool_upload(file, digest)
+            key = cache.key(digest.hexdigest(), insurance_type)
+            
+            def compute():
+                # Other requests for the same upload may share the computation
+                # and it may outlive this one, so it takes over the spooled file
+                nonlocal path
+                owned_path, path = path, None
+                return process_pdf_document(owned_path, insurance_type)
+        else:
+            # Pasted text is normalized first, so the same document pasted
+            # from different platforms is processed once
+            document_text = normalize_text(text_content)
+            key = cache.key(text_digest(document_text), insurance_type)
+            path = None
+            
+            def compute():
+                return process_text_document(document_text, insurance_type)
+        
+        try:
+            if bypass_cache:
+                document_text, term_store = await compute()
+            else:
+                document_text, term_store = await cache.get_or_compute(key, compute)
+        finally:
+            if path:
+                os.remove(path)
+    except PoolSaturatedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except JobTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    
+    # Keep the processed document so follow-up questions can refer to it by ID
+    session = get_session_store().create(document_text, insurance_type, term_store)
+    
+    return document_response(request, {
+        "document_id": session.document_id,
+        "version": session.version,
+        "insurance_type": insurance_type
+    }, document_text, term_store, response_format, include_text)
+
+@app.post("/process-document/incremental")
+async def process_document_incremental_endpoint(
+    request: Request,
+    document_id: str = Form(...),
+    text_content: Optional[str] = Form(None),
+    edit_start: Optional[int] = Form(None),
+    edit_end: Optional[int] = Form(None),
+    replacement: str = Form(""),
+    base_version: Optional[int] = Form(None),
+    response_format: str = Form("compact"),
+    include_text: bool = Form(True)
+):
+    """
+    Re-process an edited version of a previously processed document.
+    
+    Send either the full edited text as text_content, or the changed range
+    (edit_start and edit_end in the previous text) and its replacement.
+    Only the sections touched by the edit are re-scanned.
+    """
+    check_response_format(response_format)
+    store = get_session_store()
+    session = store.get(document_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Document not found or expired, please process it again")
+    
+    if base_version is not None and base_version != session.version:
+        raise HTTPException(status_code=409, detail=f"Document has changed since version {base_version}, current version is {session.version}")
+    
+    if text_content is not None:
+        start, old_end, replacement = diff_range(session.text, text_content)
+    elif edit_start is not None:
+        start = edit_start
+        old_end = edit_end if edit_end is not None else edit_start
+        if not 0 <= start <= old_end <= len(session.text):
+            raise HTTPException(status_code=400, detail="Edit range is outside the document")
     else:
-        document_text = text_content
+        raise HTTPException(status_code=400, detail="Either text_content or edit_start must be provided")
     
-    # Identify complex terms
-    identified_terms = identify_terms(document_text, insurance_type)
+    document_text, sections, term_store, rescanned = await reprocess_edit(
+        session.text, session.terms, session.sections, session.insurance_type, start, old_end, replacement
+    )
+    store.update(session, document_text, sections, term_store)
+    record_document("incremental", document_text, len(term_store))
     
-    # Generate explanations for identified terms
-    terms_with_explanations = generate_explanations(identified_terms, insurance_type)
+    return document_response(request, {
+        "document_id": session.document_id,
+        "version": session.version,
+        "rescanned_range": {"start_index": rescanned[0], "end_index": rescanned[1]},
+        "insurance_type": session.insurance_type
+    }, document_text, term_store, response_format, include_text)
+
+@app.post("/jobs")
+async def submit_job_endpoint(
+    file: Optional[UploadFile] = File(None),
+    text_content: Optional[str] = Form(None),
+    insurance_type: str = Form(...)
+):
+    """
+    Queue an insurance document (PDF upload or text input) for processing in
+    the background. Poll /jobs/{job_id} for progress and results.
+    """
+    if not file and not text_content:
+        raise HTTPException(status_code=400, detail="Either file or text_content must be provided")
     
-    return JSONResponse(content={
-        "original_text": document_text,
-        "terms": terms_with_explanations,
-        "insurance_type": insurance_type
-    })
+    path = await spool_upload(file) if file else None
+    try:
+        job = get_job_manager().submit(insurance_type, text=None if file else text_content, path=path)
+    except JobQueueFullError as e:
+        if path:
+            os.remove(path)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    
+    return JSONResponse(status_code=202, content=job.status_fields())
+
+@app.get("/jobs/{job_id}")
+async def job_status_endpoint(
+    request: Request,
+    job_id: str,
+    response_format: str = "compact",
+    include_text: bool = True
+):
+    """
+    Report a job's progress per stage. Once terms have been identified they are
+    included in the requested format, and explanations are filled in as they
+    complete.
+    """
+    check_response_format(response_format)
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    
+    terms = job.terms_snapshot()
+    if terms is None:
+        return JSONResponse(content=job.status_fields())
+    return document_response(request, job.status_fields(), job.text, terms, response_format, include_text)
+
+@app.post("/process-batch")
+async def process_batch_endpoint(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    insurance_type: str = Form(...),
+    response_format: str = Form("compact"),
+    include_text: bool = Form(False)
+):
+    """
+    Process a bundle of insurance documents (PDF or .txt uploads) and stream
+    one NDJSON line per document as each finishes. A document that fails gets
+    a line with its error instead of failing the whole batch.
+    """
+    check_response_format(response_format)
+    if len(files) > BATCH_MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {BATCH_MAX_DOCUMENTS} documents")
+    
+    # Spool every upload before responding, since the request body cannot be
+    # read once the response has started
+    documents = []
+    try:
+        for file in files:
+            name = file.filename or f"document-{len(documents)}"
+            path = await spool_upload(file)
+            documents.append(BatchDocument(name, path, not name.lower().endswith(".txt"), temporary=True))
+    except Exception:
+        for document in documents:
+            os.remove(document.path)
+        raise
+    
+    async def lines():
+        async for _, line in process_batch(documents, insurance_type, response_format, include_text):
+            yield line
+    
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    
+    return StreamingResponse(compress_async_stream(lines(), encoding), media_type="application/x-ndjson", headers=headers)
+
+def resolve_document(document_id: Optional[str], document_text: Optional[str], insurance_type: Optional[str]):
+    """
+    Get the document text, insurance type, retrieval index, fact index and
+    fingerprint for a question, from the session store when a document_id is
+    given
+    """
+    document_index = None
+    fact_index = None
+    fingerprint = None
+    if document_id:
+        store = get_session_store()
+        session = store.get(document_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Document not found or expired, please process it again")
+        document_text = session.text
+        insurance_type = insurance_type or session.insurance_type
+        document_index = store.get_document_index(session)
+        fact_index = store.get_fact_index(session)
+        fingerprint = session.fingerprint
+    elif not document_text:
+        raise HTTPException(status_code=400, detail="Either document_id or document_text must be provided")
+    
+    if not insurance_type:
+        raise HTTPException(status_code=400, detail="insurance_type must be provided")
+    
+    return document_text, insurance_type, document_index, fact_index, fingerprint
+
+@app.get("/documents/{document_id}/facts")
+def document_facts_endpoint(document_id: str, term: Optional[str] = None):
+    """
+    Amounts, percentages and periods stated in a processed document, each
+    with the insurance term it describes. Pass term to get one term's facts.
+    """
+    store = get_session_store()
+    session = store.get(document_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Document not found or expired, please process it again")
+    
+    fact_index = store.get_fact_index(session)
+    return {
+        "document_id": session.document_id,
+        "version": session.version,
+        "terms": fact_index.terms(),
+        "facts": fact_index.to_dicts(term)
+    }
 
 @app.post("/ask-question")
 async def ask_question_endpoint(
     question: str = Form(...),
-    document_text: str = Form(...),
-    insurance_type: str = Form(...)
+    document_text: Optional[str] = Form(None),
+    insurance_type: Optional[str] = Form(None),
+    document_id: Optional[str] = Form(None),
+    bypass_cache: bool = Form(False)
 ):
     """
-    Answer a specific question about an insurance policy
+    Answer a specific question about an insurance policy, given either the
+    document text or the document_id returned by /process-document.
+    Factual questions about a processed document, such as the amount of its
+    deductible, are answered from its fact index without the LLM.
+    Set bypass_cache to skip cached answers and the fact index.
     """
-    # Identify the type of question (coverage, recommendation, etc.)
-    question_type = identify_question_type(question)
+    document_text, insurance_type, document_index, fact_index, fingerprint = resolve_document(document_id, document_text,
+                                                                                               insurance_type)
     
-    # Extract any personal context from the question
-    personal_context = extract_personal_context(question)
+    # Identify the type of question (coverage, recommendation, etc.) and any
+    # personal context, once for both the response and the answer
+    classification = classify_question(question)
     
     # Get the answer
-    answer = answer_question(question, document_text, insurance_type)
+    answer = await answer_question(question, document_text, insurance_type, document_index, classification, not bypass_cache,
+                                   fact_index, fingerprint)
     
     return JSONResponse(content={
         "question": question,
         "answer": answer,
-        "question_type": question_type,
-        "personal_context": personal_context
+        "question_type": classification.question_type,
+        "personal_context": classification.personal_context
     })
 
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """
+    Format a Server-Sent Events message
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/ask-question/stream")
+async def ask_question_stream_endpoint(
+    request: Request,
+    question: str = Form(...),
+    document_text: Optional[str] = Form(None),
+    insurance_type: Optional[str] = Form(None),
+    document_id: Optional[str] = Form(None),
+    bypass_cache: bool = Form(False)
+):
+    """
+    Answer a question like /ask-question, streaming the answer as Server-Sent
+    Events: a "meta" event, then "token" events, then "done"
+    """
+    document_text, insurance_type, document_index, fact_index, fingerprint = resolve_document(document_id, document_text,
+                                                                                               insurance_type)
+    
+    classification = classify_question(question)
+    
+    async def event_stream():
+        yield format_sse("meta", {
+            "question": question,
+            "question_type": classification.question_type,
+            "personal_context": classification.personal_context
+        })
+        
+        answer_stream = answer_question_stream(question, document_text, insurance_type, document_index, classification,
+                                               not bypass_cache, fact_index, fingerprint)
+        try:
+            async for chunk in answer_stream:
+                # Stop generating (and close the upstream request) once the client is gone
+                if await request.is_disconnected():
+                    break
+                yield format_sse("token", {"text": chunk})
+            else:
+                yield format_sse("done", {})
+        finally:
+            await answer_stream.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/cache/stats")
+def cache_stats_endpoint():
+    """
+    Hit, miss and size counts for the document, answer and explanation caches
+    """
+    return {
+        "documents": get_document_cache().stats(),
+        "answers": get_answer_cache().stats(),
+        "explanations": get_explanation_cache().stats()
+    }
+
+def cache_stats_by_name() -> Dict[str, Dict[str, Any]]:
+    explanation_stats = get_explanation_cache().stats()
+    answer_stats = get_answer_cache().stats()
+    document_stats = get_document_cache().stats()
+    caches = {
+        "documents": {**document_stats, "hits": document_stats["hits"] + document_stats["shared_computations"]},
+        "answers": {**answer_stats, "hits": answer_stats["hits"] + answer_stats["near_duplicate_hits"]},
+        "explanations_memory": explanation_stats["memory"]
+    }
+    if explanation_stats["disk"] is not None:
+        caches["explanations_disk"] = explanation_stats["disk"]
+    return caches
+
+def cache_hit_ratios():
+    for name, stats in cache_stats_by_name().items():
+        lookups = stats["hits"] + stats["misses"]
+        yield (name,), stats["hits"] / lookups if lookups else 0.0
+
+registry.callback("insurspeak_cache_hits_total", "Cache lookups that found an entry", "counter", ["cache"],
+                  lambda: [((name,), stats["hits"]) for name, stats in cache_stats_by_name().items()])
+registry.callback("insurspeak_cache_misses_total", "Cache lookups that found nothing", "counter", ["cache"],
+                  lambda: [((name,), stats["misses"]) for name, stats in cache_stats_by_name().items()])
+registry.callback("insurspeak_cache_hit_ratio", "Share of cache lookups that found an entry", "gauge", ["cache"],
+                  cache_hit_ratios)
+registry.callback("insurspeak_cache_entries", "Entries currently in each cache", "gauge", ["cache"],
+                  lambda: [((name,), stats["size"]) for name, stats in cache_stats_by_name().items()])
+registry.callback("insurspeak_cpu_pool_pending_jobs", "Jobs running in or waiting for the process pool", "gauge", [],
+                  lambda: [((), pending_jobs())])
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    Stage timings, LLM calls, cache effectiveness and document sizes in the
+    Prometheus text format
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,313 @@
+"""
+In-process metrics in the Prometheus text format, and per-request profiles.
+
+Stage timings, LLM calls and document sizes are recorded in counters and
+histograms owned by this module and exposed on /metrics. Work done inside
+pool worker processes is timed from the API process, around the pool call.
+
+A request can also be profiled: every span that completes while handling it
+is collected and returned as a stage-by-stage breakdown.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Whether clients may ask for a per-request stage breakdown with PROFILE_HEADER
+REQUEST_PROFILING = os.getenv("REQUEST_PROFILING", "false").lower() in ("1", "true", "yes")
+
+# Request header that turns on profiling for one request
+PROFILE_HEADER = "X-Profile"
+
+# Histogram buckets for durations, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Histogram buckets for document sizes, in characters
+DOCUMENT_SIZE_BUCKETS = (1000, 10000, 50000, 100000, 500000, 1000000, 5000000)
+
+# Histogram buckets for the number of terms identified in a document
+TERM_COUNT_BUCKETS = (10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+# Histogram buckets for the size of LLM prompts, in tokens
+PROMPT_TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 128000)
+
+# A sample: metric name suffix, label pairs and value
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    """
+    A monotonically increasing count per combination of label values
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", tuple(zip(self.label_names, key)), value
+
+class Histogram:
+    """
+    Observations counted into cumulative buckets per combination of label values
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: counts per bucket, the last one for +Inf
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.label_names)
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            counts[bucket] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        for key, counts, total in values:
+            labels = tuple(zip(self.label_names, key))
+            cumulative = 0
+            for upper, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", labels + (("le", _format_value(upper)),), cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
+
+class CallbackMetric:
+    """
+    A gauge or counter kept elsewhere, e.g. by a cache, and read when metrics
+    are collected from a callback returning (label values, value) pairs
+    """
+
+    def __init__(self, name: str, description: str, kind: str, label_names: Sequence[str],
+                 read: Callable[[], Iterable[Tuple[Sequence[str], float]]]):
+        self.name = name
+        self.kind = kind
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.read = read
+
+    def samples(self) -> Iterator[Sample]:
+        try:
+            values = list(self.read())
+        except Exception as e:
+            print(f"Error reading metric {self.name}: {e}")
+            return
+        for key, value in values:
+            yield "", tuple(zip(self.label_names, map(str, key))), value
+
+class MetricsRegistry:
+    """
+    The metrics exposed by this process
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, description: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, description, label_names))
+
+    def histogram(self, name: str, description: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def callback(self, name: str, description: str, kind: str, label_names: Sequence[str],
+                 read: Callable[[], Iterable[Tuple[Sequence[str], float]]]) -> CallbackMetric:
+        return self._register(CallbackMetric(name, description, kind, label_names, read))
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "insurspeak_stage_seconds", "Time spent in each pipeline stage", ["stage"]
+)
+STAGE_ERRORS = registry.counter(
+    "insurspeak_stage_errors_total", "Pipeline stages that raised an error", ["stage"]
+)
+REQUEST_SECONDS = registry.histogram(
+    "insurspeak_request_seconds", "Time until the response starts, per route", ["method", "route"]
+)
+REQUESTS = registry.counter(
+    "insurspeak_requests_total", "HTTP requests per route and status code", ["method", "route", "status"]
+)
+LLM_SECONDS = registry.histogram(
+    "insurspeak_llm_request_seconds", "LLM API call latency, including retries", ["operation"]
+)
+LLM_REQUESTS = registry.counter(
+    "insurspeak_llm_requests_total", "LLM API calls per outcome", ["operation", "outcome"]
+)
+LLM_RETRIES = registry.counter(
+    "insurspeak_llm_retries_total", "LLM API attempts that were retried", ["operation"]
+)
+LLM_TOKENS = registry.counter(
+    "insurspeak_llm_tokens_total", "Tokens reported by the LLM API", ["operation", "kind"]
+)
+PROMPT_TOKENS = registry.histogram(
+    "insurspeak_llm_prompt_tokens", "Prompt tokens per LLM request, counted before sending", ["operation"],
+    PROMPT_TOKEN_BUCKETS
+)
+FACT_ANSWERS = registry.counter(
+    "insurspeak_fact_answers_total", "Questions answered from a document's fact index without an LLM call"
+)
+DOCUMENT_CHARACTERS = registry.histogram(
+    "insurspeak_document_characters", "Size of processed documents in characters", ["source"],
+    DOCUMENT_SIZE_BUCKETS
+)
+DOCUMENT_TERMS = registry.histogram(
+    "insurspeak_document_terms", "Terms identified per processed document", ["source"], TERM_COUNT_BUCKETS
+)
+
+# Spans completed while handling the current request, when it is profiled
+_profile: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("profile", default=None)
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time a block of work as a pipeline stage
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        profile = _profile.get()
+        if profile is not None:
+            profile.append((stage, elapsed))
+
+def timed(func: Callable) -> Callable:
+    """
+    Decorator timing every call of a function, sync or async, as a stage
+    named after the function
+    """
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span(func.__name__):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+def record_document(source: str, text: str, term_count: int) -> None:
+    """
+    Record the size of a processed document
+    """
+    DOCUMENT_CHARACTERS.observe(len(text), source=source)
+    DOCUMENT_TERMS.observe(term_count, source=source)
+
+def record_llm_usage(operation: str, response_data: Dict) -> None:
+    """
+    Count the tokens reported in an LLM API response
+    """
+    usage = response_data.get("usage") or {}
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            LLM_TOKENS.inc(usage[kind], operation=operation, kind=kind[:-len("_tokens")])
+    # Prompt tokens the provider served from its prompt cache
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached:
+        LLM_TOKENS.inc(cached, operation=operation, kind="cached_prompt")
+
+def start_profile() -> contextvars.Token:
+    """
+    Start collecting the spans of the current request
+    """
+    return _profile.set([])
+
+def finish_profile(token: contextvars.Token) -> List[Tuple[str, float, int]]:
+    """
+    Stop collecting spans and return (stage, total seconds, calls) per stage,
+    in the order stages first completed
+    """
+    spans = _profile.get() or []
+    _profile.reset(token)
+    totals: Dict[str, List[float]] = {}
+    for stage, elapsed in spans:
+        total = totals.setdefault(stage, [0.0, 0])
+        total[0] += elapsed
+        total[1] += 1
+    return [(stage, total, int(calls)) for stage, (total, calls) in totals.items()]
+
+def server_timing(profile: List[Tuple[str, float, int]], total: float) -> str:
+    """
+    A profile as a Server-Timing header value, shown by browser developer tools
+    """
+    entries = [f'{stage};dur={elapsed * 1000:.1f};desc="{calls} call{"s" if calls != 1 else ""}"'
+               for stage, elapsed, calls in profile]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
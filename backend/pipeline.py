@@ -0,0 +1,29 @@
+from typing import Tuple
+
+from document_processor import iter_pdf_file_pages
+from term_identifier import PageTermScanner, identify_terms_compact
+from term_store import TermStore
+from metrics import timed
+
+# Pipeline stages that are safe to run in a worker process. They only take
+# and return plain, picklable values.
+
+@timed
+def extract_and_identify_pdf(path: str, insurance_type: str) -> Tuple[str, TermStore]:
+    """
+    Extract the text of a spooled PDF and identify its terms page by page
+    """
+    scanner = PageTermScanner(insurance_type)
+    for page_text in iter_pdf_file_pages(path):
+        scanner.add_page(page_text)
+    store = scanner.finish()
+    return store.text, store
+
+@timed
+def identify_text_file(path: str, insurance_type: str) -> Tuple[str, TermStore]:
+    """
+    Read a plain text document and identify its terms
+    """
+    with open(path, encoding="utf-8") as text_file:
+        text = text_file.read()
+    return text, identify_terms_compact(text, insurance_type)
@@ -1,29 +1,96 @@
 import os
-import re
 import sys
-import requests
 import json
-from typing import Dict, Any, List
-from dotenv import load_dotenv
+import asyncio
+from typing import AsyncIterator, Dict, Any, List, Optional
 
-# Load environment variables
-load_dotenv()
+from http_client import post_chat_completion, stream_chat_completion, LLMRequestError
+from answer_cache import get_answer_cache
+from question_classifier import QuestionClassification, classify_question
+from retrieval import DocumentIndex, get_document_index, document_fingerprint
+from fact_index import FactIndex
+from metrics import FACT_ANSWERS, timed
+from token_budget import (ANSWER_PROMPT_TOKENS, LLM_MODEL, chat_request, count_message_tokens, count_tokens,
+                          prompt_token_budget, truncate_to_tokens)
 
-def answer_question(question: str, document_text: str, insurance_type: str) -> str:
+# Seconds between words when streaming mock answers, to mimic model output
+MOCK_STREAM_DELAY = float(os.getenv("MOCK_STREAM_DELAY", "0.02"))
+
+# Longest answer the model may write, in tokens
+ANSWER_MAX_TOKENS = 500
+
+# Instructions for every question, sent as the system message
+ANSWER_INSTRUCTIONS = """You are an insurance expert assistant helping a user understand their insurance policy. Your goal is to explain complex insurance concepts in simple terms.
+
+Provide a clear, straightforward answer that:
+1. Directly addresses the user's question
+2. Uses simple language (aim for 8th-grade reading level)
+3. Explains any technical terms you need to use
+4. Does NOT provide legal advice or definitive coverage determinations
+5. Includes appropriate disclaimers when the answer requires interpretation
+
+If the answer cannot be determined from the policy text provided, explain what additional information would be needed.
+"""
+
+# Further instructions per question type, appended to ANSWER_INSTRUCTIONS
+QUESTION_TYPE_INSTRUCTIONS = {
+    "recommendation": """
+This appears to be a personalized recommendation question. Please:
+1. Consider the user's individual situation as implied in their question
+2. Explain how various factors (age, health status, family situation, etc.) might affect this decision
+3. Highlight the pros and cons of different options
+4. Suggest what questions they should ask themselves to make the best decision
+5. End with a balanced recommendation but emphasize they should consult with a licensed insurance advisor
+""",
+    "coverage": """
+This appears to be a coverage question. Please:
+1. Clearly state what the policy seems to cover and what it doesn't
+2. Highlight any conditions, limitations, or exclusions that apply
+3. Explain any relevant deductibles, copays, or out-of-pocket costs
+4. Mention if there are any circumstances where coverage might change
+5. Note if there are any ambiguities in the policy that would require clarification
+""",
+    "comparison": """
+This appears to be a comparison question. Please:
+1. Clearly outline the key differences between the options mentioned
+2. Compare costs, coverage, limitations, and benefits objectively
+3. Highlight scenarios where one option might be better than another
+4. Consider different user circumstances in your comparison
+5. Provide a balanced assessment rather than strongly favoring one option
+""",
+    "definition": """
+This appears to be a question about defining a term or concept. Please:
+1. Provide a clear, simple definition in everyday language
+2. Explain why this term matters in the context of insurance
+3. Give a practical example of how this concept works in real life
+4. Note any variations in how this term might be used across different policies
+"""
+}
+
+@timed
+async def answer_question(question: str, document_text: str, insurance_type: str, document_index: Optional[DocumentIndex] = None,
+                          classification: Optional[QuestionClassification] = None, use_cache: bool = True,
+                          fact_index: Optional[FactIndex] = None, fingerprint: Optional[str] = None) -> str:
     """
-    Generate an answer to a user's question about their insurance policy
+    Generate an answer to a user's question about their insurance policy.
+    Pass the question's classification if the caller has already computed it,
+    the document's fact index to answer factual questions without the model,
+    its fingerprint if known, and use_cache=False to always ask the model.
     """
     try:
         # Identify the type of question (coverage, recommendation, interpretation)
-        question_type = identify_question_type(question)
+        # and extract personal context from the question
+        question_type, personal_context = classification or classify_question(question)
         
-        # Extract personal context from the question
-        personal_context = extract_personal_context(question)
+        fact_answer = answer_from_facts(question, question_type, fact_index) if use_cache else None
+        if fact_answer is not None:
+            return fact_answer
         
         # For real OpenAI API implementation
         api_key = os.getenv("OPENAI_API_KEY")
         if api_key:
-            return call_openai_api(question, document_text, insurance_type, question_type, personal_context)
+            return await call_openai_api(question, document_text, insurance_type, question_type, personal_context, document_index, use_cache,
+                                         fingerprint)
         else:
             # Fallback to mock if no API key
             return mock_answer(question, document_text, insurance_type, question_type)
@@ -34,61 +101,42 @@ def answer_question(question: str, document_text: str, insurance_type: str) -> s
         traceback.print_exc()
         return "I'm sorry, I couldn't process your question. Please try again or rephrase your question."
 
-def call_openai_api(question: str, document_text: str, insurance_type: str, question_type: str, personal_context: Dict[str, Any]) -> str:
+@timed
+async def call_openai_api(question: str, document_text: str, insurance_type: str, question_type: str, personal_context: Dict[str, Any],
+                          document_index: Optional[DocumentIndex] = None, use_cache: bool = True,
+                          fingerprint: Optional[str] = None) -> str:
     """
-    Call the OpenAI API to generate an answer
+    Call the OpenAI API to generate an answer, reusing a cached answer to the
+    same question about the same document when there is one
     """
-    # Prepare the prompt
-    prompt = create_question_prompt(question, document_text, insurance_type, question_type, personal_context)
-    
-    # API endpoint
-    api_url = "https://api.openai.com/v1/chat/completions"
-    
-    # Get API key from environment
-    api_key = os.getenv("OPENAI_API_KEY")
-    
-    # Headers with proper authentication
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
+    cache = get_answer_cache()
+    if use_cache and cache.enabled:
+        fingerprint = fingerprint or document_fingerprint(document_text)
+        cached = cache.get(fingerprint, insurance_type, question_type, personal_context, question)
+        if cached is not None:
+            return cached
+    else:
+        fingerprint = None
     
     # Request body
-    data = {
-        "model": "gpt-4o",
-        "messages": [
-            {"role": "system", "content": "You are an insurance expert assistant that explains complex insurance concepts in simple terms."},
-            {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.5,
-        "max_tokens": 500
-    }
+    data = create_answer_request(question, document_text, insurance_type, question_type, personal_context, document_index,
+                                 fingerprint=fingerprint)
     
     try:
-        print(f"Calling OpenAI API with model: gpt-4o")
-        response = requests.post(api_url, headers=headers, json=data)
-        
-        # Check for errors
-        response.raise_for_status()
-        
-        # Parse the response
-        response_data = response.json()
+        print(f"Calling OpenAI API with model: {LLM_MODEL}")
+        response_data = await post_chat_completion(data, operation="answer")
         
         # Extract the generated text
         if "choices" in response_data and len(response_data["choices"]) > 0:
             answer = response_data["choices"][0]["message"]["content"]
+            if fingerprint:
+                cache.set(fingerprint, insurance_type, question_type, personal_context, question, answer)
             return answer
         else:
             return "No answer was generated. Please try again."
     
-    except requests.exceptions.HTTPError as http_err:
-        error_message = f"HTTP error: {http_err}"
-        try:
-            error_data = response.json()
-            if "error" in error_data:
-                error_message = f"API error: {error_data['error']['message']}"
-        except:
-            pass
+    except LLMRequestError as api_err:
+        error_message = str(api_err)
         print(error_message)
         return f"Error: {error_message}"
     
@@ -96,81 +144,116 @@ def call_openai_api(question: str, document_text: str, insurance_type: str, ques
         print(f"Error calling OpenAI API: {e}")
         return f"Error: {str(e)}"
 
-def create_question_prompt(question: str, document_text: str, insurance_type: str, question_type: str, personal_context: Dict[str, Any]) -> str:
+async def answer_question_stream(question: str, document_text: str, insurance_type: str, document_index: Optional[DocumentIndex] = None,
+                                 classification: Optional[QuestionClassification] = None, use_cache: bool = True,
+                                 fact_index: Optional[FactIndex] = None, fingerprint: Optional[str] = None) -> AsyncIterator[str]:
     """
-    Create a prompt for the LLM to answer the question based on the document and question type
+    Generate an answer to a user's question, yielding text as it is produced.
+    A cached answer or one from the fact index is sent as a single chunk.
     """
-    # Truncate document text if it's too long
-    max_text_length = 4000  # Adjust based on token limits
-    truncated_text = document_text[:max_text_length] if len(document_text) > max_text_length else document_text
+    try:
+        question_type, personal_context = classification or classify_question(question)
+        
+        fact_answer = answer_from_facts(question, question_type, fact_index) if use_cache else None
+        if fact_answer is not None:
+            yield fact_answer
+            return
+        
+        if os.getenv("OPENAI_API_KEY"):
+            cache = get_answer_cache()
+            if use_cache and cache.enabled:
+                fingerprint = fingerprint or document_fingerprint(document_text)
+                cached = cache.get(fingerprint, insurance_type, question_type, personal_context, question)
+                if cached is not None:
+                    yield cached
+                    return
+            else:
+                fingerprint = None
+            
+            print(f"Streaming from OpenAI API with model: {LLM_MODEL}")
+            data = create_answer_request(question, document_text, insurance_type, question_type, personal_context, document_index,
+                                         "answer_stream", fingerprint)
+            chunks = []
+            async for chunk in stream_chat_completion(data, operation="answer_stream"):
+                chunks.append(chunk)
+                yield chunk
+            
+            # Only answers that streamed to the end are cached
+            if fingerprint and chunks:
+                cache.set(fingerprint, insurance_type, question_type, personal_context, question, "".join(chunks))
+        else:
+            # Fallback to mock if no API key
+            async for chunk in mock_answer_stream(question, document_text, insurance_type, question_type):
+                yield chunk
     
-    base_prompt = f"""
-    You are an insurance expert assistant helping a user understand their insurance policy. Your goal is to explain complex insurance concepts in simple terms.
-
-    User's insurance policy type: {insurance_type}
+    except LLMRequestError as api_err:
+        print(str(api_err))
+        yield f"Error: {api_err}"
     
-    Relevant policy text:
-    {truncated_text}
+    except Exception as e:
+        print(f"Error generating answer: {e}")
+        yield "I'm sorry, I couldn't process your question. Please try again or rephrase your question."
+
+def answer_from_facts(question: str, question_type: str, fact_index: Optional[FactIndex]) -> Optional[str]:
+    """
+    Answer a factual question, such as the amount of a deductible, from the
+    document's fact index, or return None if the model is needed
+    """
+    if fact_index is None:
+        return None
+    answer = fact_index.answer(question, question_type)
+    if answer is not None:
+        FACT_ANSWERS.inc()
+    return answer
 
-    User question: {question}
+def answer_instructions(question_type: str) -> str:
     """
+    The system message for answering a question of a type. It is the same for
+    every question of that type, so the provider can cache it as a prefix.
+    """
+    return ANSWER_INSTRUCTIONS + QUESTION_TYPE_INSTRUCTIONS.get(question_type, "")
+
+def create_answer_request(question: str, document_text: str, insurance_type: str, question_type: str, personal_context: Dict[str, Any],
+                          document_index: Optional[DocumentIndex] = None, operation: str = "answer",
+                          fingerprint: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Build the chat completion request body for answering a question, filling
+    the prompt token budget with the policy text most relevant to the question
+    """
+    instructions = answer_instructions(question_type)
+    budget = prompt_token_budget(ANSWER_MAX_TOKENS, ANSWER_PROMPT_TOKENS)
+    
+    def prompt_tokens(relevant_text: str) -> int:
+        return count_message_tokens([
+            {"role": "system", "content": instructions},
+            {"role": "user", "content": create_question_prompt(question, insurance_type, personal_context, relevant_text)}
+        ])
+    
+    # Policy text gets whatever the instructions and the question leave over
+    if document_index is None:
+        document_index = get_document_index(document_text, fingerprint)
+    relevant_text = document_index.select_context(question, max(0, budget - prompt_tokens("")))
+    
+    # Text can take a token or two more once joined with the rest of the prompt
+    overflow = prompt_tokens(relevant_text) - budget
+    if overflow > 0:
+        relevant_text = truncate_to_tokens(relevant_text, count_tokens(relevant_text) - overflow)
+    
+    return chat_request(instructions, create_question_prompt(question, insurance_type, personal_context, relevant_text),
+                        ANSWER_MAX_TOKENS, 0.5, operation)
+
+def create_question_prompt(question: str, insurance_type: str, personal_context: Dict[str, Any], relevant_text: str) -> str:
+    """
+    Create the part of the prompt that changes per question: the policy text
+    relevant to it, the question and the user's personal context
+    """
+    prompt = f"User's insurance policy type: {insurance_type}\n\nRelevant policy text:\n{relevant_text}\n\nUser question: {question}"
     
     # Add personal context to the prompt
     if personal_context:
-        base_prompt += f"""
-        User's personal context:
-        {', '.join(f'{key}: {value}' for key, value in personal_context.items())}
-        """
+        prompt += "\n\nUser's personal context: " + ", ".join(f"{key}: {value}" for key, value in personal_context.items())
     
-    # Customize prompt based on question type
-    if question_type == "recommendation":
-        base_prompt += """
-        This appears to be a personalized recommendation question. Please:
-        1. Consider the user's individual situation as implied in their question
-        2. Explain how various factors (age, health status, family situation, etc.) might affect this decision
-        3. Highlight the pros and cons of different options
-        4. Suggest what questions they should ask themselves to make the best decision
-        5. End with a balanced recommendation but emphasize they should consult with a licensed insurance advisor
-        """
-    elif question_type == "coverage":
-        base_prompt += """
-        This appears to be a coverage question. Please:
-        1. Clearly state what the policy seems to cover and what it doesn't
-        2. Highlight any conditions, limitations, or exclusions that apply
-        3. Explain any relevant deductibles, copays, or out-of-pocket costs
-        4. Mention if there are any circumstances where coverage might change
-        5. Note if there are any ambiguities in the policy that would require clarification
-        """
-    elif question_type == "comparison":
-        base_prompt += """
-        This appears to be a comparison question. Please:
-        1. Clearly outline the key differences between the options mentioned
-        2. Compare costs, coverage, limitations, and benefits objectively
-        3. Highlight scenarios where one option might be better than another
-        4. Consider different user circumstances in your comparison
-        5. Provide a balanced assessment rather than strongly favoring one option
-        """
-    elif question_type == "definition":
-        base_prompt += """
-        This appears to be a question about defining a term or concept. Please:
-        1. Provide a clear, simple definition in everyday language
-        2. Explain why this term matters in the context of insurance
-        3. Give a practical example of how this concept works in real life
-        4. Note any variations in how this term might be used across different policies
-        """
-    
-    base_prompt += """
-    Provide a clear, straightforward answer that:
-    1. Directly addresses the user's question
-    2. Uses simple language (aim for 8th-grade reading level)
-    3. Explains any technical terms you need to use
-    4. Does NOT provide legal advice or definitive coverage determinations
-    5. Includes appropriate disclaimers when the answer requires interpretation
-
-    If the answer cannot be determined from the policy text provided, explain what additional information would be needed.
-    """
-    
-    return base_prompt
+    return prompt
 
 def mock_answer(question: str, document_text: str, insurance_type: str, question_type: str) -> str:
     """
@@ -213,54 +296,28 @@ def mock_answer(question: str, document_text: str, insurance_type: str, question
     else:
         return f"Based on your {insurance_type} insurance policy, I would need more specific information to answer your question accurately. Could you please provide more details or ask a more specific question about your coverage, deductibles, copayments, or exclusions?"
 
+async def mock_answer_stream(question: str, document_text: str, insurance_type: str, question_type: str, delay: float = MOCK_STREAM_DELAY) -> AsyncIterator[str]:
+    """
+    Stream the mock answer word by word, so the streaming path can be
+    load-tested without network access
+    """
+    words = mock_answer(question, document_text, insurance_type, question_type).split(" ")
+    for i, word in enumerate(words):
+        yield word if i == 0 else " " + word
+        if delay > 0:
+            await asyncio.sleep(delay)
+
 def identify_question_type(question: str) -> str:
     """
     Identify the type of question being asked to provide a more tailored response
     """
-    question_lower = question.lower()
-    
-    # Check for personal recommendation questions
-    if any(phrase in question_lower for phrase in ["should i", "better for me", "recommend", "best for my", "good for my situation"]):
-        return "recommendation"
-    
-    # Check for coverage questions
-    elif any(phrase in question_lower for phrase in ["cover", "covered", "coverage", "pay for", "reimburse"]):
-        return "coverage"
-    
-    # Check for policy comparisons
-    elif any(phrase in question_lower for phrase in ["compare", "difference", "better", "versus", "vs"]):
-        return "comparison"
-    
-    # Check for definition/explanation questions
-    elif any(phrase in question_lower for phrase in ["what is", "what does", "mean", "define", "explain"]):
-        return "definition"
-    
-    # Default to general interpretation
-    return "general"
+    return classify_question(question).question_type
 
 def extract_personal_context(question: str) -> Dict[str, Any]:
     """
     Extract personal context from the user's question to provide more tailored responses
     """
-    context = {}
-    
-    # Simple extraction of age
-    age_match = re.search(r'I am (\d+)', question) or re.search(r'(\d+) years old', question)
-    if age_match:
-        context["age"] = int(age_match.group(1))
-    
-    # Simple extraction of family status
-    if re.search(r'married|spouse|wife|husband', question, re.IGNORECASE):
-        context["married"] = True
-    
-    if re.search(r'kids|children|child|baby|infant', question, re.IGNORECASE):
-        context["has_children"] = True
-    
-    # Health conditions
-    if re.search(r'chronic|condition|diabetes|asthma|heart|cancer', question, re.IGNORECASE):
-        context["has_health_conditions"] = True
-    
-    return context
+    return classify_question(question).personal_context
 
 def get_related_terms(question: str, identified_terms: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
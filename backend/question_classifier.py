@@ -0,0 +1,182 @@
+"""
+Classify questions by type and extract personal context, in batches.
+
+Each category is one compiled pattern that is run once over a whole batch of
+questions joined together, and matches are mapped back to their question.
+This is used per request by the API and offline for FAQ analytics.
+
+Usage:
+    python question_classifier.py questions.txt --output classified.json
+"""
+import argparse
+import json
+import re
+import sys
+from bisect import bisect_right
+from collections import Counter
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Pattern, Sequence, Tuple
+
+# Question types in priority order, with the phrases that identify them.
+# A question takes the first type with a phrase appearing anywhere in it.
+QUESTION_TYPE_PHRASES = [
+    # Personal recommendation questions
+    ("recommendation", ["should i", "better for me", "recommend", "best for my", "good for my situation"]),
+
+    # Coverage questions
+    ("coverage", ["cover", "covered", "coverage", "pay for", "reimburse"]),
+
+    # Policy comparisons
+    ("comparison", ["compare", "difference", "better", "versus", "vs"]),
+
+    # Definition/explanation questions
+    ("definition", ["what is", "what does", "mean", "define", "explain"])
+]
+
+# Type of questions that match none of the phrases
+DEFAULT_QUESTION_TYPE = "general"
+
+# Patterns for the asker's age, tried in order
+AGE_PATTERNS = [r'I am (\d+)', r'(\d+) years old']
+
+# Personal context flags and the words that set them, in any case
+PERSONAL_CONTEXT_PATTERNS = [
+    # Family status
+    ("married", r'married|spouse|wife|husband'),
+    ("has_children", r'kids|children|child|baby|infant'),
+
+    # Health conditions
+    ("has_health_conditions", r'chronic|condition|diabetes|asthma|heart|cancer')
+]
+
+# Questions are joined with a separator that no pattern can match across
+_SEPARATOR = "\n"
+
+_QUESTION_TYPE_MATCHERS: List[Tuple[str, Pattern]] = [
+    (question_type, re.compile("|".join(re.escape(phrase) for phrase in phrases)))
+    for question_type, phrases in QUESTION_TYPE_PHRASES
+]
+_AGE_MATCHERS: List[Pattern] = [re.compile(pattern) for pattern in AGE_PATTERNS]
+_CONTEXT_MATCHERS: List[Tuple[str, Pattern]] = [
+    (flag, re.compile(pattern, re.IGNORECASE)) for flag, pattern in PERSONAL_CONTEXT_PATTERNS
+]
+
+# Case-sensitive versions for lowercased ASCII text, where they match exactly
+# the same as the patterns above and run considerably faster
+_LOWERCASE_CONTEXT_MATCHERS: List[Tuple[str, Pattern]] = [
+    (flag, re.compile(pattern)) for flag, pattern in PERSONAL_CONTEXT_PATTERNS
+]
+
+class QuestionClassification(NamedTuple):
+    question_type: str
+    personal_context: Dict[str, Any]
+
+def _join(questions: Sequence[str]) -> Tuple[str, List[int]]:
+    """
+    Join questions into one text, returning it with each question's start offset
+    """
+    starts = []
+    offset = 0
+    for question in questions:
+        starts.append(offset)
+        offset += len(question) + len(_SEPARATOR)
+    return _SEPARATOR.join(questions), starts
+
+def _first_matches(pattern: Pattern, text: str, starts: List[int]) -> Iterator[Tuple[int, "re.Match"]]:
+    """
+    (question position, match) for the first match of a pattern in each of the
+    joined questions. After a match the search resumes at the next question.
+    """
+    position = 0
+    while True:
+        match = pattern.search(text, position)
+        if match is None:
+            return
+        question = bisect_right(starts, match.start()) - 1
+        yield question, match
+        if question + 1 >= len(starts):
+            return
+        position = starts[question + 1]
+
+def classify_questions(questions: Sequence[str]) -> Dict[str, List[Any]]:
+    """
+    Classify a batch of questions, returning one array per field: question_type,
+    age (None when not stated) and a boolean array per personal context flag
+    """
+    count = len(questions)
+    text, starts = _join(questions)
+    lowered_text, lowered_starts = _join([question.lower() for question in questions])
+
+    question_types: List[Optional[str]] = [None] * count
+    for question_type, pattern in _QUESTION_TYPE_MATCHERS:
+        for position, _ in _first_matches(pattern, lowered_text, lowered_starts):
+            if question_types[position] is None:
+                question_types[position] = question_type
+
+    ages: List[Optional[int]] = [None] * count
+    for pattern in _AGE_MATCHERS:
+        for position, match in _first_matches(pattern, text, starts):
+            if ages[position] is None:
+                ages[position] = int(match.group(1))
+
+    results: Dict[str, List[Any]] = {
+        "question_type": [question_type or DEFAULT_QUESTION_TYPE for question_type in question_types],
+        "age": ages
+    }
+    if text.isascii():
+        context_matchers, context_text, context_starts = _LOWERCASE_CONTEXT_MATCHERS, lowered_text, lowered_starts
+    else:
+        context_matchers, context_text, context_starts = _CONTEXT_MATCHERS, text, starts
+    for flag, pattern in context_matchers:
+        values = [False] * count
+        for position, _ in _first_matches(pattern, context_text, context_starts):
+            values[position] = True
+        results[flag] = values
+    return results
+
+def personal_context_at(results: Dict[str, List[Any]], position: int) -> Dict[str, Any]:
+    """
+    Personal context of one classified question, with only the facts found
+    """
+    context = {}
+    if results["age"][position] is not None:
+        context["age"] = results["age"][position]
+    for flag, _ in PERSONAL_CONTEXT_PATTERNS:
+        if results[flag][position]:
+            context[flag] = True
+    return context
+
+def classify_question(question: str) -> QuestionClassification:
+    """
+    Classify a single question
+    """
+    results = classify_questions([question])
+    return QuestionClassification(results["question_type"][0], personal_context_at(results, 0))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Classify logged questions for FAQ analytics")
+    parser.add_argument("input", help="Text file with one question per line")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    parser.add_argument("--batch-size", type=int, default=100000, help="Questions classified per batch (default: 100000)")
+    args = parser.parse_args()
+
+    with open(args.input, encoding="utf-8") as input_file:
+        questions = [line.rstrip("\n") for line in input_file if line.strip()]
+
+    results: Dict[str, List[Any]] = {}
+    for batch_start in range(0, len(questions), args.batch_size):
+        batch = classify_questions(questions[batch_start:batch_start + args.batch_size])
+        for field, values in batch.items():
+            results.setdefault(field, []).extend(values)
+
+    for question_type, count in Counter(results.get("question_type", [])).most_common():
+        print(f"{question_type:<16}{count:>10}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(results))
+
+if __name__ == "__main__":
+    main()
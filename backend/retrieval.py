@@ -0,0 +1,176 @@
+import hashlib
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from section_index import SectionIndex
+from explanation_cache import LRUCache
+from metrics import timed
+from token_budget import count_tokens, truncate_to_tokens
+
+# Tokens of policy text selected as context when no budget is given; question
+# prompts fill whatever ANSWER_PROMPT_TOKENS leaves after their instructions
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+
+# Sections longer than this are split into smaller chunks for retrieval
+MAX_CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "1200"))
+
+# Number of document indexes kept for reuse across questions
+DOCUMENT_INDEX_CACHE_SIZE = int(os.getenv("DOCUMENT_INDEX_CACHE_SIZE", "32"))
+
+# Placed between the chunks of selected context
+CONTEXT_SEPARATOR = "\n...\n"
+
+# Smallest part of a chunk worth adding to fill the rest of a context budget
+MIN_PARTIAL_CHUNK_TOKENS = 16
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+# Words too common to tell chunks apart
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "how", "i", "if", "in", "is", "it", "me", "my", "of", "on", "or",
+    "our", "that", "the", "their", "this", "to", "was", "what", "when", "which",
+    "who", "will", "with", "would", "you", "your"
+}
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase words for indexing, dropping stopwords
+    """
+    return [word for word in _WORD_PATTERN.findall(text.lower()) if word not in STOPWORDS]
+
+def chunk_document(document_text: str, section_index: Optional[SectionIndex] = None) -> List[Tuple[int, int, str]]:
+    """
+    Split a document into (start, end, section title) chunks along section
+    boundaries, breaking long sections at line or sentence ends
+    """
+    if section_index is None:
+        section_index = SectionIndex(document_text)
+    
+    chunks = []
+    for position in range(len(section_index)):
+        start, end = section_index.bounds(position)
+        title = section_index.titles[position]
+        while end - start > MAX_CHUNK_CHARS:
+            limit = start + MAX_CHUNK_CHARS
+            cut = document_text.rfind("\n", start + 1, limit)
+            if cut <= start:
+                cut = document_text.rfind(". ", start + 1, limit) + 1
+            if cut <= start:
+                cut = limit
+            chunks.append((start, cut, title))
+            start = cut
+        if end > start and document_text[start:end].strip():
+            chunks.append((start, end, title))
+    return chunks
+
+class DocumentIndex:
+    """
+    BM25 index over the chunks of one document
+    """
+
+    def __init__(self, document_text: str, section_index: Optional[SectionIndex] = None, k1: float = 1.5, b: float = 0.75):
+        self.text = document_text
+        self.k1 = k1
+        self.b = b
+        self.chunks = chunk_document(document_text, section_index)
+        self.chunk_lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+
+        for chunk_id, (start, end, title) in enumerate(self.chunks):
+            words = tokenize(title + " " + document_text[start:end])
+            self.chunk_lengths.append(len(words))
+            for word, count in Counter(words).items():
+                self.postings[word].append((chunk_id, count))
+
+        self.average_length = (sum(self.chunk_lengths) / len(self.chunk_lengths)) if self.chunks else 0.0
+        self._chunk_tokens: Optional[List[int]] = None
+
+    def search(self, query: str) -> List[Tuple[float, int]]:
+        """
+        Score chunks against a query, best first, skipping chunks with no overlap
+        """
+        chunk_count = len(self.chunks)
+        scores: Dict[int, float] = defaultdict(float)
+        for word in set(tokenize(query)):
+            postings = self.postings.get(word)
+            if not postings:
+                continue
+            idf = math.log(1 + (chunk_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, count in postings:
+                length_norm = 1 - self.b + self.b * self.chunk_lengths[chunk_id] / (self.average_length or 1)
+                scores[chunk_id] += idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+        return sorted(((score, chunk_id) for chunk_id, score in scores.items()), reverse=True)
+
+    @timed
+    def select_context(self, question: str, token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+        """
+        Pack the chunks most relevant to the question into the token budget,
+        in document order. Falls back to the start of the document when
+        nothing matches.
+        """
+        ranked = [chunk_id for _, chunk_id in self.search(question)]
+        if not ranked:
+            ranked = list(range(len(self.chunks)))
+
+        chunk_tokens = self.chunk_tokens()
+        separator_tokens = count_tokens(CONTEXT_SEPARATOR)
+        selected = []
+        skipped = None
+        remaining = token_budget
+        for chunk_id in ranked:
+            start, end, _ = self.chunks[chunk_id]
+            cost = chunk_tokens[chunk_id] + (separator_tokens if selected else 0)
+            if cost > remaining:
+                if not selected:
+                    # Always include at least part of the best chunk
+                    selected.append((start, start + len(truncate_to_tokens(self.text[start:end], remaining))))
+                    remaining = 0
+                    break
+                if skipped is None:
+                    skipped = chunk_id
+                continue
+            selected.append((start, end))
+            remaining -= cost
+            if remaining <= 0:
+                break
+
+        # Fill the rest of the budget with the start of the best chunk that did not fit
+        if skipped is not None and remaining - separator_tokens >= MIN_PARTIAL_CHUNK_TOKENS:
+            start, end, _ = self.chunks[skipped]
+            selected.append((start, start + len(truncate_to_tokens(self.text[start:end], remaining - separator_tokens))))
+
+        selected.sort()
+        return CONTEXT_SEPARATOR.join(self.text[start:end].strip() for start, end in selected)
+
+    def chunk_tokens(self) -> List[int]:
+        """
+        Tokens in each chunk as included in context, counted on first use
+        """
+        if self._chunk_tokens is None:
+            self._chunk_tokens = [count_tokens(self.text[start:end].strip()) for start, end, _ in self.chunks]
+        return self._chunk_tokens
+
+_document_indexes = LRUCache(DOCUMENT_INDEX_CACHE_SIZE, ttl=3600)
+
+def document_fingerprint(document_text: str) -> str:
+    """
+    Stable hash identifying a document's text
+    """
+    return hashlib.sha256(document_text.encode("utf-8")).hexdigest()
+
+@timed
+def get_document_index(document_text: str, fingerprint: Optional[str] = None) -> DocumentIndex:
+    """
+    Get the retrieval index for a document, building it once and reusing it
+    for later questions about the same text
+    """
+    key = fingerprint or document_fingerprint(document_text)
+    index = _document_indexes.get(key)
+    if index is None:
+        index = DocumentIndex(document_text)
+        _document_indexes.set(key, index)
+    return index
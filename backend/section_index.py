@@ -0,0 +1,128 @@
+import re
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterator, List, Match, Tuple
+
+# Common headings that start a new section in insurance documents
+SECTION_HEADERS = [
+    "DEFINITIONS", "COVERAGE", "EXCLUSIONS", "LIMITATIONS",
+    "BENEFITS", "ELIGIBILITY", "PREMIUMS", "CLAIMS", "GENERAL PROVISIONS"
+]
+
+# All headings in one pattern so the text is scanned once. The delimiter
+# after a heading is matched in a lookahead so other headings right after it
+# are still found; repeats of the same heading within its delimiter are
+# skipped as when each heading was searched for separately.
+_SECTION_HEADER_PATTERN = re.compile(
+    r'(?i)(?:^|\n)\s*(' + '|'.join(re.escape(header) for header in SECTION_HEADERS) + r')(?=(\s*[:.\n]))'
+)
+
+# Title of the implicit section that starts at the beginning of the document
+FULL_DOCUMENT_TITLE = "FULL DOCUMENT"
+
+def _iter_headers(text: str, position: int = 0) -> Iterator[Match]:
+    """
+    Section headings in a text from a position on, in order
+    """
+    delimiter_ends: Dict[str, int] = {}
+    for match in _SECTION_HEADER_PATTERN.finditer(text, position):
+        header = match.group(1).upper()
+        if match.start() < delimiter_ends.get(header, 0):
+            continue
+        delimiter_ends[header] = match.end(2)
+        yield match
+
+class SectionIndex:
+    """
+    Sections of a document stored as offset ranges into the shared text.
+
+    Sections are kept in sorted order, so the section containing any character
+    offset is found with a binary search instead of copying section text.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.starts: List[int] = [0]
+        self.titles: List[str] = [FULL_DOCUMENT_TITLE]
+
+        for match in _iter_headers(text):
+            self.starts.append(match.start())
+            self.titles.append(match.group(1))
+
+        self.ends: List[int] = self.starts[1:] + [len(text)]
+
+    @classmethod
+    def _from_headers(cls, text: str, starts: List[int], titles: List[str]) -> "SectionIndex":
+        index = cls.__new__(cls)
+        index.text = text
+        index.starts = starts
+        index.titles = titles
+        index.ends = starts[1:] + [len(text)]
+        return index
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def section_at(self, offset: int) -> int:
+        """
+        Position of the section containing a character offset
+        """
+        return max(0, bisect_right(self.starts, offset) - 1)
+
+    def title_at(self, offset: int) -> str:
+        """
+        Title of the section containing a character offset
+        """
+        return self.titles[self.section_at(offset)]
+
+    def bounds(self, position: int) -> Tuple[int, int]:
+        """
+        (start, end) offsets of a section
+        """
+        return self.starts[position], self.ends[position]
+
+    def apply_edit(self, text: str, start: int, old_end: int, new_end: int) -> Tuple["SectionIndex", int]:
+        """
+        Sections of text, the indexed text with the characters from start to
+        old_end replaced by new_end - start others. Headings before the edit
+        are kept and those after it shifted; only the text from the section
+        the edit starts in up to the first unchanged heading is re-scanned.
+        Returns the new index and the end of the re-scanned text.
+        """
+        delta = new_end - old_end
+        # Start at the heading before the edit, which may itself be changed
+        section = self.section_at(start - 1)
+        starts, titles = self.starts[:max(1, section)], self.titles[:max(1, section)]
+
+        for match in _iter_headers(text, self.starts[section]):
+            position = match.start()
+            if position >= new_end:
+                old = bisect_left(self.starts, position - delta, 1)
+                if old < len(self.starts) and self.starts[old] == position - delta:
+                    # From an unchanged heading on the text, and so the
+                    # headings, are the same as before
+                    starts.extend(old_start + delta for old_start in self.starts[old:])
+                    titles.extend(self.titles[old:])
+                    return SectionIndex._from_headers(text, starts, titles), position
+            starts.append(position)
+            titles.append(match.group(1))
+        return SectionIndex._from_headers(text, starts, titles), len(text)
+
+    def content(self, position: int) -> str:
+        """
+        Text of a section, sliced from the shared text on demand
+        """
+        return self.text[self.starts[position]:self.ends[position]]
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """
+        Sections in the dictionary format returned by split_into_sections
+        """
+        return [
+            {
+                "title": self.titles[i],
+                "content": self.content(i),
+                "start_index": self.starts[i],
+                "end_index": self.ends[i]
+            }
+            for i in range(len(self))
+        ]
@@ -0,0 +1,227 @@
+import os
+import pickle
+import re
+import secrets
+import threading
+import time
+from typing import Dict, Optional
+
+from fact_index import FactIndex, extract_facts
+from retrieval import DocumentIndex, document_fingerprint
+from section_index import SectionIndex
+from term_store import TermStore
+
+# Where document sessions are kept: "memory" or "disk"
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+
+# Directory used by the disk backend
+SESSION_DIR = os.getenv("SESSION_DIR", "sessions")
+
+# Seconds a session may go unused before it expires
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+
+# Minimum seconds between sweeps for expired sessions
+SESSION_SWEEP_INTERVAL = 60
+
+# Document IDs are URL-safe tokens, which also keeps them safe as file names
+_DOCUMENT_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+class DocumentSession:
+    """
+    Precomputed state for a processed document, reused across questions
+    """
+
+    def __init__(self, document_id: str, text: str, insurance_type: str, terms: TermStore):
+        self.document_id = document_id
+        self.text = text
+        self.insurance_type = insurance_type
+        self.terms = terms
+        self.fingerprint = document_fingerprint(text)
+        self.sections = SectionIndex(text)
+        self.document_index: Optional[DocumentIndex] = None
+        self.fact_index: Optional[FactIndex] = None
+        self.version = 1
+        self.last_access = time.time()
+
+class MemorySessionBackend:
+    """
+    Keeps sessions in process memory
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, DocumentSession] = {}
+        self._lock = threading.Lock()
+
+    def get(self, document_id: str) -> Optional[DocumentSession]:
+        with self._lock:
+            return self._sessions.get(document_id)
+
+    def put(self, session: DocumentSession) -> None:
+        with self._lock:
+            self._sessions[session.document_id] = session
+
+    def delete(self, document_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(document_id, None)
+
+    def expire(self, cutoff: float) -> None:
+        with self._lock:
+            for document_id in [key for key, session in self._sessions.items() if session.last_access < cutoff]:
+                del self._sessions[document_id]
+
+    def touch(self, session: DocumentSession) -> None:
+        # Sessions are shared objects, so updating last_access is enough
+        pass
+
+class DiskSessionBackend:
+    """
+    Keeps sessions as pickle files in a local directory, so they survive
+    restarts and can be shared by workers on the same machine
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, document_id: str) -> str:
+        return os.path.join(self.directory, f"{document_id}.pkl")
+
+    def get(self, document_id: str) -> Optional[DocumentSession]:
+        path = self._path(document_id)
+        try:
+            last_access = os.path.getmtime(path)
+            with open(path, "rb") as session_file:
+                session = pickle.load(session_file)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+        session.last_access = last_access
+        return session
+
+    def put(self, session: DocumentSession) -> None:
+        # Write to a temporary file first so readers never see a partial session
+        path = self._path(session.document_id)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as session_file:
+            pickle.dump(session, session_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        os.utime(path, (session.last_access, session.last_access))
+
+    def delete(self, document_id: str) -> None:
+        try:
+            os.remove(self._path(document_id))
+        except OSError:
+            pass
+
+    def expire(self, cutoff: float) -> None:
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def touch(self, session: DocumentSession) -> None:
+        try:
+            os.utime(self._path(session.document_id), (session.last_access, session.last_access))
+        except OSError:
+            pass
+
+class SessionStore:
+    """
+    Issues document IDs and expires sessions that have been idle too long
+    """
+
+    def __init__(self, backend, idle_ttl: float = SESSION_IDLE_TTL):
+        self.backend = backend
+        self.idle_ttl = idle_ttl
+        self._last_sweep = time.time()
+
+    def _sweep(self) -> None:
+        now = time.time()
+        if now - self._last_sweep >= SESSION_SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.backend.expire(now - self.idle_ttl)
+
+    def create(self, text: str, insurance_type: str, terms: TermStore) -> DocumentSession:
+        """
+        Store a processed document and return its session
+        """
+        self._sweep()
+        session = DocumentSession(secrets.token_urlsafe(16), text, insurance_type, terms)
+        self.backend.put(session)
+        return session
+
+    def get(self, document_id: str) -> Optional[DocumentSession]:
+        """
+        Look up a session, returning None if it does not exist or has expired
+        """
+        self._sweep()
+        if not _DOCUMENT_ID_PATTERN.fullmatch(document_id):
+            return None
+        session = self.backend.get(document_id)
+        if session is None:
+            return None
+
+        now = time.time()
+        if now - session.last_access > self.idle_ttl:
+            self.backend.delete(document_id)
+            return None
+
+        session.last_access = now
+        self.backend.touch(session)
+        return session
+
+    def save(self, session: DocumentSession) -> None:
+        """
+        Persist changes made to a session
+        """
+        self.backend.put(session)
+
+    def update(self, session: DocumentSession, text: str, sections: SectionIndex, terms: TermStore) -> None:
+        """
+        Replace a session's document with a new version
+        """
+        session.text = text
+        session.fingerprint = document_fingerprint(text)
+        session.sections = sections
+        session.terms = terms
+        session.document_index = None
+        session.fact_index = None
+        session.version += 1
+        self.save(session)
+
+    def get_document_index(self, session: DocumentSession) -> DocumentIndex:
+        """
+        Get the session's retrieval index, building and storing it on first use
+        """
+        if session.document_index is None:
+            session.document_index = DocumentIndex(session.text, session.sections)
+            self.save(session)
+        return session.document_index
+
+    def get_fact_index(self, session: DocumentSession) -> FactIndex:
+        """
+        Get the session's index of numeric facts, building and storing it on first use
+        """
+        if session.fact_index is None:
+            session.fact_index = extract_facts(session.terms)
+            self.save(session)
+        return session.fact_index
+
+_session_store: Optional[SessionStore] = None
+
+def get_session_store() -> SessionStore:
+    """
+    Get the shared session store, creating it on first use
+    """
+    global _session_store
+    if _session_store is None:
+        if SESSION_BACKEND == "disk":
+            backend = DiskSessionBackend(SESSION_DIR)
+        else:
+            backend = MemorySessionBackend()
+        _session_store = SessionStore(backend)
+    return _session_store
@@ -1,102 +1,123 @@
-import re
 import json
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
-# Dictionary of common insurance terms and their categories
-# In a production application, this would be stored in a database
-COMMON_INSURANCE_TERMS = {
-    "premium": "payment",
-    "deductible": "payment",
-    "copay": "payment",
-    "coinsurance": "payment",
-    "out-of-pocket maximum": "payment",
-    "beneficiary": "policy",
-    "policyholder": "policy",
-    "coverage": "policy",
-    "claim": "process",
-    "exclusion": "coverage",
-    "preexisting condition": "medical",
-    "waiting period": "policy",
-    "rider": "policy",
-    "underwriting": "process",
-    "actuary": "process",
-    "indemnity": "legal",
-    "endorsement": "legal",
-    "grace period": "policy",
-    "guaranteed insurability": "policy",
-    "living benefits": "benefit",
-    "maturity": "policy",
-    "waiver of premium": "benefit",
-    "elimination period": "policy",
-    "accelerated death benefit": "benefit",
-}
+import complex_patterns
+from section_index import SectionIndex
+from glossary import get_glossary
+from term_matcher import TermMatcher
+from term_store import TermStore
+from metrics import timed
 
-# Insurance type specific terms
-INSURANCE_TYPE_TERMS = {
-    "health": [
-        "network provider", "in-network", "out-of-network", "formulary", 
-        "prior authorization", "referral", "explanation of benefits", 
-        "coordination of benefits", "health maintenance organization", 
-        "preferred provider organization", "exclusive provider organization"
-    ],
-    "life": [
-        "cash value", "death benefit", "term life", "whole life", "universal life",
-        "variable life", "accidental death", "annuity", "surrender value",
-        "paid-up additions", "suicide clause", "contestability period"
-    ],
-    "disability": [
-        "own occupation", "any occupation", "residual disability", "partial disability",
-        "total disability", "long-term disability", "short-term disability",
-        "presumptive disability", "recurrent disability", "social insurance offset"
-    ]
-}
+def get_term_matcher(insurance_type: str) -> TermMatcher:
+    """
+    Get the precompiled term matcher for an insurance type
+    """
+    return get_glossary().matcher(insurance_type)
 
-def identify_terms(document_text: str, insurance_type: str) -> List[Dict[str, Any]]:
+@timed
+def identify_terms_compact(document_text: str, insurance_type: str, section_index: Optional[SectionIndex] = None,
+                           with_sections: bool = True) -> TermStore:
     """
-    Identify insurance jargon terms in the document text
+    Identify insurance jargon terms in the document text into a compact term
+    store, noting the section each one falls in unless with_sections is False,
+    e.g. for part of a document whose sections are assigned later
     """
-    identified_terms = []
-    
-    # Get terms relevant to this insurance type
-    relevant_type_terms = INSURANCE_TYPE_TERMS.get(insurance_type.lower(), [])
-    
-    # Combine with common terms
-    all_terms = list(COMMON_INSURANCE_TERMS.keys()) + relevant_type_terms
+    store = TermStore(document_text, insurance_type)
     
-    # Sort by length (longest first) to avoid substring matches
-    all_terms.sort(key=len, reverse=True)
-    
-    # Find term occurrences in the text
-    for term in all_terms:
-        # Use word boundaries to find whole terms only
-        pattern = r'\b' + re.escape(term) + r'\b'
-        for match in re.finditer(pattern, document_text, re.IGNORECASE):
-            # Get some context around the term (50 chars before and after)
-            start_idx = max(0, match.start() - 50)
-            end_idx = min(len(document_text), match.end() + 50)
-            context = document_text[start_idx:end_idx]
-            
-            # Determine category
-            category = COMMON_INSURANCE_TERMS.get(term.lower(), "general")
-            
-            identified_terms.append({
-                "term": term,
-                "original_text": match.group(0),
-                "start_index": match.start(),
-                "end_index": match.end(),
-                "context": context,
-                "category": category,
-                "insurance_type": insurance_type
-            })
+    # Find all term occurrences in a single pass; overlapping matches are
+    # resolved longest-first to avoid substring matches
+    # Synonyms are recorded under their canonical term. The glossary is read
+    # once so a concurrent reload cannot mix two versions in one document.
+    glossary = get_glossary()
+    for start, end, form in glossary.matcher(insurance_type).find(document_text):
+        term = glossary.canonical_term(form, insurance_type)
+        store.add(term, glossary.category(term), start, end)
     
     # Advanced term identification using patterns
-    identified_terms.extend(identify_complex_terms(document_text, insurance_type))
+    for start, end, category in iter_complex_matches(document_text, insurance_type):
+        store.add(document_text[start:end], category, start, end)
     
     # Sort terms by their position in the document
-    identified_terms.sort(key=lambda x: x["start_index"])
-    
-    return identified_terms
+    store.sort()
+    if with_sections:
+        store.assign_sections(section_index or SectionIndex(document_text))
+    return store
+
+def identify_terms_between(document_text: str, insurance_type: str, start: int, end: int) -> TermStore:
+    """
+    Identify the terms starting between two offsets of a document, without
+    sections. The text on either side is scanned as far as a clause reaches,
+    so terms at the edges are found as in the whole document.
+    """
+    reach = complex_patterns.registry.clause_max_chars
+    scan_start = max(0, start - reach)
+    found = identify_terms_compact(document_text[scan_start:end + reach], insurance_type, with_sections=False)
+    store = found.slice(found.row_at(start - scan_start), found.row_at(end - scan_start))
+    store.text = document_text
+    store.shift(scan_start)
+    return store
+
+class PageTermScanner:
+    """
+    Identifies terms page by page as a document arrives, into one store with
+    offsets into the whole document.
+
+    Terms are recorded once the text after them is as long as a clause can
+    be, and the text at each page join is scanned together with the pages on
+    both sides of it, so terms crossing a join are found as in the whole
+    document. Sections are assigned once the document is complete.
+    """
+
+    def __init__(self, insurance_type: str):
+        self.insurance_type = insurance_type
+        self.store = TermStore(insurance_type=insurance_type)
+        self.pages: List[str] = []
+        self.length = 0
+        # Terms starting before this offset have been recorded
+        self._recorded = 0
+
+    def add_page(self, page_text: str) -> None:
+        self.pages.append(page_text)
+        self.length += len(page_text)
+        self._record(self.length - complex_patterns.registry.clause_max_chars)
+
+    def finish(self) -> TermStore:
+        """
+        Record the remaining terms and assign sections on the whole text
+        """
+        self._record(self.length)
+        self.store.text = "".join(self.pages)
+        self.store.assign_sections(SectionIndex(self.store.text))
+        return self.store
+
+    def _record(self, end: int) -> None:
+        if end <= self._recorded:
+            return
+        # Join only the pages a clause before the first unrecorded term reaches
+        first = len(self.pages)
+        text_start = self.length
+        while first and text_start > self._recorded - complex_patterns.registry.clause_max_chars:
+            first -= 1
+            text_start -= len(self.pages[first])
+        found = identify_terms_between("".join(self.pages[first:]), self.insurance_type,
+                                       self._recorded - text_start, end - text_start)
+        self.store.extend(found, text_start)
+        self._recorded = end
+
+def identify_terms(document_text: str, insurance_type: str, section_index: Optional[SectionIndex] = None) -> List[Dict[str, Any]]:
+    """
+    Identify insurance jargon terms in the document text, noting the section
+    each one falls in
+    """
+    return identify_terms_compact(document_text, insurance_type, section_index).to_dicts()
+
+def iter_complex_matches(document_text: str, insurance_type: Optional[str] = None) -> Iterator[Tuple[int, int, str]]:
+    """
+    Find (start, end, category) of complex terms and clauses, including the
+    patterns registered for the insurance type, in a single pass
+    """
+    return complex_patterns.registry.finditer(document_text, insurance_type)
 
 def identify_complex_terms(document_text: str, insurance_type: str) -> List[Dict[str, Any]]:
     """
@@ -104,37 +125,20 @@ def identify_complex_terms(document_text: str, insurance_type: str) -> List[Dict
     """
     complex_terms = []
     
-    # Define patterns for complex terms
-    patterns = [
-        # Numbers with percentage
-        (r'\b(\d+(?:\.\d+)?%)\b', "percentage"),
+    for start, end, category in iter_complex_matches(document_text, insurance_type):
+        # Get context around the match
+        start_idx = max(0, start - 50)
+        end_idx = min(len(document_text), end + 50)
+        context = document_text[start_idx:end_idx]
         
-        # Dollar amounts
-        (r'\$\s*(\d+(?:,\d{3})*(?:\.\d{2})?)', "monetary"),
-        
-        # Time periods
-        (r'\b(\d+\s+(?:day|week|month|year)s?)\b', "time_period"),
-        
-        # Complex clauses often starting with certain words
-        (r'\b(provided that|subject to|notwithstanding|whereas)\b[^.]*\.', "legal_clause")
-    ]
-    
-    # Find matches for each pattern
-    for pattern, category in patterns:
-        for match in re.finditer(pattern, document_text, re.IGNORECASE):
-            # Get context around the match
-            start_idx = max(0, match.start() - 50)
-            end_idx = min(len(document_text), match.end() + 50)
-            context = document_text[start_idx:end_idx]
-            
-            complex_terms.append({
-                "term": match.group(0),
-                "original_text": match.group(0),
-                "start_index": match.start(),
-                "end_index": match.end(),
-                "context": context,
-                "category": category,
-                "insurance_type": insurance_type
-            })
+        complex_terms.append({
+            "term": document_text[start:end],
+            "original_text": document_text[start:end],
+            "start_index": start,
+            "end_index": end,
+            "context": context,
+            "category": category,
+            "insurance_type": insurance_type
+        })
     
     return complex_terms
@@ -0,0 +1,123 @@
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+def _is_word_char(char: str) -> bool:
+    """
+    Mirror the regex definition of a word character used by \\b
+    """
+    return char.isalnum() or char == "_"
+
+def _fold(char: str) -> str:
+    """
+    Case-fold a single character without changing the text length,
+    so match offsets always point into the original document
+    """
+    lowered = char.lower()
+    return lowered if len(lowered) == 1 else char
+
+class TermMatcher:
+    """
+    Aho-Corasick automaton that finds every dictionary term in one pass.
+
+    Matching is case-insensitive and only accepts whole terms, following the
+    same word-boundary rules as wrapping each term in \\b...\\b.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        self.terms: List[str] = []
+
+        seen = set()
+        for term in terms:
+            if term and term not in seen:
+                seen.add(term)
+                self._add(term)
+        self._build_failure_links()
+
+    def _add(self, term: str) -> None:
+        term_id = len(self.terms)
+        self.terms.append(term)
+
+        state = 0
+        for char in term:
+            char = _fold(char)
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].append(term_id)
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state].extend(self._output[self._fail[next_state]])
+
+    def _has_boundary(self, text: str, index: int) -> bool:
+        before = index > 0 and _is_word_char(text[index - 1])
+        after = index < len(text) and _is_word_char(text[index])
+        return before != after
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        Return every (start, end, term) whole-term match, including overlaps
+        """
+        matches = []
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+
+        for index, char in enumerate(text):
+            char = _fold(char)
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not output[state]:
+                continue
+
+            end = index + 1
+            for term_id in output[state]:
+                term = self.terms[term_id]
+                start = end - len(term)
+                if self._has_boundary(text, start) and self._has_boundary(text, end):
+                    matches.append((start, end, term))
+
+        return matches
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        Return non-overlapping matches ordered by position, resolving overlaps
+        longest-first (e.g. "waiver of premium" wins over "premium")
+        """
+        candidates = self.find_all(text)
+        candidates.sort(key=lambda match: (match[0] - match[1], match[0]))
+
+        # Accepted spans never overlap, so a sorted list of starts plus a
+        # neighbour check is enough to test each candidate
+        starts: List[int] = []
+        ends: Dict[int, int] = {}
+        selected = []
+        for start, end, term in candidates:
+            position = bisect_left(starts, start)
+            if position < len(starts) and starts[position] < end:
+                continue
+            if position > 0 and ends[starts[position - 1]] > start:
+                continue
+            starts.insert(position, start)
+            ends[start] = end
+            selected.append((start, end, term))
+
+        selected.sort(key=lambda match: match[0])
+        return selected
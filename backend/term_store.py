@@ -0,0 +1,351 @@
+import json
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from section_index import SectionIndex
+
+# Characters of context on each side of a term
+CONTEXT_CHARS = 50
+
+# Number of terms serialized per chunk when streaming JSON
+JSON_CHUNK_SIZE = 1000
+
+# JSON formats for terms: "compact" sends terms as columns of offsets and IDs
+# into shared tables, "reference" sends each distinct term and its explanation
+# once plus a list of occurrences pointing at it, and "full" sends one object
+# per term
+JSON_FORMATS = ("compact", "reference", "full")
+
+_NO_EXPLANATION = -1
+
+# Per-occurrence columns, in the order rows are laid out
+_COLUMNS = ("starts", "ends", "term_ids", "category_ids", "section_ids", "explanation_ids")
+
+class TermStore:
+    """
+    Compact, columnar store of the terms identified in one document.
+
+    Each occurrence is a row in parallel arrays of offsets and interned IDs.
+    Term, category and section strings and explanations are stored once, and
+    the original text and context of an occurrence are sliced from the shared
+    document text only when needed.
+    """
+
+    def __init__(self, text: str = "", insurance_type: str = ""):
+        self.text = text
+        self.insurance_type = insurance_type
+
+        self.starts = array("q")
+        self.ends = array("q")
+        self.term_ids = array("l")
+        self.category_ids = array("l")
+        self.section_ids = array("l")
+        self.explanation_ids = array("l")
+
+        self.terms: List[str] = []
+        self.categories: List[str] = []
+        self.section_titles: List[str] = []
+        self.explanations: List[Dict[str, str]] = []
+
+        self._term_lookup: Dict[str, int] = {}
+        self._category_lookup: Dict[str, int] = {}
+        # Explanation ID by (lowercased term, category), as in explanation_key
+        self._explanation_lookup: Dict[Tuple[str, str], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @staticmethod
+    def _intern(table: List[str], lookup: Dict[str, int], value: str) -> int:
+        value_id = lookup.get(value)
+        if value_id is None:
+            value_id = len(table)
+            table.append(value)
+            lookup[value] = value_id
+        return value_id
+
+    def add(self, term: str, category: str, start: int, end: int) -> None:
+        """
+        Add one term occurrence
+        """
+        self.starts.append(start)
+        self.ends.append(end)
+        self.term_ids.append(self._intern(self.terms, self._term_lookup, term))
+        self.category_ids.append(self._intern(self.categories, self._category_lookup, category))
+        self.section_ids.append(0)
+        self.explanation_ids.append(_NO_EXPLANATION)
+
+    def extend(self, other: "TermStore", offset: int = 0) -> None:
+        """
+        Append the occurrences of another store, e.g. one page of a document,
+        shifting their offsets
+        """
+        term_map = [self._intern(self.terms, self._term_lookup, term) for term in other.terms]
+        category_map = [self._intern(self.categories, self._category_lookup, category) for category in other.categories]
+        explanation_base = len(self.explanations)
+        self.explanations.extend(other.explanations)
+
+        for key, explanation_id in other._explanation_lookup.items():
+            self._explanation_lookup.setdefault(key, explanation_id + explanation_base)
+
+        self.starts.extend(start + offset for start in other.starts)
+        self.ends.extend(end + offset for end in other.ends)
+        self.term_ids.extend(term_map[term_id] for term_id in other.term_ids)
+        self.category_ids.extend(category_map[category_id] for category_id in other.category_ids)
+        self.section_ids.extend(0 for _ in other.section_ids)
+        self.explanation_ids.extend(
+            explanation_id + explanation_base if explanation_id != _NO_EXPLANATION else _NO_EXPLANATION
+            for explanation_id in other.explanation_ids
+        )
+
+    def row_at(self, offset: int) -> int:
+        """
+        First row starting at or after a character offset
+        """
+        return bisect_left(self.starts, offset)
+
+    def slice(self, first: int, last: int) -> "TermStore":
+        """
+        A new store with rows first to last, sharing the same tables
+        """
+        store = TermStore(self.text, self.insurance_type)
+        for name in _COLUMNS:
+            setattr(store, name, getattr(self, name)[first:last])
+        store.terms = list(self.terms)
+        store.categories = list(self.categories)
+        store.section_titles = list(self.section_titles)
+        store.explanations = list(self.explanations)
+        store._term_lookup = dict(self._term_lookup)
+        store._category_lookup = dict(self._category_lookup)
+        store._explanation_lookup = dict(self._explanation_lookup)
+        return store
+
+    def shift(self, delta: int, first: int = 0, section_delta: int = 0) -> None:
+        """
+        Move the rows from first on by delta characters and section_delta
+        sections, e.g. after an edit before them
+        """
+        if delta:
+            self.starts[first:] = array("q", map(delta.__add__, self.starts[first:]))
+            self.ends[first:] = array("q", map(delta.__add__, self.ends[first:]))
+        if section_delta:
+            self.section_ids[first:] = array("l", map(section_delta.__add__, self.section_ids[first:]))
+
+    def splice(self, first: int, last: int, other: "TermStore", offset: int = 0) -> "TermStore":
+        """
+        A new store with rows first to last replaced by the rows of another
+        store, e.g. a re-scanned part of the document, shifting their offsets.
+        Sections of the inserted rows are left for assign_sections.
+        """
+        store = self.slice(0, first)
+        store.extend(other, offset)
+        for name in _COLUMNS:
+            getattr(store, name).extend(getattr(self, name)[last:])
+        return store
+
+    def sort(self) -> None:
+        """
+        Order occurrences by position, keeping insertion order for ties
+        """
+        order = sorted(range(len(self)), key=self.starts.__getitem__)
+        if order == list(range(len(self))):
+            return
+        for name in _COLUMNS:
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, (column[i] for i in order)))
+
+    def assign_sections(self, section_index: SectionIndex, first: int = 0, last: Optional[int] = None) -> None:
+        """
+        Record the section each occurrence falls in, or only those in rows
+        first to last when the other sections are unchanged
+        """
+        self.section_titles = list(section_index.titles)
+        starts = self.starts[first:last]
+        self.section_ids[first:last] = array("l", (section_index.section_at(start) for start in starts))
+
+    # Row accessors
+
+    def term(self, i: int) -> str:
+        return self.terms[self.term_ids[i]]
+
+    def category(self, i: int) -> str:
+        return self.categories[self.category_ids[i]]
+
+    def original_text(self, i: int) -> str:
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def context(self, i: int) -> str:
+        return self.text[max(0, self.starts[i] - CONTEXT_CHARS):self.ends[i] + CONTEXT_CHARS]
+
+    def section(self, i: int) -> Optional[str]:
+        return self.section_titles[self.section_ids[i]] if self.section_titles else None
+
+    def explanation(self, i: int) -> Optional[Dict[str, str]]:
+        explanation_id = self.explanation_ids[i]
+        return self.explanations[explanation_id] if explanation_id != _NO_EXPLANATION else None
+
+    def record(self, i: int) -> Dict[str, Any]:
+        """
+        One occurrence in the original per-term dictionary format
+        """
+        term_info = {
+            "term": self.term(i),
+            "original_text": self.original_text(i),
+            "start_index": self.starts[i],
+            "end_index": self.ends[i],
+            "context": self.context(i),
+            "category": self.category(i),
+            "insurance_type": self.insurance_type
+        }
+        if self.section_titles:
+            term_info["section"] = self.section(i)
+        explanation = self.explanation(i)
+        if explanation is not None:
+            term_info.update(explanation)
+        return term_info
+
+    def iter_dicts(self) -> Iterator[Dict[str, Any]]:
+        """
+        Compatibility view: occurrences as per-term dictionaries, built lazily
+        """
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return list(self.iter_dicts())
+
+    @classmethod
+    def from_dicts(cls, text: str, identified_terms: List[Dict[str, Any]], insurance_type: str) -> "TermStore":
+        """
+        Build a store from terms in the per-term dictionary format
+        """
+        store = cls(text, insurance_type)
+        explanation_lookup: Dict[Tuple[str, str, str], int] = {}
+        for term_info in identified_terms:
+            store.add(term_info["term"], term_info["category"], term_info["start_index"], term_info["end_index"])
+            if "explanation" in term_info:
+                explanation = {
+                    "explanation": term_info["explanation"],
+                    "implications": term_info["implications"],
+                    "source": term_info["source"]
+                }
+                key = (explanation["explanation"], explanation["implications"], explanation["source"])
+                if key not in explanation_lookup:
+                    explanation_lookup[key] = len(store.explanations)
+                    store.explanations.append(explanation)
+                store.explanation_ids[-1] = explanation_lookup[key]
+                term_key = (term_info["term"].lower(), term_info["category"])
+                store._explanation_lookup.setdefault(term_key, explanation_lookup[key])
+        return store
+
+    # Explanations
+
+    def explanation_for(self, term: str, category: str) -> Optional[Dict[str, str]]:
+        """
+        Explanation attached to occurrences of a term, if any
+        """
+        explanation_id = self._explanation_lookup.get((term.lower(), category))
+        return self.explanations[explanation_id] if explanation_id is not None else None
+
+    def unique_terms(self) -> Dict[Tuple[int, int], int]:
+        """
+        First occurrence of each distinct (term ID, category ID) pair
+        """
+        first: Dict[Tuple[int, int], int] = {}
+        for i, pair in enumerate(zip(self.term_ids, self.category_ids)):
+            if pair not in first:
+                first[pair] = i
+        return first
+
+    def set_explanations(self, explanations: Dict[Tuple[int, int], Dict[str, str]]) -> None:
+        """
+        Attach one explanation per (term ID, category ID) pair to every occurrence
+        """
+        self.explanations = []
+        self._explanation_lookup = {}
+        explanation_ids: Dict[Tuple[int, int], int] = {}
+        for pair, explanation in explanations.items():
+            explanation_ids[pair] = len(self.explanations)
+            term_key = (self.terms[pair[0]].lower(), self.categories[pair[1]])
+            self._explanation_lookup.setdefault(term_key, len(self.explanations))
+            self.explanations.append(explanation)
+        self.explanation_ids = array("l", (
+            explanation_ids.get(pair, _NO_EXPLANATION)
+            for pair in zip(self.term_ids, self.category_ids)
+        ))
+
+    # JSON serialization
+
+    def iter_json(self, json_format: str = "compact") -> Iterator[str]:
+        """
+        Stream the store as JSON in one of JSON_FORMATS
+        """
+        if json_format == "compact":
+            return self.iter_json_columns()
+        if json_format == "reference":
+            return self.iter_json_references()
+        if json_format == "full":
+            return self.iter_json_records()
+        raise ValueError(f"Unknown JSON format: {json_format}")
+
+    def iter_json_columns(self) -> Iterator[str]:
+        """
+        Stream the store as a columnar JSON object: string tables plus one
+        array per field, with context left to the client to slice from the text
+        """
+        yield '{"terms": ' + json.dumps(self.terms)
+        yield ', "categories": ' + json.dumps(self.categories)
+        yield ', "sections": ' + json.dumps(self.section_titles)
+        yield ', "explanations": ' + json.dumps(self.explanations)
+        for field, column in (
+            ("start_index", self.starts),
+            ("end_index", self.ends),
+            ("term_id", self.term_ids),
+            ("category_id", self.category_ids),
+            ("section_id", self.section_ids),
+            ("explanation_id", self.explanation_ids)
+        ):
+            yield f', "{field}": ['
+            for chunk_start in range(0, len(column), JSON_CHUNK_SIZE):
+                prefix = ", " if chunk_start else ""
+                yield prefix + ", ".join(map(str, column[chunk_start:chunk_start + JSON_CHUNK_SIZE]))
+            yield "]"
+        yield "}"
+
+    def iter_json_references(self) -> Iterator[str]:
+        """
+        Stream the store as a JSON object with one dictionary entry per distinct
+        term, carrying its explanation, and occurrences as
+        [start_index, end_index, entry ID, section ID] rows pointing into it
+        """
+        first_occurrences = self.unique_terms()
+        entry_ids = {pair: entry_id for entry_id, pair in enumerate(first_occurrences)}
+        entries = []
+        for i in first_occurrences.values():
+            entry = {"term": self.term(i), "category": self.category(i)}
+            entry.update(self.explanation(i) or {})
+            entries.append(entry)
+
+        yield '{"dictionary": ' + json.dumps(entries)
+        yield ', "sections": ' + json.dumps(self.section_titles)
+        yield ', "occurrences": ['
+        rows = zip(self.starts, self.ends, self.term_ids, self.category_ids, self.section_ids)
+        for chunk_start in range(0, len(self), JSON_CHUNK_SIZE):
+            chunk = []
+            for _, (start, end, term_id, category_id, section_id) in zip(range(JSON_CHUNK_SIZE), rows):
+                chunk.append(f"[{start}, {end}, {entry_ids[term_id, category_id]}, {section_id}]")
+            prefix = ", " if chunk_start else ""
+            yield prefix + ", ".join(chunk)
+        yield "]}"
+
+    def iter_json_records(self) -> Iterator[str]:
+        """
+        Stream the store as a JSON array in the per-term dictionary format
+        """
+        yield "["
+        for chunk_start in range(0, len(self), JSON_CHUNK_SIZE):
+            chunk_end = min(len(self), chunk_start + JSON_CHUNK_SIZE)
+            prefix = ", " if chunk_start else ""
+            yield prefix + ", ".join(json.dumps(self.record(i)) for i in range(chunk_start, chunk_end))
+        yield "]"
@@ -0,0 +1,129 @@
+"""
+Token counting and prompt budgets for LLM requests.
+
+Token counts, and so prompt budgets, are estimates at about four characters
+per token. tiktoken is deliberately not required: it downloads encodings on
+first use, which fails on offline hosts. When it is installed and its
+encoding loads, tokens are counted with the model's tokenizer instead and
+budgets are exact.
+
+Requests put their static instructions in the system message, ahead of
+anything that changes per request, so repeated requests share a prefix the
+provider can cache.
+"""
+import importlib.util
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from metrics import PROMPT_TOKENS
+
+# Chat model used for explanations and answers
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+
+# Prompt tokens for answering a question: instructions, question and as much
+# relevant policy text as fits in what is left
+ANSWER_PROMPT_TOKENS = int(os.getenv("ANSWER_PROMPT_TOKENS", "1600"))
+
+# Context window of known models, in tokens; prompts are budgeted to fit in
+# the window minus the tokens reserved for the reply
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385
+}
+
+# Context window assumed for models not listed above
+DEFAULT_CONTEXT_TOKENS = 8192
+
+# Seconds before loading a tokenizer that failed to load is tried again
+TOKENIZER_RETRY_INTERVAL = 300
+
+# Tokens the chat format adds for each message and for the reply
+_MESSAGE_OVERHEAD_TOKENS = 4
+_REPLY_OVERHEAD_TOKENS = 3
+
+_TIKTOKEN_INSTALLED = importlib.util.find_spec("tiktoken") is not None
+_encodings: Dict[str, Any] = {}
+_encoding_retry_at: Dict[str, float] = {}
+
+def _encoding(model: str):
+    """
+    The tokenizer for a model, or None to estimate token counts
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None or not _TIKTOKEN_INSTALLED or time.time() < _encoding_retry_at.get(model, 0):
+        return encoding
+    import tiktoken
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Encodings are downloaded on first use, which fails offline
+        print(f"Error loading tokenizer for {model}, estimating token counts: {e}")
+        _encoding_retry_at[model] = time.time() + TOKENIZER_RETRY_INTERVAL
+        return None
+    _encodings[model] = encoding
+    return encoding
+
+def count_tokens(text: str, model: str = LLM_MODEL) -> int:
+    """
+    Number of tokens in a text, estimated unless tiktoken is available
+    """
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = LLM_MODEL) -> str:
+    """
+    The longest start of a text that fits in a number of tokens
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str = LLM_MODEL) -> int:
+    """
+    Prompt tokens of a list of chat messages
+    """
+    return _REPLY_OVERHEAD_TOKENS + sum(
+        _MESSAGE_OVERHEAD_TOKENS + count_tokens(message["content"], model) for message in messages
+    )
+
+def prompt_token_budget(max_tokens: int, budget: Optional[int] = None, model: str = LLM_MODEL) -> int:
+    """
+    Tokens a prompt may use: the requested budget, capped so the prompt and
+    the reply fit in the model's context window
+    """
+    window = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS) - max_tokens
+    return min(budget, window) if budget is not None else window
+
+def chat_request(instructions: str, content: str, max_tokens: int, temperature: float, operation: str,
+                 model: str = LLM_MODEL) -> Dict[str, Any]:
+    """
+    Chat completion request body with static instructions as the system
+    message and the per-request content as the user message. The prompt's
+    size is recorded per operation.
+    """
+    messages = [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": content}
+    ]
+    PROMPT_TOKENS.observe(count_message_tokens(messages, model), operation=operation)
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from metrics import span
+
+# Number of worker processes for CPU-bound stages, one per CPU by default
+# (0 disables the pool)
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+# Jobs allowed to wait for a free worker before new jobs are rejected
+CPU_POOL_QUEUE_SIZE = int(os.getenv("CPU_POOL_QUEUE_SIZE", "8"))
+
+# Workers kept free of background jobs (uploads processed as jobs, batches)
+# so interactive requests can start right away
+CPU_POOL_RESERVED_WORKERS = int(os.getenv("CPU_POOL_RESERVED_WORKERS", "1" if CPU_POOL_WORKERS > 1 else "0"))
+
+# Seconds a single job may take before the caller gives up on it
+CPU_JOB_TIMEOUT = float(os.getenv("CPU_JOB_TIMEOUT", "120"))
+
+class PoolSaturatedError(Exception):
+    """
+    Raised when every worker is busy and the wait queue is full
+    """
+
+class JobTimeoutError(Exception):
+    """
+    Raised when a job does not finish within CPU_JOB_TIMEOUT
+    """
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+_pending_jobs = 0
+
+def cpu_pool_enabled() -> bool:
+    """
+    Check whether CPU-bound stages should run in the process pool
+    """
+    return CPU_POOL_WORKERS > 0
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Get the shared process pool, creating it on first use
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS)
+        return _executor
+
+def shutdown_executor() -> None:
+    """
+    Stop the process pool, e.g. when the server shuts down
+    """
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+def pending_jobs() -> int:
+    """
+    Jobs running in or waiting for the process pool
+    """
+    return _pending_jobs
+
+def _job_finished(_future) -> None:
+    global _pending_jobs
+    with _lock:
+        _pending_jobs -= 1
+
+def _reserve_slot(limit: int) -> None:
+    global _pending_jobs
+    with _lock:
+        if _pending_jobs >= limit:
+            raise PoolSaturatedError("All document workers are busy, please retry shortly")
+        _pending_jobs += 1
+
+async def run_cpu_bound(func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run a CPU-bound function in the process pool without blocking the event loop.
+
+    A job holds its slot until the worker actually finishes it, so jobs that
+    timed out still count against the queue until their worker is free again.
+    """
+    return await _run_in_pool(CPU_POOL_WORKERS + CPU_POOL_QUEUE_SIZE, func, *args)
+
+async def _run_in_pool(limit: int, func: Callable[..., Any], *args: Any) -> Any:
+    _reserve_slot(limit)
+    try:
+        try:
+            concurrent_future = get_executor().submit(func, *args)
+        except BrokenProcessPool:
+            # A worker died; replace the pool and try once more
+            shutdown_executor()
+            concurrent_future = get_executor().submit(func, *args)
+    except Exception:
+        _job_finished(None)
+        raise
+    concurrent_future.add_done_callback(_job_finished)
+
+    try:
+        # Metrics recorded inside the worker stay in that process, so the
+        # stage is timed here, including any wait for a free worker
+        with span(func.__name__):
+            return await asyncio.wait_for(asyncio.wrap_future(concurrent_future), CPU_JOB_TIMEOUT)
+    except asyncio.TimeoutError:
+        # Drop the job if it has not started yet
+        concurrent_future.cancel()
+        raise JobTimeoutError(f"Processing took longer than {CPU_JOB_TIMEOUT:g} seconds")
+
+async def run_cpu_bound_when_free(func: Callable[..., Any], *args: Any, retry_delay: float = 1.0) -> Any:
+    """
+    Run a CPU-bound function in the process pool once a worker outside the
+    CPU_POOL_RESERVED_WORKERS is free, instead of failing or queueing. Meant
+    for background work: it never takes the reserved workers or a place in
+    the wait queue, so interactive requests are not stuck behind it.
+    """
+    limit = max(1, CPU_POOL_WORKERS - CPU_POOL_RESERVED_WORKERS)
+    while True:
+        try:
+            return await _run_in_pool(limit, func, *args)
+        except PoolSaturatedError:
+            await asyncio.sleep(retry_delay)
@@ -31,6 +31,7 @@ const QuestionsPage = () => {
   const inputRef = useRef(null);
   
   const { 
+    documentId,
     originalText, 
     terms, 
     insuranceType, 
@@ -99,6 +100,7 @@ const QuestionsPage = () => {
     
     await dispatch(askQuestion({
       question: currentQuestion,
+      documentId,
       documentText: originalText,
       insuranceType
     }));
@@ -14,6 +14,8 @@ export const processDocument = createAsyncThunk(
         formData.append('text_content', textContent);
       }
       formData.append('insurance_type', insuranceType);
+      // The UI renders one object per term, so ask for the full term format
+      formData.append('response_format', 'full');
 
       const response = await axios.post('http://localhost:8000/process-document', formData, {
         headers: {
@@ -29,6 +31,7 @@ export const processDocument = createAsyncThunk(
 );
 
 const initialState = {
+  documentId: null,
   originalText: '',
   processedText: '',
   terms: [],
@@ -62,6 +65,7 @@ const documentSlice = createSlice({
       })
       .addCase(processDocument.fulfilled, (state, action) => {
         state.loading = false;
+        state.documentId = action.payload.document_id;
         state.originalText = action.payload.original_text;
         state.terms = action.payload.terms;
         state.insuranceType = action.payload.insurance_type;
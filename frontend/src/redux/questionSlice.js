@@ -4,15 +4,32 @@ import axios from 'axios';
 // Async thunk for asking questions about the document
 export const askQuestion = createAsyncThunk(
   'questions/ask',
-  async ({ question, documentText, insuranceType }, { rejectWithValue }) => {
-    try {
+  async ({ question, documentId, documentText, insuranceType }, { rejectWithValue }) => {
+    const buildFormData = (useDocumentId) => {
       const formData = new FormData();
       formData.append('question', question);
-      formData.append('document_text', documentText);
+      if (useDocumentId) {
+        formData.append('document_id', documentId);
+      } else {
+        formData.append('document_text', documentText);
+      }
       formData.append('insurance_type', insuranceType);
+      return formData;
+    };
 
-      const response = await axios.post('http://localhost:8000/ask-question', formData);
-      return response.data;
+    try {
+      try {
+        // Refer to the processed document by ID so the text isn't re-sent
+        const response = await axios.post('http://localhost:8000/ask-question', buildFormData(Boolean(documentId)));
+        return response.data;
+      } catch (error) {
+        // The server-side session may have expired; fall back to sending the text
+        if (documentId && error.response?.status === 404) {
+          const response = await axios.post('http://localhost:8000/ask-question', buildFormData(false));
+          return response.data;
+        }
+        throw error;
+      }
     } catch (error) {
       return rejectWithValue(error.response?.data || 'Failed to get answer');
     }